@@ -1,8 +1,33 @@
+import asyncio
+import contextlib
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import upload, summary, chatbot
+from app.services import data_store, ingest_jobs, llm, telemetry
 
-app = FastAPI(title="AI-Powered Finance Chatbot (Backend Only)")
+# How often each worker deletes the data of tenants idle for TENANT_TTL_HOURS
+TENANT_PURGE_SECONDS = 3600
+
+async def _purge_idle_tenants():
+    while True:
+        await asyncio.to_thread(data_store.purge_idle_tenants)
+        await asyncio.sleep(TENANT_PURGE_SECONDS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Map the persisted ledger back in before the first request
+    data_store.load_from_disk()
+    purger = asyncio.create_task(_purge_idle_tenants())
+    yield
+    purger.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await purger
+    ingest_jobs.shutdown()
+    await llm.aclose()
+
+app = FastAPI(title="AI-Powered Finance Chatbot (Backend Only)", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -16,6 +41,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so the timings include the other middleware
+app.add_middleware(telemetry.TimingMiddleware)
+
 app.include_router(upload.router, prefix="/upload", tags=["Upload"])
 app.include_router(summary.router, prefix="/summary", tags=["Summary"])
 app.include_router(chatbot.router, prefix="/chatbot", tags=["Chatbot"])
@@ -23,3 +51,8 @@ app.include_router(chatbot.router, prefix="/chatbot", tags=["Chatbot"])
 @app.get("/")
 def root():
     return {"status": "ok", "message": "Finance Chatbot API running 🚀"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Request and stage latency histograms and counters, in the Prometheus text format."""
+    return PlainTextResponse(telemetry.render(), media_type="text/plain; version=0.0.4")
@@ -9,6 +9,25 @@ class UploadResponse(BaseModel):
     message: str
     rows: int
 
+class AppendResponse(UploadResponse):
+    duplicates: int = 0
+
+class StreamUploadResponse(UploadResponse):
+    rejected: int = 0
+
+class IngestJobResponse(BaseModel):
+    job_id: str
+    status: str
+    filename: str
+    progress: float
+    parts_done: int
+    parts_total: int
+    rows: int
+    rejected: int
+    error: Optional[str] = None
+    created_at: float
+    finished_at: Optional[float] = None
+
 class Transaction(BaseModel):
     date: date
     description: str
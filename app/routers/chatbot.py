@@ -1,34 +1,173 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from app.models.schemas import ChatRequest
-from app.services import metrics
-from app.services.llm import ask_llm
+from app.routers.deps import tenant_id
+from app.services import llm, llm_cache, llm_guard, metrics, query_engine, context_builder
+from app.services.telemetry import span
+from app.services.data_store import get_snapshot, Snapshot
+from app.services.llm import generate, generate_stream, LLMError, LLMUnavailable, GEMINI_MODEL, \
+    DEFAULT_MAX_OUTPUT_TOKENS, DEFAULT_TEMPERATURE
+from typing import Any, Dict, List, Optional
+import asyncio
 import json
+import os
+import time
 
 router = APIRouter()
 
-@router.post("/")
-def chatbot(req: ChatRequest):
-    # Build transaction summaries
-    context = {
-        "spending_by_category": metrics.spending_by_category(),
-        "top_merchants": metrics.top_merchants(n=5),
-        "monthly_totals": metrics.monthly_totals(),
-        "fastest_growing_category": metrics.fastest_growing_category(),
-        "top_expenses_week": metrics.latest_week_top_expenses(k=3),
-    }
+# Questions a single /chatbot/batch call may carry, and how many of them are answered at once
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+# The routes are async for the LLM call; reading the snapshot and building the context
+# run pandas, so they go to the thread pool rather than blocking the event loop.
+
+def _build_context(query: str, snap: Snapshot) -> dict:
+    # Only the summaries relevant to the question, all from the same data version
+    return context_builder.build_context(query, snap)
 
+def _build_prompt(context: dict, query: str) -> str:
     # Create a better prompt for LLM
-    prompt = f"""
+    return f"""
     You are a personal finance assistant. 
-    Use the following transaction summary (JSON) to answer the user’s question.
+    Use the following transaction summary to answer the user’s question.
+    Each line is "section: key=value; ...", amounts in currency units, months as YYYY-MM.
 
     Transaction Summary:
-    {json.dumps(context, indent=2)}
+    {context_builder.encode(context)}
 
-    Question: {req.query}
+    Question: {query}
 
     Answer clearly, using the numbers from the data only.
     """
 
-    answer = ask_llm(prompt)
-    return {"answer": answer, "context_used": context}
+def _cache_key(query: str, tenant: str, snap: Snapshot) -> str:
+    return llm_cache.make_key(query, f"{tenant}:{snap.fingerprint}", model=GEMINI_MODEL,
+                              max_output_tokens=DEFAULT_MAX_OUTPUT_TOKENS, temperature=DEFAULT_TEMPERATURE,
+                              context_budget=context_builder.CONTEXT_TOKEN_BUDGET)
+
+def _data_only(context: dict, error: LLMError) -> str:
+    # What we can still say while the LLM is out: the numbers the question needed
+    summary = context_builder.encode(context)
+    return f"{error} Meanwhile, here is the data relevant to your question:\n{summary}" if summary else str(error)
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 2)
+
+async def _answer(query: str, tenant: str, snap: Snapshot,
+                  summaries: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Answer from the data if the query engine can, else from the cache or the LLM.
+    served_by is "local", "cache", "llm", or "data" when the circuit breaker is open
+    and only the relevant numbers can be returned; other LLM failures raise LLMError.
+    """
+    with span("chat.query_engine"):
+        local = await run_in_threadpool(query_engine.answer, query, snap)
+    if local is not None:
+        return {"answer": local.text, "context_used": local.data, "served_by": "local", "intent": local.intent}
+
+    with span("chat.build_context"):
+        context = await run_in_threadpool(context_builder.build_context, query, snap, summaries=summaries)
+    key = _cache_key(query, tenant, snap)
+    answer = llm_cache.answers.get(key)
+    if answer is not None:
+        return {"answer": answer, "context_used": context, "served_by": "cache"}
+    with span("chat.build_prompt"):
+        prompt = _build_prompt(context, query)
+    try:
+        with span("chat.llm"):
+            answer = await generate(prompt)
+    except LLMUnavailable as e:
+        return {"answer": _data_only(context, e), "context_used": context, "served_by": "data"}
+    llm_cache.answers.put(key, answer)
+    return {"answer": answer, "context_used": context, "served_by": "llm"}
+
+@router.post("/")
+async def chatbot(req: ChatRequest, tenant: str = Depends(tenant_id)):
+    started = time.perf_counter()
+    snap = await run_in_threadpool(get_snapshot, tenant)
+    try:
+        result = await _answer(req.query, tenant, snap)
+    except LLMError as e:
+        result = {"answer": str(e), "context_used": await run_in_threadpool(_build_context, req.query, snap),
+                  "served_by": "llm"}
+    result["latency_ms"] = _elapsed_ms(started)
+    return result
+
+@router.post("/batch")
+async def chatbot_batch(reqs: List[ChatRequest], tenant: str = Depends(tenant_id)):
+    """
+    Answer many questions against one data version. The summaries are computed once,
+    up to BATCH_CONCURRENCY questions are answered at a time, and answers come back in
+    question order; a question whose LLM call fails gets "error" instead of an answer.
+    """
+    if len(reqs) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch.")
+    started = time.perf_counter()
+    snap = await run_in_threadpool(get_snapshot, tenant)
+    summaries = await run_in_threadpool(context_builder.overview, snap)
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def one(query: str) -> Dict[str, Any]:
+        async with slots:
+            try:
+                result = await _answer(query, tenant, snap, summaries)
+            except LLMError as e:
+                return {"query": query, "answer": None, "served_by": "llm", "error": str(e)}
+        return {"query": query, "answer": result["answer"], "served_by": result["served_by"], "error": None}
+
+    answers = await asyncio.gather(*(one(req.query) for req in reqs))
+    return {"answers": answers, "failed": sum(a["error"] is not None for a in answers),
+            "latency_ms": _elapsed_ms(started)}
+
+@router.post("/stream")
+async def chatbot_stream(req: ChatRequest, tenant: str = Depends(tenant_id)):
+    """
+    Same as POST /chatbot, but streams the answer as Server-Sent Events:
+    "data: {"text": ...}" per piece, then "event: done" whose data says which path
+    served the answer.
+    """
+    started = time.perf_counter()
+    snap = await run_in_threadpool(get_snapshot, tenant)
+    with span("chat.query_engine"):
+        local = await run_in_threadpool(query_engine.answer, req.query, snap)
+
+    async def events():
+        if local is not None:
+            yield f"data: {json.dumps({'text': local.text})}\n\n"
+            yield f"event: done\ndata: {json.dumps({'served_by': 'local', 'latency_ms': _elapsed_ms(started)})}\n\n"
+            return
+        with span("chat.build_context"):
+            context = await run_in_threadpool(_build_context, req.query, snap)
+        key = _cache_key(req.query, tenant, snap)
+        cached = llm_cache.answers.get(key)
+        served_by = "cache" if cached is not None else "llm"
+        if cached is not None:
+            yield f"data: {json.dumps({'text': cached})}\n\n"
+        else:
+            pieces = []
+            try:
+                async for piece in generate_stream(_build_prompt(context, req.query)):
+                    pieces.append(piece)
+                    yield f"data: {json.dumps({'text': piece})}\n\n"
+                llm_cache.answers.put(key, "".join(pieces).strip())
+            except LLMUnavailable as e:
+                served_by = "data"
+                yield f"data: {json.dumps({'text': _data_only(context, e)})}\n\n"
+            except LLMError as e:
+                yield f"data: {json.dumps({'text': str(e)})}\n\n"
+        yield f"event: done\ndata: {json.dumps({'served_by': served_by, 'latency_ms': _elapsed_ms(started)})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/cache-stats")
+def cache_stats():
+    """Hit/miss counters of the answer cache, for sizing LLM_CACHE_SIZE."""
+    return llm_cache.answers.stats()
+
+@router.get("/llm-stats")
+def llm_stats():
+    """Rate limiter and circuit breaker state of the LLM client, and how many calls were coalesced."""
+    return {**llm_guard.stats(), "coalesced": {"llm": llm.inflight.stats(), "metrics": metrics.inflight.stats()}}
@@ -0,0 +1,26 @@
+from datetime import date
+from typing import Any, Dict, Optional, Tuple
+from fastapi import Header, HTTPException, Query
+from app.services.data_store import DEFAULT_TENANT, TENANT_ID_PATTERN  # type: ignore
+
+
+def tenant_id(x_tenant_id: Optional[str] = Header(None)) -> str:
+    """Tenant the request is scoped to, from the X-Tenant-ID header."""
+    if not x_tenant_id:
+        return DEFAULT_TENANT
+    if not TENANT_ID_PATTERN.match(x_tenant_id):
+        raise HTTPException(status_code=400, detail="Invalid X-Tenant-ID header.")
+    return x_tenant_id
+
+
+def summary_filters(start: Optional[date] = None, end: Optional[date] = None,
+                    category: Optional[str] = None, merchant: Optional[str] = None) -> Dict[str, Any]:
+    """filter_snapshot arguments from the query string: dates are YYYY-MM-DD, both inclusive."""
+    if start is not None and end is not None and start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end.")
+    return {"start": start, "end": end, "category": category, "merchant": merchant}
+
+
+def page(limit: Optional[int] = Query(None, ge=1), offset: int = Query(0, ge=0)) -> Tuple[int, Optional[int]]:
+    """(offset, limit) of the entries to return; no limit returns everything from offset."""
+    return offset, limit
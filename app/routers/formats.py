@@ -0,0 +1,86 @@
+from typing import Any, Dict, Mapping, Optional
+import json
+import numpy as np
+from fastapi import HTTPException, Query, Request, Response
+
+# Response encodings for the summary routes, picked with ?format= or the Accept header:
+# - json: the default shapes ({"Food": 12.5, ...} or one object per day)
+# - columnar: one JSON array per column, e.g. {"category": [...], "amount": [...]},
+#   which pandas.DataFrame() takes as is
+# - arrow: the same columns as an Apache Arrow IPC stream
+# orjson (fast JSON) and pyarrow (Arrow) are optional; without orjson the stdlib
+# encoder is used, without pyarrow Arrow requests get 406.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+FORMATS = ("json", "columnar", "arrow")
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+COLUMNAR_MEDIA_TYPE = "application/vnd.finance.columnar+json"
+
+
+def response_format(request: Request,
+                    format: Optional[str] = Query(None, pattern="^(json|columnar|arrow)$"),
+                    columnar: bool = False) -> str:
+    """Requested encoding: ?format= wins, then ?columnar=true, then the Accept header."""
+    if format is None:
+        accept = request.headers.get("accept", "")
+        if columnar or COLUMNAR_MEDIA_TYPE in accept:
+            format = "columnar"
+        elif ARROW_MEDIA_TYPE in accept:
+            format = "arrow"
+        else:
+            format = "json"
+    if format == "arrow" and pa is None:
+        raise HTTPException(status_code=406, detail="Arrow responses need pyarrow installed on the server.")
+    return format
+
+
+def json_response(content: Any, headers: Optional[Mapping[str, str]] = None) -> Response:
+    """content encoded with orjson when available; numpy arrays are written without a list copy."""
+    if orjson is None:
+        return Response(json.dumps(content, default=_plain), media_type="application/json", headers=headers)
+    body = orjson.dumps(content, default=_plain, option=orjson.OPT_SERIALIZE_NUMPY)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def _plain(value: Any) -> Any:
+    # what orjson / json cannot write natively
+    if isinstance(value, np.ndarray):
+        return _json_column(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _json_column(values: np.ndarray) -> Any:
+    if values.dtype.kind == "M":
+        return np.datetime_as_string(values.astype("datetime64[D]"), unit="D").tolist()
+    if values.dtype.kind in "biuf" and orjson is not None:
+        return values
+    return values.tolist()
+
+
+def columns_json(columns: Mapping[str, np.ndarray]) -> Dict[str, Any]:
+    """columns ready for json_response: dates become YYYY-MM-DD strings."""
+    return {name: _json_column(np.asarray(values)) for name, values in columns.items()}
+
+
+def columns_response(columns: Mapping[str, np.ndarray], format: str,
+                     headers: Optional[Mapping[str, str]] = None) -> Response:
+    """Equal-length columns as columnar JSON or, for format="arrow", one Arrow record batch stream."""
+    if format != "arrow":
+        return json_response(columns_json(columns), headers)
+    table = pa.table({name: pa.array(np.asarray(values)) for name, values in columns.items()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return Response(sink.getvalue().to_pybytes(), media_type=ARROW_MEDIA_TYPE, headers=headers)
@@ -1,33 +1,139 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
+from app.routers.deps import page, summary_filters, tenant_id
+from app.routers.formats import columns_json, columns_response, json_response, response_format
 from app.services import metrics
-import pandas as pd
+from app.services.data_store import filter_snapshot, get_snapshot, Snapshot
+from itertools import islice
+from typing import Any, Dict, Optional, Tuple
+import hashlib
+import numpy as np
 
 router = APIRouter()
 
+# Every route takes start/end/category/merchant (see deps.summary_filters) and the
+# panels are computed over the matching transactions only; list-like results also
+# take limit/offset and report the unpaged size in X-Total-Count. The encoding is
+# negotiated by formats.response_format.
+
+def _view(tenant: str, filters: Dict[str, Any]) -> Snapshot:
+    return filter_snapshot(get_snapshot(tenant), **filters)
+
+def _paged(items: Dict[str, Any], paging: Tuple[int, Optional[int]], response: Response) -> Dict[str, Any]:
+    offset, limit = paging
+    response.headers["X-Total-Count"] = str(len(items))
+    if offset == 0 and limit is None:
+        return items
+    return dict(islice(items.items(), offset, None if limit is None else offset + limit))
+
+def _columns(items: Dict[str, float], key: str) -> Dict[str, np.ndarray]:
+    return {key: np.array(list(items), dtype=str), "amount": np.fromiter(items.values(), dtype=float, count=len(items))}
+
+def _encoded(items: Dict[str, float], key: str, format: str, response: Response):
+    # json: returned as is for FastAPI to encode; otherwise one array per column
+    if format == "json":
+        return items
+    return columns_response(_columns(items, key), format, headers={"X-Total-Count": response.headers["X-Total-Count"]})
+
+def _daily_columns(snap: Snapshot, paging: Tuple[int, Optional[int]] = (0, None)) -> Dict[str, np.ndarray]:
+    offset, limit = paging
+    by_day = snap.by_day.iloc[offset:None if limit is None else offset + limit]
+    return {"date": by_day.index.to_numpy().astype("datetime64[D]"), "amount": by_day.to_numpy()}
+
+def _daily_records(columns: Dict[str, np.ndarray]):
+    # [{"date": "YYYY-MM-DD", "amount": ...}]
+    dates = np.datetime_as_string(columns["date"], unit="D").tolist()
+    return [{"date": d, "amount": a} for d, a in zip(dates, columns["amount"].tolist())]
+
 @router.get("/by-category")
-def by_category():
-    return metrics.spending_by_category()
+def by_category(response: Response, filters: dict = Depends(summary_filters), paging: tuple = Depends(page),
+                format: str = Depends(response_format), tenant: str = Depends(tenant_id)):
+    items = _paged(metrics.spending_by_category(snapshot=_view(tenant, filters)), paging, response)
+    return _encoded(items, "category", format, response)
 
 @router.get("/top-merchants")
-def top_merchants(n: int = 5):
-    return metrics.top_merchants(n=n)
+def top_merchants(response: Response, n: int = 5, filters: dict = Depends(summary_filters),
+                  paging: tuple = Depends(page), format: str = Depends(response_format),
+                  tenant: str = Depends(tenant_id)):
+    items = _paged(metrics.top_merchants(n=n, snapshot=_view(tenant, filters)), paging, response)
+    return _encoded(items, "merchant", format, response)
 
 @router.get("/monthly-totals")
-def monthly():
-    return metrics.monthly_totals()
+def monthly(response: Response, filters: dict = Depends(summary_filters), paging: tuple = Depends(page),
+            format: str = Depends(response_format), tenant: str = Depends(tenant_id)):
+    items = _paged(metrics.monthly_totals(snapshot=_view(tenant, filters)), paging, response)
+    return _encoded(items, "month", format, response)
 
 
 @router.get("/top-expenses-week")
-def top_expenses_week(k: int = 3):
-    return metrics.latest_week_top_expenses(k=k)
+def top_expenses_week(response: Response, k: int = 3, filters: dict = Depends(summary_filters),
+                      paging: tuple = Depends(page), format: str = Depends(response_format),
+                      tenant: str = Depends(tenant_id)):
+    items = _paged(metrics.latest_week_top_expenses(k=k, snapshot=_view(tenant, filters)), paging, response)
+    return _encoded(items, "expense", format, response)
 
 @router.get("/daily-totals")
-async def daily_totals():
-    from app.services.data_store import get_transactions
-    df = get_transactions()
-    if df.empty:
-        return []
-    df["date"] = pd.to_datetime(df["date"]).dt.date # type: ignore
-    summary = df.groupby("date")["amount"].sum().reset_index()
-    return summary.to_dict(orient="records")
+def daily_totals(filters: dict = Depends(summary_filters), paging: tuple = Depends(page),
+                 format: str = Depends(response_format), tenant: str = Depends(tenant_id)):
+    snap = _view(tenant, filters)
+    columns = _daily_columns(snap, paging)
+    headers = {"X-Total-Count": str(len(snap.by_day))}
+    if format != "json":
+        return columns_response(columns, format, headers)
+    # already plain str/float lists: skip FastAPI's per-item encoding pass
+    return JSONResponse(_daily_records(columns), headers=headers)
+
+@router.get("/rollup")
+def rollup(grain: str = Query("month", pattern="^(day|week|month)$"),
+           by: str = Query("category", pattern="^(category|merchant)$"),
+           filters: dict = Depends(summary_filters), paging: tuple = Depends(page),
+           format: str = Depends(response_format), tenant: str = Depends(tenant_id)):
+    """
+    Spend per period (day, week from Monday, or month; named by its first day) and
+    per category or merchant, oldest period first, from the pre-aggregated cube.
+    """
+    columns = metrics.spend_rollup(grain=grain, by=by, snapshot=get_snapshot(tenant), **filters)
+    offset, limit = paging
+    headers = {"X-Total-Count": str(len(columns["amount"]))}
+    columns = {name: values[offset:None if limit is None else offset + limit] for name, values in columns.items()}
+    if format != "json":
+        return columns_response(columns, format, headers)
+    # [{"period": "YYYY-MM-DD", "category": ..., "amount": ...}]
+    periods = np.datetime_as_string(columns["period"], unit="D").tolist()
+    return JSONResponse([{"period": p, by: label, "amount": a}
+                         for p, label, a in zip(periods, columns[by].tolist(), columns["amount"].tolist())],
+                        headers=headers)
 
+@router.get("/dashboard")
+def dashboard(request: Request, n: int = 5, k: int = 3, filters: dict = Depends(summary_filters),
+              format: str = Depends(response_format), tenant: str = Depends(tenant_id)):
+    """
+    Every panel of the UI from one snapshot. The ETag changes only when the data
+    (or n/k, or the filters) does; send it back in If-None-Match to get an empty 304 instead.
+    With format=columnar every panel is a dict of columns.
+    """
+    if format == "arrow":
+        raise HTTPException(status_code=406, detail="The dashboard has several tables; use format=columnar, "
+                                                    "or request the panels one by one as Arrow.")
+    snap = get_snapshot(tenant)
+    scope = ":".join(str(filters[f] or "") for f in ("start", "end", "category", "merchant"))
+    etag = '"' + hashlib.sha1(f"{tenant}:{snap.fingerprint}:{n}:{k}:{format}:{scope}".encode()).hexdigest()[:20] + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    snap = filter_snapshot(snap, **filters)
+    panels = {
+        "by_category": metrics.spending_by_category(snapshot=snap),
+        "monthly_totals": metrics.monthly_totals(snapshot=snap),
+        "top_merchants": metrics.top_merchants(n=n, snapshot=snap),
+        "top_expenses_week": metrics.latest_week_top_expenses(k=k, snapshot=snap),
+    }
+    daily = _daily_columns(snap)
+    if format == "columnar":
+        keys = {"by_category": "category", "monthly_totals": "month", "top_merchants": "merchant",
+                "top_expenses_week": "expense"}
+        panels = {name: columns_json(_columns(items, keys[name])) for name, items in panels.items()}
+        panels["daily_totals"] = columns_json(daily)
+        return json_response(panels, headers)
+    panels["daily_totals"] = _daily_records(daily)
+    return JSONResponse(panels, headers=headers)
@@ -1,24 +1,74 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
 import pandas as pd
-from app.services.data_store import save_transactions  # type: ignore
-from app.models.schemas import UploadResponse
+from app.routers.deps import tenant_id
+from typing import Optional
+from app.services import ingest_jobs, parsers
+from app.services.data_store import (  # type: ignore
+    append_transactions, ingest_chunks, DEDUPE_KEY, INGEST_CHUNK_ROWS,
+)
+from app.models.schemas import AppendResponse, IngestJobResponse, StreamUploadResponse
 
 router = APIRouter()
 
-@router.post("/", response_model=UploadResponse)
-async def upload_file(file: UploadFile = File(...)):
+# The synchronous routes below are plain def: FastAPI runs them in its thread pool,
+# so parsing a file never blocks the event loop.
+
+def _read_upload(file: UploadFile, profile: Optional[str] = None) -> pd.DataFrame:
+    return parsers.parse(file.file, file.filename, profile=profile)
+
+@router.post("/", response_model=IngestJobResponse, status_code=202)
+async def upload_file(response: Response, file: UploadFile = File(...), profile: Optional[str] = None,
+                      tenant: str = Depends(tenant_id)):
+    """
+    Replace the data with the file in the background. Returns the job at once;
+    poll /upload/jobs/{job_id} until its status is done or failed. profile names
+    the bank export layout (see parsers); by default it is detected from the header.
+    """
+    try:
+        ingest_jobs.check(file.filename, profile)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    # copied to a file the parser processes read their pieces from, never whole into memory
+    path = await run_in_threadpool(ingest_jobs.spool, file.file)
+    job = ingest_jobs.submit(path, file.filename, tenant=tenant, profile=profile)
+    response.headers["Location"] = f"/upload/jobs/{job.id}"
+    return job.to_dict()
+
+@router.get("/jobs/{job_id}", response_model=IngestJobResponse)
+async def upload_job(job_id: str, tenant: str = Depends(tenant_id)):
+    job = ingest_jobs.get(job_id, tenant=tenant)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown upload job.")
+    return job.to_dict()
+
+@router.post("/append", response_model=AppendResponse)
+def append_file(file: UploadFile = File(...), dedupe_on: str = ",".join(DEDUPE_KEY),
+                profile: Optional[str] = None, tenant: str = Depends(tenant_id)):
+    """Add the file's rows to the existing data; pass dedupe_on="" to keep duplicates."""
     try:
-        filename = file.filename.lower()
+        df = _read_upload(file, profile)
+        key = [c for c in dedupe_on.split(",") if c.strip()]
+        added, skipped = append_transactions(df, dedupe_on=key, tenant=tenant)
+        return AppendResponse(message="File appended successfully", rows=added, duplicates=skipped)
 
-        if filename.endswith(".csv"):
-            df = pd.read_csv(file.file)
-        elif filename.endswith((".xls", ".xlsx")):
-            df = pd.read_excel(file.file)
-        else:
-            raise ValueError("Unsupported file format. Please upload a CSV or Excel file.")
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to process file: {e}")
+
+@router.post("/stream", response_model=StreamUploadResponse)
+def upload_stream(file: UploadFile = File(...),
+                  chunk_rows: int = Query(INGEST_CHUNK_ROWS, ge=1),
+                  profile: Optional[str] = None,
+                  tenant: str = Depends(tenant_id)):
+    """Replace the data with a CSV read chunk_rows rows at a time (for very large exports)."""
+    try:
+        if not file.filename.lower().endswith(".csv"):
+            raise ValueError("Streaming upload supports CSV files only.")
 
-        rows = save_transactions(df)
-        return UploadResponse(message="File uploaded successfully", rows=rows)
+        accepted, rejected = ingest_chunks(parsers.iter_csv(file.file, chunk_rows, profile=profile), tenant=tenant)
+        return StreamUploadResponse(message="File uploaded successfully", rows=accepted, rejected=rejected)
 
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
@@ -0,0 +1,181 @@
+import os
+import re
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from app.services import metrics
+from app.services.data_store import Snapshot, AMOUNT_SCALE  # type: ignore
+from app.services.query_engine import parse_period
+from app.services.search_index import tokenize
+
+# Picks the metrics relevant to a question, trims them to the period it asks about
+# and encodes them compactly, so the prompt stays within CONTEXT_TOKEN_BUDGET no
+# matter how much history the tenant has uploaded.
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "600"))
+DEFAULT_MONTHS = int(os.getenv("CONTEXT_DEFAULT_MONTHS", "6"))
+# Individual transactions matching the question that are added to the context
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "10"))
+
+_TOPICS = {
+    "spending_by_category": re.compile(r"\b(categor(y|ies)|on what|where|breakdown|split|most)\b"),
+    "top_merchants": re.compile(r"\b(merchants?|stores?|shops?|vendors?|payees?|where|who)\b"),
+    "monthly_totals": re.compile(r"\b(months?|monthly|trend|over time|history|year|compare|increase|decrease)\b"),
+    "fastest_growing_category": re.compile(r"\b(grow\w*|rising|increas\w*|trend\w*|faster|jump\w*)\b"),
+    "top_expenses_week": re.compile(r"\b(week\w*|recent\w*|lately|biggest|largest|expensive|purchases?)\b"),
+}
+# Dropped last-first when the budget is exceeded
+_PRIORITY = ["transactions", "spending_by_category", "category_months", "monthly_totals", "top_merchants",
+             "fastest_growing_category", "top_expenses_week"]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English and numbers)."""
+    return (len(text) + 3) // 4
+
+
+def _fmt(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.2f}".rstrip("0").rstrip(".")
+    return str(value)
+
+
+def encode(context: Dict[str, Dict[str, Any]]) -> str:
+    """One line per section: "name: key=value; key=value"."""
+    return "\n".join(f"{name}: " + "; ".join(f"{k}={_fmt(v)}" for k, v in section.items())
+                     for name, section in context.items() if section)
+
+
+_STOPWORDS = {"a", "an", "and", "are", "did", "do", "does", "for", "from", "how", "i", "in", "is", "last",
+              "me", "much", "my", "of", "on", "or", "over", "show", "than", "that", "the", "this", "to",
+              "under", "was", "were", "what", "when", "where", "which", "with", "all", "any", "pay",
+              "paid", "spend", "spent", "time", "times", "more", "less", "above", "below"}
+_OVER = re.compile(r"\b(?:over|above|more than|greater than|at least)\s*\$?(\d+(?:\.\d+)?)")
+_UNDER = re.compile(r"\b(?:under|below|less than|at most)\s*\$?(\d+(?:\.\d+)?)")
+_NUMERIC = re.compile(r"\$\d+(?:\.\d+)?|\b(?:19|20)\d\d\b|\b\d+ days\b")
+
+
+def related_transactions(query: str, snap: Snapshot, k: int = RETRIEVAL_TOP_K) -> Dict[str, float]:
+    """
+    Up to k transactions whose description or category matches words of query, best
+    match first and newest first among equals, honouring a period and "over/under $N"
+    in the question. Keyed "YYYY-MM-DD description (category)", amounts in currency units.
+    """
+    if snap.index is None or snap.transactions.empty or k <= 0:
+        return {}
+    q = query.lower()
+    # amounts, years and day counts are filters, not words to look up
+    text = _NUMERIC.sub(" ", _UNDER.sub(" ", _OVER.sub(" ", q)))
+    words = [w for w in tokenize(text) if w not in _STOPWORDS]
+    df = snap.transactions
+    start, end, _ = parse_period(q, snap.by_day.index.max())
+    first_day = last_day = None
+    if start is not None:
+        first_day, last_day = (int(d.to_datetime64().astype("datetime64[D]").astype(np.int64)) for d in (start, end))
+    over, under = _OVER.search(q), _UNDER.search(q)
+    keep: Optional[Callable[[np.ndarray], np.ndarray]] = None
+    if over or under:
+        low = float(over.group(1)) * AMOUNT_SCALE if over else -np.inf
+        high = float(under.group(1)) * AMOUNT_SCALE if under else np.inf
+        amounts = df["amount"].to_numpy()
+
+        def in_range(rows: np.ndarray) -> np.ndarray:
+            size = np.abs(amounts[rows])
+            return (size > low) & (size < high)
+        keep = in_range
+
+    rows = snap.index.search(words, k, first_day, last_day, keep)
+    out: Dict[str, float] = {}
+    picked = df.take(rows)  # only k rows; never materialize the whole categorical columns
+    for date, desc, cat, value in zip(picked["date"], picked["description"], picked["category"], picked["amount"]):
+        key = base = f"{str(date)[:10]} {desc} ({cat})"
+        n = 2
+        while key in out:  # same merchant twice on one day
+            key, n = f"{base} #{n}", n + 1
+        out[key] = round(float(value) / AMOUNT_SCALE, 2)
+    return out
+
+
+def _months_window(snap: Snapshot, query: str) -> Tuple[List[str], str]:
+    """Months relevant to query: the named period plus the month before it, else the latest few."""
+    months = list(snap.by_month.index)
+    start, end, _ = parse_period(query.lower(), snap.spend["date"].iloc[-1])
+    if start is None:
+        return months[-DEFAULT_MONTHS:], ""
+    first = (start.to_period("M") - 1).strftime("%Y-%m")
+    last = end.to_period("M").strftime("%Y-%m")
+    return [m for m in months if first <= m <= last], f"{first}..{last}"
+
+
+def overview(snap: Snapshot) -> Dict[str, Dict[str, Any]]:
+    """All the summaries build_context picks from, for callers answering many questions at once."""
+    return {
+        "spending_by_category": metrics.spending_by_category(snapshot=snap),
+        "top_merchants": metrics.top_merchants(n=5, snapshot=snap),
+        "monthly_totals": metrics.monthly_totals(snapshot=snap),
+        "fastest_growing_category": metrics.fastest_growing_category(snapshot=snap),
+        "top_expenses_week": metrics.latest_week_top_expenses(k=3, snapshot=snap),
+    }
+
+
+def build_context(query: str, snap: Snapshot, budget: int = CONTEXT_TOKEN_BUDGET,
+                  summaries: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Metrics relevant to query, trimmed until their encoding fits in budget tokens.
+    summaries is overview(snap), if the caller already has it.
+    """
+    if snap.empty:
+        return {}
+    if summaries is None:
+        summaries = {}
+    q = query.lower()
+    wanted = {name for name, pattern in _TOPICS.items() if pattern.search(q)}
+    months, window = _months_window(snap, q)
+    named = [c for c in snap.by_category.index if re.search(rf"(?<!\w){re.escape(str(c).lower())}(?!\w)", q)]
+    related = related_transactions(query, snap)
+    if not wanted and not window and not named and not related:
+        wanted = set(_TOPICS)  # nothing specific asked: give the overview
+
+    context: Dict[str, Dict[str, Any]] = {}
+    if related:
+        context["transactions"] = related
+    if "spending_by_category" in wanted or not (named or related):
+        context["spending_by_category"] = summaries.get("spending_by_category") \
+            or metrics.spending_by_category(snapshot=snap)
+    if named:
+        # month-by-month spend of the categories the question names
+        per_month = snap.by_category_month.loc[named]
+        context["category_months"] = {f"{c}@{m}": round(float(v), 2) for (c, m), v in per_month.items()
+                                      if m in months}
+    if "monthly_totals" in wanted or window:
+        totals = summaries.get("monthly_totals") or metrics.monthly_totals(snapshot=snap)
+        context["monthly_totals"] = {m: totals[m] for m in months}
+    if "top_merchants" in wanted:
+        context["top_merchants"] = summaries.get("top_merchants") or metrics.top_merchants(n=5, snapshot=snap)
+    if "fastest_growing_category" in wanted:
+        context["fastest_growing_category"] = summaries.get("fastest_growing_category") \
+            or metrics.fastest_growing_category(snapshot=snap)
+    if "top_expenses_week" in wanted:
+        context["top_expenses_week"] = summaries.get("top_expenses_week") \
+            or metrics.latest_week_top_expenses(k=3, snapshot=snap)
+    return fit_budget(context, budget)
+
+
+def fit_budget(context: Dict[str, Dict[str, Any]], budget: int) -> Dict[str, Dict[str, Any]]:
+    """Shrink the longest section (oldest / smallest entries first) until encode(context) fits."""
+    context = {name: dict(section) for name, section in context.items() if section}
+    while context and estimate_tokens(encode(context)) > budget:
+        name = max(context, key=lambda n: (len(context[n]), -_PRIORITY.index(n) if n in _PRIORITY else 0))
+        section = context[name]
+        if len(section) <= 1:
+            # only single-entry sections left: drop the least important one
+            del context[max(context, key=lambda n: _PRIORITY.index(n) if n in _PRIORITY else len(_PRIORITY))]
+            continue
+        if name in ("monthly_totals", "category_months"):
+            section.pop(next(iter(section)))  # oldest month
+        elif name == "transactions":
+            section.popitem()  # weakest match
+        elif all(isinstance(v, (int, float)) for v in section.values()):
+            section.pop(min(section, key=section.get))
+        else:
+            del context[name]  # a record, not a ranking: keep it whole or not at all
+    return context
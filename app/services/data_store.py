@@ -1,39 +1,851 @@
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import threading
+import numpy as np
 import pandas as pd
-from typing import Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, fields, replace
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from app.services import rollup
+from app.services.search_index import TransactionIndex
+from app.services.telemetry import rows_ingested, timed
 
-# In-memory DataFrame
-_df: Optional[pd.DataFrame] = None
+try:
+    import fcntl
+except ImportError:  # not on Windows: writers then exclude each other within one process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
 
 REQUIRED_COLUMNS = ["date", "description", "amount", "category"]
 
-def reset():
-    global _df
-    _df = None
+# Columns that identify the same transaction across appended batches
+DEDUPE_KEY = ["date", "description", "amount"]
+
+# Rows parsed per chunk by streaming ingestion; bounds the transient memory of an upload
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "100000"))
+
+# Compact layout: description/category as categoricals, amount as int64 cents and
+# day-precision dates. Set COMPACT_STORAGE=0 for the plain object/float64 layout.
+COMPACT_STORAGE = os.getenv("COMPACT_STORAGE", "1") != "0"
+
+# Stored "amount" units per currency unit
+AMOUNT_SCALE = 100 if COMPACT_STORAGE else 1
+
+# Directory the normalized columns are persisted to and memory-mapped back from on
+# startup. Every worker on the host shares it; set DATA_STORE_DIR="" to stay in memory.
+DATA_STORE_DIR = os.getenv("DATA_STORE_DIR", ".finance_data")
+
+# Tenant used when the caller does not identify itself
+DEFAULT_TENANT = "default"
+
+# Memory the in-process tenant data may use before least recently used tenants are
+# spilled (dropped from memory; they are mapped back from DATA_STORE_DIR on next use)
+TENANT_MEMORY_BUDGET_MB = int(os.getenv("TENANT_MEMORY_BUDGET_MB", "1024"))
+
+# Tenants (other than DEFAULT_TENANT) whose data has not been read or written for this
+# many hours are deleted from DATA_STORE_DIR by purge_idle_tenants; 0 keeps them all
+TENANT_TTL_HOURS = float(os.getenv("TENANT_TTL_HOURS", "168"))
+
+TENANT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    Immutable view of one tenant's data, built once per upload and swapped in whole,
+    so a reader holding it sees one consistent version for the entire request:
+    - transactions: the stored (normalized) rows, oldest first
+    - spend: rows with a valid date and a positive amount, plus a "month" column,
+      oldest first (see date_slice)
+    - by_category / by_merchant: spend totals, largest first
+    - by_month: spend totals per "YYYY-MM", oldest first
+    - by_category_month: spend totals keyed by (category, month)
+    - by_day: net totals (refunds included) per calendar day
+    - index: word index over the description/category of transactions
+    - cube: spend and net amounts per day / week / month x category x merchant
+      (see rollup.py), which filtered views are answered from
+    Rollups are in currency units; spend keeps the stored amount (see AMOUNT_SCALE).
+    Views made by filter_snapshot have neither index nor cube.
+    """
+    version: int
+    transactions: pd.DataFrame
+    spend: pd.DataFrame
+    by_category: pd.Series
+    by_merchant: pd.Series
+    by_month: pd.Series
+    by_category_month: pd.Series
+    by_day: pd.Series
+    index: Optional[TransactionIndex] = None
+    cube: Optional[rollup.Cube] = None
+
+    @property
+    def empty(self) -> bool:
+        return self.spend.empty
+
+    @property
+    def fingerprint(self) -> str:
+        """Identifies this data version; also changes if versions restart with different data."""
+        return f"{self.version}-{len(self.transactions)}-{float(self.by_day.sum()):.2f}"
+
+
+class _Tenant:
+    """
+    Everything the store holds for one tenant. Readers only ever take the current
+    snapshot reference; writers hold lock while they build and publish a new one.
+    """
+
+    def __init__(self, tenant_id: str):
+        self.id = tenant_id
+        self.lock = threading.Lock()
+        self.snapshot = _build_snapshot(_empty_frame(), 0)
+        self.nbytes = 0
+        # Sorted row-key hashes of the stored rows for the key in seen_key_cols, built on first append
+        self.seen_keys: Optional[np.ndarray] = None
+        self.seen_key_cols: Tuple[str, ...] = ()
+        # (mtime_ns, inode) of the manifest this process last loaded or wrote
+        self.disk_stamp: Any = "unchecked"
+        # True while the in-memory data has not been written to disk
+        self.dirty = False
+        # Set once the tenant has been spilled or purged; writers then look it up again
+        self.evicted = False
+        # When this process last marked the tenant's directory as used (time.time())
+        self.touched = 0.0
+
+    @property
+    def version(self) -> int:
+        return self.snapshot.version
+
+    @property
+    def dir(self) -> str:
+        return os.path.join(DATA_STORE_DIR, self.id)
+
+
+_MANIFEST = "manifest.json"
+# Held (flock) by the writer of a tenant, in whichever worker process it runs
+_LOCK_FILE = ".lock"
+# Its mtime is when any worker last read the tenant's data (at most a minute off)
+_USED_FILE = ".used"
+_TOUCH_SECONDS = 60
+
+# In-memory tenants, least recently used first
+_tenants: "OrderedDict[str, _Tenant]" = OrderedDict()
+_tenants_lock = threading.Lock()
+
+
+def _tenant(tenant_id: str) -> _Tenant:
+    if not TENANT_ID_PATTERN.match(tenant_id):
+        raise ValueError("Tenant id must be 1-64 letters, digits, '.', '_' or '-'.")
+    with _tenants_lock:
+        t = _tenants.get(tenant_id)
+        if t is None:
+            t = _tenants[tenant_id] = _Tenant(tenant_id)
+        _tenants.move_to_end(tenant_id)
+    return t
+
+
+@contextmanager
+def _writing(tenant_id: str) -> Iterator[_Tenant]:
+    """
+    Hold the tenant's writer lock, and with DATA_STORE_DIR its lock file, so that a
+    writer in another worker process waits as well; readers are never blocked by it.
+    A writer building on the current data must _sync once it holds the lock.
+    """
+    while True:
+        t = _tenant(tenant_id)
+        with t.lock:
+            if t.evicted:
+                continue
+            with _file_lock(t):
+                yield t
+            return
+
+
+@contextmanager
+def _file_lock(t: _Tenant) -> Iterator[None]:
+    if not DATA_STORE_DIR or fcntl is None:
+        yield
+        return
+    path = os.path.join(t.dir, _LOCK_FILE)
+    while True:
+        try:
+            os.makedirs(t.dir, exist_ok=True)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            logger.warning("Could not lock tenant %s for writing: %s", t.id, e)
+            yield
+            return
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                break
+        except OSError:
+            pass
+        os.close(fd)  # the directory was purged while we waited: lock the new file
+    try:
+        yield
+    finally:
+        os.close(fd)  # releases the lock
+
+
+def _publish(t: _Tenant, snapshot: Snapshot):
+    # A single reference assignment: readers see either the old or the new snapshot
+    t.snapshot = snapshot
+    t.nbytes = int(snapshot.transactions.memory_usage(index=False).sum()
+                   + snapshot.spend.memory_usage(index=False).sum()
+                   + (snapshot.index.nbytes if snapshot.index is not None else 0)
+                   + (snapshot.cube.nbytes if snapshot.cube is not None else 0))
+
+
+def _enforce_budget():
+    """Spill least recently used tenants until resident data fits TENANT_MEMORY_BUDGET_MB."""
+    if not DATA_STORE_DIR:
+        return  # nowhere to spill to
+    budget = TENANT_MEMORY_BUDGET_MB * 1024 * 1024
+    with _tenants_lock:
+        total = sum(t.nbytes for t in _tenants.values())
+        for tenant_id in list(_tenants)[:-1]:  # never the most recently used
+            if total <= budget:
+                break
+            t = _tenants[tenant_id]
+            if t.dirty or not t.lock.acquire(blocking=False):
+                continue  # unsaved, or a writer is busy with it
+            try:
+                t.evicted = True
+                del _tenants[tenant_id]
+                total -= t.nbytes
+            finally:
+                t.lock.release()
+
+
+def _rollup(amount: pd.Series, by) -> pd.Series:
+    # observed=True groups categoricals on their integer codes and skips unused categories
+    s = amount.groupby(by, observed=True).sum() / AMOUNT_SCALE
+    if isinstance(s.index, pd.MultiIndex):
+        s.index = pd.MultiIndex.from_arrays(
+            [s.index.get_level_values(i).astype(object) for i in range(s.index.nlevels)],
+            names=s.index.names)
+    elif isinstance(s.index, pd.CategoricalIndex):
+        s.index = s.index.astype(object)
+    return s
+
+
+def _daily(df: pd.DataFrame) -> pd.Series:
+    """Net amount per calendar day that has transactions: a bincount over day ordinals."""
+    days = df["date"].to_numpy().astype("datetime64[D]").astype(np.int64)
+    if len(days) == 0:
+        return pd.Series([], index=pd.DatetimeIndex([], name="date"), dtype=float, name="amount")
+    first = days.min()
+    offsets = days - first
+    totals = np.bincount(offsets, weights=df["amount"].to_numpy(dtype=np.float64))
+    present = np.flatnonzero(np.bincount(offsets))
+    index = pd.DatetimeIndex((present + first).astype("datetime64[D]").astype("datetime64[s]"), name="date")
+    return pd.Series(totals[present] / AMOUNT_SCALE, index=index, name="amount")
+
+
+def _by_date(frame: pd.DataFrame) -> pd.DataFrame:
+    """frame ordered by date (stable, so rows of one day keep their upload order)."""
+    if frame["date"].is_monotonic_increasing:
+        return frame
+    return frame.sort_values("date", kind="stable", ignore_index=True)
+
+
+def _append_by_date(frame: pd.DataFrame, batch: pd.DataFrame) -> pd.DataFrame:
+    """
+    frame (in date order) with batch added, in date order. Only the rows of frame
+    dated after batch's first day are sorted again; a batch no older than frame's
+    last row is just appended.
+    """
+    batch = _by_date(batch)
+    if not len(batch) or not len(frame):
+        return _concat([frame, batch])
+    dates = frame["date"].to_numpy()
+    first = batch["date"].to_numpy()[:1].astype(dates.dtype)
+    cut = int(np.searchsorted(dates, first, "right")[0])
+    if cut == len(frame):
+        return _concat([frame, batch])
+    # stable: within a day, the stored rows stay ahead of the batch's
+    return _concat([frame.iloc[:cut], _by_date(_concat([frame.iloc[cut:], batch]))])
+
+
+def _build_snapshot(df: pd.DataFrame, version: int, indexed: bool = True) -> Snapshot:
+    """indexed=False skips the search index, for batches that are merged into another snapshot."""
+    df = _by_date(df)
+    spend = df[df["amount"] > 0]
+    spend = spend.assign(month=spend["date"].dt.to_period("M"))
+    amount = spend["amount"]
+    by_month = _rollup(amount, spend["month"]).sort_index()
+    by_month.index = by_month.index.astype(str)
+    by_category_month = _rollup(amount, [spend["category"], spend["month"].astype(str)])
+    return Snapshot(
+        version=version,
+        transactions=df,
+        spend=spend,
+        by_category=_rollup(amount, spend["category"]).sort_values(ascending=False),
+        by_merchant=_rollup(amount, spend["description"]).sort_values(ascending=False),
+        by_month=by_month,
+        by_category_month=by_category_month,
+        by_day=_daily(df),
+        index=TransactionIndex(df) if indexed else None,
+        cube=rollup.build(df, AMOUNT_SCALE),
+    )
+
+
+def _merge_snapshot(snap: Snapshot, delta: Snapshot, version: int, transactions: Optional[pd.DataFrame] = None,
+                    spend: Optional[pd.DataFrame] = None) -> Snapshot:
+    """
+    Fold the rollups of a batch snapshot into an existing one without rescanning
+    history. transactions and spend default to both snapshots' frames combined in
+    date order. The search index is built on its first search, not here.
+    """
+    def add(a: pd.Series, b: pd.Series) -> pd.Series:
+        return a.add(b, fill_value=0)
+
+    if transactions is None:
+        transactions = _append_by_date(snap.transactions, delta.transactions)
+    if spend is None:
+        spend = _append_by_date(snap.spend, delta.spend)
+    return Snapshot(
+        version=version,
+        transactions=transactions,
+        spend=spend,
+        by_category=add(snap.by_category, delta.by_category).sort_values(ascending=False),
+        by_merchant=add(snap.by_merchant, delta.by_merchant).sort_values(ascending=False),
+        by_month=add(snap.by_month, delta.by_month).sort_index(),
+        by_category_month=add(snap.by_category_month, delta.by_category_month),
+        by_day=add(snap.by_day, delta.by_day).sort_index(),
+        index=TransactionIndex(transactions, lazy=True),
+        # the cubes merge from their cells, without the rows
+        cube=(snap.cube.merge(delta.cube) if snap.cube is not None and delta.cube is not None
+              else rollup.build(transactions, AMOUNT_SCALE)),
+    )
+
+
+def _empty_frame() -> pd.DataFrame:
+    return _encode(pd.DataFrame({
+        "date": pd.Series(dtype="datetime64[ns]"),
+        "description": pd.Series(dtype=object),
+        "amount": pd.Series(dtype=float),
+        "category": pd.Series(dtype=object),
+    }))
+
+
+def _concat(frames: Sequence[pd.DataFrame]) -> pd.DataFrame:
+    """pd.concat that keeps categorical columns categorical when their categories differ."""
+    frames = [f for f in frames if len(f)] or list(frames[:1])
+    out = pd.concat(frames, ignore_index=True)
+    for col, dtype in frames[0].dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype) and not isinstance(out[col].dtype, pd.CategoricalDtype):
+            try:
+                out[col] = pd.api.types.union_categoricals([f[col] for f in frames])
+            except TypeError:
+                # categories of different dtypes (e.g. numbers in one file, text in another)
+                out[col] = out[col].astype("category")
+    return out
+
+
+def reset(tenant: str = DEFAULT_TENANT):
+    with _writing(tenant) as t:
+        t.seen_keys = None
+        _publish(t, _build_snapshot(_empty_frame(), _next_version(t)))
+        _persist(t)
+
+
+# ---------------------------------------------------------------------------
+# On-disk persistence: one .npy file per column, memory-mapped when loaded
+# ---------------------------------------------------------------------------
+
+def _write_frame(path: str, prefix: str, frame: pd.DataFrame) -> list:
+    """Save each column of frame under path; returns the metadata _read_frame needs."""
+    meta = []
+    for i, (col, s) in enumerate(frame.items()):
+        name = f"{prefix}{i}"
+        item: Dict[str, Any] = {"name": col, "file": name, "dtype": str(s.dtype)}
+        if isinstance(s.dtype, pd.PeriodDtype):
+            item["kind"] = "period"
+            values = s.array.asi8
+        elif pd.api.types.is_datetime64_dtype(s.dtype):
+            item["kind"] = "datetime"
+            values = s.to_numpy().view("int64")
+        elif isinstance(s.dtype, np.dtype) and s.dtype.kind in "biuf":
+            item["kind"] = "array"
+            values = s.to_numpy()
+        else:
+            # text and anything else is dictionary-encoded
+            cat = s.array if isinstance(s.dtype, pd.CategoricalDtype) else pd.Categorical(s)
+            item["kind"] = "category"
+            item["categories"] = json.loads(json.dumps(cat.categories.tolist(), default=str))
+            values = cat.codes
+        np.save(os.path.join(path, name + ".npy"), values)
+        meta.append(item)
+    return meta
+
+
+def _read_frame(path: str, meta: list) -> pd.DataFrame:
+    """Rebuild a frame written by _write_frame on top of read-only memory maps (no copy)."""
+    cols = {}
+    for item in meta:
+        values = np.load(os.path.join(path, item["file"] + ".npy"), mmap_mode="r")
+        if item["kind"] == "period":
+            col = pd.arrays.PeriodArray(values, dtype=item["dtype"])
+        elif item["kind"] == "datetime":
+            col = values.view(item["dtype"])
+        elif item["kind"] == "category":
+            col = pd.Categorical.from_codes(values, categories=pd.Index(item["categories"]), validate=False)
+            if item["dtype"] != "category":
+                col = pd.Series(col).astype(item["dtype"])
+        else:
+            col = values
+        cols[item["name"]] = col
+    return pd.DataFrame(cols, copy=False)
+
+
+def _manifest_stamp(t: _Tenant) -> Any:
+    try:
+        st = os.stat(os.path.join(t.dir, _MANIFEST))
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_ino)
+
+
+def _persist(t: _Tenant):
+    """Write the tenant's data under DATA_STORE_DIR and point its manifest at it."""
+    t.dirty = True
+    if not DATA_STORE_DIR:
+        return
+    try:
+        os.makedirs(t.dir, exist_ok=True)
+        manifest_path = os.path.join(t.dir, _MANIFEST)
+        name = f"v{t.version:012d}-{os.getpid()}"
+        manifest: Dict[str, Any] = {"version": t.version, "dir": None, "compact": COMPACT_STORAGE}
+        snap = t.snapshot
+        if not snap.transactions.empty:
+            path = os.path.join(t.dir, name)
+            tmp = path + ".tmp"
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            manifest["dir"] = name
+            manifest["transactions"] = _write_frame(tmp, "t", snap.transactions)
+            manifest["spend"] = _write_frame(tmp, "s", snap.spend)
+            rollups = {f.name: getattr(snap, f.name) for f in fields(Snapshot)
+                       if f.name not in ("version", "transactions", "spend")}
+            if snap.index is not None and not snap.index.built:
+                rollups["index"] = None  # built by whichever process searches first
+            pd.to_pickle(rollups, os.path.join(tmp, "rollups.pkl"))
+            os.replace(tmp, path)
+
+        tmp_manifest = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_manifest, "w") as fh:
+            json.dump(manifest, fh)
+        os.replace(tmp_manifest, manifest_path)
+        t.disk_stamp = _manifest_stamp(t)
+        t.dirty = False
+
+        # Older versions can go; other workers keep reading any files they still have mapped
+        for entry in os.listdir(t.dir):
+            if (entry.startswith("v") and not entry.endswith(".tmp")
+                    and entry.split("-")[0] < name.split("-")[0]):
+                shutil.rmtree(os.path.join(t.dir, entry), ignore_errors=True)
+    except OSError as e:
+        logger.warning("Could not persist transactions for tenant %s: %s", t.id, e)
+    _enforce_budget()
+
+
+def _next_version(t: _Tenant) -> int:
+    """Versions keep increasing across restarts and across workers sharing DATA_STORE_DIR."""
+    version = t.version
+    if DATA_STORE_DIR:
+        try:
+            with open(os.path.join(t.dir, _MANIFEST)) as fh:
+                version = max(version, json.load(fh)["version"])
+        except (OSError, ValueError, KeyError):
+            pass
+    return version + 1
+
+
+def load_from_disk(tenant: str = DEFAULT_TENANT):
+    """
+    Map in the tenant's data last persisted by any worker, if it changed since this
+    process last loaded or wrote it.
+    """
+    with _writing(tenant) as t:
+        _sync(t)
+
+
+def _refresh(t: _Tenant):
+    """Reader side of _sync: one stat, and never waits on a writer of this tenant."""
+    if not DATA_STORE_DIR or _manifest_stamp(t) == t.disk_stamp:
+        return
+    if t.lock.acquire(blocking=False):
+        try:
+            _sync(t)
+        finally:
+            t.lock.release()
+
+
+def _sync(t: _Tenant):
+    """Load newer persisted data for t; the caller holds t.lock."""
+    if not DATA_STORE_DIR:
+        return
+    stamp = _manifest_stamp(t)
+    if stamp == t.disk_stamp:
+        return
+    previous, t.disk_stamp = t.disk_stamp, stamp
+    if stamp is None:
+        if isinstance(previous, tuple):
+            # another worker purged the idle tenant
+            t.seen_keys = None
+            _publish(t, _build_snapshot(_empty_frame(), t.version + 1))
+        return
+
+    try:
+        with open(os.path.join(t.dir, _MANIFEST)) as fh:
+            manifest = json.load(fh)
+        if manifest["compact"] != COMPACT_STORAGE:
+            logger.warning("Ignoring persisted data written with COMPACT_STORAGE=%s", manifest["compact"])
+            return
+        version = max(t.version, manifest["version"])
+        if manifest["dir"] is None:
+            # another worker reset the store
+            t.seen_keys = None
+            _publish(t, _build_snapshot(_empty_frame(), version))
+            return
+        path = os.path.join(t.dir, manifest["dir"])
+        df = _read_frame(path, manifest["transactions"])
+        spend = _read_frame(path, manifest["spend"])
+        rollups = pd.read_pickle(os.path.join(path, "rollups.pkl"))
+        if not df["date"].is_monotonic_increasing or not spend["date"].is_monotonic_increasing:
+            # written before rows were kept in date order; index positions change with the order
+            df, spend = _by_date(df), _by_date(spend)
+            rollups["index"] = None
+        if rollups.get("index") is None:
+            rollups["index"] = TransactionIndex(df, lazy=True)  # not built when written
+        if rollups.get("cube") is None:
+            rollups["cube"] = rollup.build(df, AMOUNT_SCALE)  # written before the cube existed
+    except (OSError, ValueError, KeyError) as e:
+        # a writer replaced the version mid-read; the next call retries against the new manifest
+        logger.warning("Could not load persisted transactions for tenant %s: %s", t.id, e)
+        t.disk_stamp = "unchecked"
+        return
+
+    t.seen_keys = None
+    t.dirty = False
+    _publish(t, Snapshot(version=version, transactions=df, spend=spend, **rollups))
+    _enforce_budget()
+
+def parse_dates(values: pd.Series, date_format: Optional[str] = None) -> pd.Series:
+    """
+    values as datetimes, NaT where they do not parse. Text is parsed once per distinct
+    value: exports repeat each date many times, and parsing row by row is the slowest
+    step of an upload. Without date_format the format is guessed from the first
+    value, day first (03/04/2024 is 3 April).
+    """
+    if not (values.dtype == object or pd.api.types.is_string_dtype(values.dtype)
+            or isinstance(values.dtype, pd.CategoricalDtype)):
+        return pd.to_datetime(values, dayfirst=True, errors="coerce")
+    codes, uniques = pd.factorize(values)
+    if not len(uniques):
+        return pd.to_datetime(values, errors="coerce")  # nothing but missing values
+    if date_format:
+        parsed = pd.to_datetime(uniques, format=date_format, errors="coerce")
+    else:
+        parsed = pd.to_datetime(uniques, dayfirst=True, errors="coerce")
+    # code -1 (a missing value) becomes NaT
+    return pd.Series(parsed.array.take(codes, allow_fill=True), index=values.index, name=values.name)
 
 def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
     d = df.copy()
     d.columns = [c.strip().lower() for c in d.columns]
     if "date" in d.columns:
-        d["date"] = pd.to_datetime(d["date"],dayfirst=True, errors="coerce")
+        d["date"] = parse_dates(d["date"])
     if "amount" in d.columns:
         d["amount"] = pd.to_numeric(d["amount"], errors="coerce")
     return d
 
-def save_transactions(df: pd.DataFrame) -> int:
-    """Replace in-memory store with uploaded data (normalized)."""
-    global _df
+def prepare(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Validate an uploaded frame and convert it to the stored layout, dropping rows
+    with a bad date/amount. Pure, so ingestion workers can run it in parallel and
+    pass the result to the writers below with prepared=True.
+    """
     d = _normalize_columns(df)
     missing = set(REQUIRED_COLUMNS) - set(d.columns)
     if missing:
         raise ValueError(f"Missing required columns: {sorted(missing)}")
 
     # Drop rows with bad date/amount
-    d = d.dropna(subset=["date", "amount"])
-    _df = d.reset_index(drop=True)
-    return len(_df)
-
-def get_transactions() -> pd.DataFrame:
-    global _df
-    if _df is None:
-        return pd.DataFrame(columns=REQUIRED_COLUMNS)
-    return _df
+    return _encode(d.dropna(subset=["date", "amount"]).reset_index(drop=True))
+
+def _encode(d: pd.DataFrame) -> pd.DataFrame:
+    if not COMPACT_STORAGE:
+        return d
+    # pandas has no datetime64[D]; second resolution at midnight is the closest day-only layout
+    return d.assign(
+        date=d["date"].dt.normalize().dt.as_unit("s"),
+        description=d["description"].astype("category"),
+        category=d["category"].astype("category"),
+        amount=(d["amount"] * AMOUNT_SCALE).round().astype("int64"),
+    )
+
+def _row_keys(d: pd.DataFrame, key: Sequence[str]) -> np.ndarray:
+    return pd.util.hash_pandas_object(d[list(key)], index=False).to_numpy()
+
+@timed("store.save_transactions")
+def save_transactions(df: pd.DataFrame, tenant: str = DEFAULT_TENANT, prepared: bool = False) -> int:
+    """Replace the tenant's store with uploaded data (normalized) and rebuild the snapshot."""
+    d = df if prepared else prepare(df)
+    with _writing(tenant) as t:
+        t.seen_keys = None
+        _publish(t, _build_snapshot(d, _next_version(t)))
+        _persist(t)
+    rows_ingested.inc(len(d), mode="replace")
+    return len(d)
+
+@timed("store.append_transactions")
+def append_transactions(df: pd.DataFrame, dedupe_on: Optional[Sequence[str]] = DEDUPE_KEY,
+                        tenant: str = DEFAULT_TENANT, prepared: bool = False) -> Tuple[int, int]:
+    """
+    Add uploaded rows to the tenant's store, skipping ones whose dedupe_on columns
+    match an existing or earlier row. Aggregates are updated from the new rows only.
+    Returns (rows added, duplicates skipped).
+    """
+    d = df if prepared else prepare(df)
+    with _writing(tenant) as t:
+        _sync(t)
+        snap = t.snapshot
+        if dedupe_on:
+            key = tuple(c.strip().lower() for c in dedupe_on)
+            columns = set(d.columns) & set(snap.transactions.columns)
+            unknown = set(key) - columns
+            if unknown:
+                raise ValueError(f"Unknown dedupe columns: {sorted(unknown)}")
+
+            if t.seen_keys is None or t.seen_key_cols != key:
+                t.seen_keys = np.sort(_row_keys(snap.transactions, key))
+                t.seen_key_cols = key
+
+            keys = _row_keys(d, key)
+            _, first = np.unique(keys, return_index=True)
+            fresh = np.zeros(len(d), dtype=bool)
+            fresh[first] = True
+            pos = np.searchsorted(t.seen_keys, keys)
+            known = pos < len(t.seen_keys)
+            known[known] = t.seen_keys[pos[known]] == keys[known]
+            fresh &= ~known
+
+            new_keys = np.sort(keys[fresh])
+            t.seen_keys = np.insert(t.seen_keys, np.searchsorted(t.seen_keys, new_keys), new_keys)
+            skipped = int(len(d) - fresh.sum())
+            d = d[fresh].reset_index(drop=True)
+        else:
+            # keys of unchecked rows are not tracked, so rebuild on the next deduped append
+            t.seen_keys = None
+            skipped = 0
+
+        version = _next_version(t)
+        _publish(t, _merge_snapshot(snap, _build_snapshot(d, version, indexed=False), version))
+        _persist(t)
+    rows_ingested.inc(len(d), mode="append")
+    return len(d), skipped
+
+@timed("store.ingest_chunks")
+def ingest_chunks(chunks: Iterable[pd.DataFrame], tenant: str = DEFAULT_TENANT,
+                  prepared: bool = False) -> Tuple[int, int]:
+    """
+    Replace the tenant's store with rows read chunk by chunk, so only one raw chunk
+    is held at a time. Each chunk is validated and folded into running aggregates;
+    the new data is published once the last chunk is in.
+    Returns (rows accepted, rows rejected for a bad date/amount; 0 for prepared chunks).
+    """
+    running = _build_snapshot(_empty_frame(), 0, indexed=False)
+    frames, spends = [], []
+    accepted = rejected = 0
+    for chunk in chunks:
+        d = chunk if prepared else prepare(chunk)
+        accepted += len(d)
+        rejected += len(chunk) - len(d)
+        delta = _build_snapshot(d, 0, indexed=False)
+        frames.append(d)
+        spends.append(delta.spend)
+        running = _merge_snapshot(running, delta, 0, transactions=running.transactions, spend=running.spend)
+    if frames:
+        transactions = _by_date(_concat(frames))
+        running = replace(running, transactions=transactions, spend=_by_date(_concat(spends)),
+                          index=TransactionIndex(transactions))
+
+    with _writing(tenant) as t:
+        t.seen_keys = None
+        _publish(t, replace(running, version=_next_version(t)))
+        _persist(t)
+    rows_ingested.inc(accepted, mode="replace")
+    return accepted, rejected
+
+def get_transactions(tenant: str = DEFAULT_TENANT) -> pd.DataFrame:
+    """
+    Return the tenant's stored transactions. The frame shares the store's column
+    arrays (no copy), so amount is in stored units: divide by AMOUNT_SCALE for currency.
+    """
+    return get_snapshot(tenant).transactions.copy(deep=False)
+
+def date_slice(frame: pd.DataFrame, start: Optional[pd.Timestamp] = None,
+               end: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    """
+    Rows of a snapshot's transactions or spend dated from start to end (whole days,
+    both inclusive; None leaves that side open). Both frames are kept in date order,
+    so this is a binary search and the result a view: the cost is O(log n), not O(n).
+    """
+    if start is None and end is None:
+        return frame
+    dates = frame["date"].to_numpy()
+
+    def bound(day: pd.Timestamp) -> int:
+        # in the column's own unit: a mismatched one would make numpy convert every date
+        return int(np.searchsorted(dates, day.normalize().to_datetime64().astype(dates.dtype), "left"))
+
+    lo = 0 if start is None else bound(pd.Timestamp(start))
+    hi = len(dates) if end is None else bound(pd.Timestamp(end) + pd.Timedelta(days=1))
+    return frame.iloc[lo:max(lo, hi)]
+
+
+def _label_mask(column: pd.Series, value: str) -> np.ndarray:
+    """Rows whose label equals value, ignoring case; compares codes for categoricals."""
+    value = value.strip().lower()
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # a lookup table over the codes; its extra last slot catches code -1 (missing)
+        table = np.append(column.cat.categories.astype(str).str.lower() == value, False)
+        return table[column.cat.codes.to_numpy()]
+    return (column.astype(str).str.lower() == value).to_numpy()
+
+
+def _filtered_rows(frame: pd.DataFrame, start: Optional[pd.Timestamp], end: Optional[pd.Timestamp],
+                   category: Optional[str], merchant: Optional[str]) -> pd.DataFrame:
+    frame = date_slice(frame, start, end)
+    mask = np.ones(len(frame), dtype=bool)
+    if category:
+        mask &= _label_mask(frame["category"], category)
+    if merchant:
+        mask &= _label_mask(frame["description"], merchant)
+    if not mask.all():
+        frame = frame[mask]
+    return frame.reset_index(drop=True)
+
+
+def _cube_rollups(cube: rollup.Cube, **filters) -> Dict[str, pd.Series]:
+    """The rollup fields of a Snapshot, in the layout _build_snapshot gives them, read from cube."""
+    def months(days: np.ndarray) -> np.ndarray:
+        return days.astype("datetime64[M]").astype(str).astype(object)
+
+    by_month = cube.by_period("month", **filters)
+    by_month.index = pd.Index(months(by_month.index.to_numpy()), name="month")
+    # labels from the codes, not the table's text, so they match by_category whatever their type
+    table = cube.table("month", "category", label_major=True, codes=True, **filters)
+    by_category_month = pd.Series(table["amount"], name="amount", index=pd.MultiIndex.from_arrays(
+        [cube.categories[table["category"]].astype(object), pd.Index(months(table["period"]), dtype=object)],
+        names=["category", "month"]))
+    return {
+        "by_category": cube.by_label("category", **filters).sort_values(ascending=False),
+        "by_merchant": cube.by_label("merchant", **filters).sort_values(ascending=False),
+        "by_month": by_month,
+        "by_category_month": by_category_month,
+        "by_day": cube.by_period("day", measure="net", **filters),
+    }
+
+
+def filter_snapshot(snap: Snapshot, start: Optional[pd.Timestamp] = None, end: Optional[pd.Timestamp] = None,
+                    category: Optional[str] = None, merchant: Optional[str] = None) -> Snapshot:
+    """
+    snap restricted to transactions from start to end (inclusive) with the given
+    category and merchant (description), ignoring case. The rollups are sliced from
+    snap's cube rather than regrouped from rows, and the rows are cut with date_slice
+    before any label is compared. Returns snap itself when nothing is filtered.
+    """
+    if start is None and end is None and not category and not merchant:
+        return snap
+    filters = {"start": start, "end": end, "category": category, "merchant": merchant}
+    transactions = _filtered_rows(snap.transactions, **filters)
+    if snap.cube is None:
+        return _build_snapshot(transactions, snap.version, indexed=False)
+    if category or merchant:
+        # the view's spend rows are among its transactions: no second label pass over the ledger
+        spend = transactions[transactions["amount"] > 0]
+        spend = spend.assign(month=spend["date"].dt.to_period("M")).reset_index(drop=True)
+    else:
+        spend = _filtered_rows(snap.spend, **filters)  # a date_slice, with the month column kept
+    return Snapshot(version=snap.version, transactions=transactions, spend=spend,
+                    **_cube_rollups(snap.cube, **filters))
+
+
+def get_snapshot(tenant: str = DEFAULT_TENANT) -> Snapshot:
+    """
+    Return the tenant's current snapshot (empty if nothing uploaded). Hold on to it
+    for the whole request rather than calling this again per metric.
+    """
+    t = _tenant(tenant)
+    _refresh(t)
+    _touch(t)
+    return t.snapshot
+
+
+def _touch(t: _Tenant):
+    """Mark t's data as used now, for purge_idle_tenants; at most once a minute per process."""
+    now = time.time()
+    if not DATA_STORE_DIR or now - t.touched < _TOUCH_SECONDS:
+        return
+    t.touched = now
+    path = os.path.join(t.dir, _USED_FILE)
+    try:
+        with open(path, "a"):
+            pass
+        os.utime(path)
+    except OSError:
+        pass  # nothing persisted for t
+
+
+def _last_used(path: str) -> float:
+    # the newest of the last read, the last write and the last upload job; 0 if none
+    stamps = [0.0]
+    for name in (_USED_FILE, _MANIFEST, "jobs"):
+        try:
+            stamps.append(os.stat(os.path.join(path, name)).st_mtime)
+        except OSError:
+            pass
+    return max(stamps)
+
+
+def purge_idle_tenants(ttl_hours: Optional[float] = None) -> List[str]:
+    """
+    Delete the data of tenants not read or written for ttl_hours (default
+    TENANT_TTL_HOURS) from DATA_STORE_DIR and from memory; returns their ids.
+    DEFAULT_TENANT is always kept. Safe to run from several workers at once.
+    """
+    ttl = TENANT_TTL_HOURS if ttl_hours is None else ttl_hours
+    if not DATA_STORE_DIR or ttl <= 0:
+        return []
+    cutoff = time.time() - ttl * 3600
+    try:
+        entries = os.listdir(DATA_STORE_DIR)
+    except OSError:
+        return []
+    purged = []
+    for tenant in entries:
+        if tenant == DEFAULT_TENANT or not TENANT_ID_PATTERN.match(tenant):
+            continue
+        if _last_used(os.path.join(DATA_STORE_DIR, tenant)) >= cutoff:
+            continue
+        with _writing(tenant) as t:
+            if _last_used(t.dir) >= cutoff:
+                continue  # used while we waited for the lock
+            shutil.rmtree(t.dir, ignore_errors=True)
+            t.evicted = True
+            with _tenants_lock:
+                if _tenants.get(tenant) is t:
+                    del _tenants[tenant]
+        purged.append(tenant)
+    if purged:
+        logger.info("Purged %d idle tenants", len(purged))
+    return purged
@@ -0,0 +1,304 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import logging
+import tempfile
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+import pandas as pd
+from app.services import data_store, parsers
+
+# Uploads run as background jobs: the file is copied to a temporary file and cut into
+# byte ranges that worker processes read, parse and normalize in parallel, then the
+# prepared frames are published by a thread, so the event loop never runs pandas and
+# no process holds the whole upload in memory. A job runs in the worker process that
+# took the upload; its status is also written to DATA_STORE_DIR/<tenant>/jobs/ so that
+# any worker sharing the directory can answer a status poll.
+
+logger = logging.getLogger(__name__)
+
+# Parser processes; 0 parses in a thread of this process instead
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+# Approximate size of the CSV piece each worker parses
+INGEST_PART_BYTES = int(os.getenv("INGEST_PART_BYTES", str(8 * 1024 * 1024)))
+# Finished jobs remembered for status polling
+INGEST_JOBS_KEPT = int(os.getenv("INGEST_JOBS_KEPT", "100"))
+# Block size for copying an upload and scanning it for cut points
+_BLOCK_BYTES = 1024 * 1024
+
+
+@dataclass
+class Job:
+    """
+    One upload. status moves queued -> parsing -> saving -> done (or failed, with
+    error set); parts_done / parts_total count the pieces parsed so far.
+    """
+    id: str
+    tenant: str
+    filename: str
+    status: str = "queued"
+    parts_done: int = 0
+    parts_total: int = 0
+    rows: int = 0
+    rejected: int = 0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    task: Optional["asyncio.Task[None]"] = field(default=None, repr=False)
+
+    @property
+    def progress(self) -> float:
+        if self.status == "done":
+            return 1.0
+        # parsing is most of the work; saving is the last tenth
+        parsed = self.parts_done / self.parts_total if self.parts_total else 0.0
+        return round(0.9 * parsed, 3)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"job_id": self.id, "status": self.status, "filename": self.filename,
+                "progress": self.progress, "parts_done": self.parts_done, "parts_total": self.parts_total,
+                "rows": self.rows, "rejected": self.rejected, "error": self.error,
+                "created_at": self.created_at, "finished_at": self.finished_at}
+
+    @classmethod
+    def from_dict(cls, tenant: str, d: Dict[str, Any]) -> "Job":
+        return cls(id=d["job_id"], tenant=tenant, filename=d["filename"], status=d["status"],
+                   parts_done=d["parts_done"], parts_total=d["parts_total"], rows=d["rows"],
+                   rejected=d["rejected"], error=d["error"], created_at=d["created_at"],
+                   finished_at=d["finished_at"])
+
+
+_jobs: "OrderedDict[str, Job]" = OrderedDict()
+# Latest job per tenant: a job publishes only after the one submitted before it
+_latest: Dict[str, Job] = {}
+_pool: Optional[Executor] = None
+
+_JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _parse_part(path: str, header_end: int, start: int, stop: int, filename: str, profile: Optional[str],
+                dialect: Optional[parsers.Dialect]) -> Tuple[pd.DataFrame, int]:
+    # runs in a worker process: (prepared rows, raw rows) of the header plus bytes [start, stop)
+    with open(path, "rb") as fh:
+        header = fh.read(header_end)
+        fh.seek(start)
+        data = header + fh.read(stop - start)
+    df = parsers.parse(data, filename, profile=profile, dialect=dialect)
+    return data_store.prepare(df), len(df)
+
+
+def spool(source: BinaryIO) -> str:
+    """Copy an upload to a temporary file, a block at a time; returns its path."""
+    fd, path = tempfile.mkstemp(prefix="upload-")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            shutil.copyfileobj(source, fh, _BLOCK_BYTES)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def csv_ranges(path: str, part_bytes: int = INGEST_PART_BYTES) -> Tuple[int, List[Tuple[int, int]]]:
+    """
+    (end of the header line, [(start, stop)]) cutting the CSV file at path into
+    byte ranges of about part_bytes at line ends; each piece is parsed as the header
+    followed by its range. A line end inside a quoted field is never a cut point:
+    the quotes before a cut must be balanced. The file is read a block at a time.
+    """
+    with open(path, "rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        pos, block = 0, fh.read(_BLOCK_BYTES)  # block starts at pos in the file
+        while block and b"\n" not in block:
+            pos, block = pos + len(block), fh.read(_BLOCK_BYTES)
+        header_end = pos + block.find(b"\n") + 1 if block else 0
+        if header_end == 0 or size <= part_bytes:
+            return 0, [(0, size)]
+        ranges: List[Tuple[int, int]] = []
+        start, quotes = header_end, 0
+        counted = header_end - pos  # quotes in block are counted up to here
+        while block:
+            i = max(counted, start + part_bytes - pos)
+            while True:
+                nl = block.find(b"\n", i)
+                if nl < 0:
+                    break
+                quotes += block.count(b'"', counted, nl + 1)
+                counted = i = nl + 1
+                if quotes % 2 == 0:
+                    ranges.append((start, pos + counted))
+                    start = pos + counted
+                    i = max(i, start + part_bytes - pos)
+            quotes += block.count(b'"', counted)
+            pos += len(block)
+            counted = 0
+            block = fh.read(_BLOCK_BYTES)
+        if start < size:
+            ranges.append((start, size))
+        return header_end, ranges
+
+
+def _status_path(tenant: str, job_id: str) -> Optional[str]:
+    if not data_store.DATA_STORE_DIR:
+        return None
+    return os.path.join(data_store.DATA_STORE_DIR, tenant, "jobs", job_id + ".json")
+
+
+def _record(job: Job):
+    """Write the job's status where the other workers read it; a failure is only logged."""
+    path = _status_path(job.tenant, job.id)
+    if path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as fh:
+            json.dump(job.to_dict(), fh)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("Could not record upload job %s: %s", job.id, e)
+
+
+def _executor() -> Optional[Executor]:
+    global _pool
+    if INGEST_WORKERS <= 0:
+        return None  # the event loop's default thread pool
+    if _pool is None:
+        # spawn, not fork: forking a process that runs threads (uvicorn, httpx) can deadlock the child
+        _pool = ProcessPoolExecutor(INGEST_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def check(filename: str, profile: Optional[str] = None):
+    """Raise ValueError for a file format or bank profile an upload job could not read."""
+    if not parsers.supported(filename):
+        raise ValueError("Unsupported file format. Please upload a CSV or Excel file.")
+    parsers.get_profile(profile)  # unknown names fail here rather than in the job
+
+
+def submit(path: str, filename: str, tenant: str = data_store.DEFAULT_TENANT,
+           profile: Optional[str] = None) -> Job:
+    """
+    Start replacing the tenant's data with the uploaded file at path (see spool),
+    read with the named bank profile if given; call from the event loop. The job
+    deletes the file when it finishes.
+    """
+    check(filename, profile)
+    job = Job(id=uuid.uuid4().hex, tenant=tenant, filename=filename)
+    previous = _latest.get(tenant)
+    _latest[tenant] = job
+    _jobs[job.id] = job
+    _record(job)
+    job.task = asyncio.get_running_loop().create_task(_run(job, path, profile, previous))
+    _forget_finished()
+    return job
+
+
+def get(job_id: str, tenant: str = data_store.DEFAULT_TENANT) -> Optional[Job]:
+    """
+    The job, if it belongs to tenant and is still remembered by this process or
+    recorded by another worker.
+    """
+    job = _jobs.get(job_id)
+    if job is not None:
+        return job if job.tenant == tenant else None
+    path = _status_path(tenant, job_id) if _JOB_ID.match(job_id) else None
+    if path is None:
+        return None
+    try:
+        with open(path) as fh:
+            return Job.from_dict(tenant, json.load(fh))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _pieces(path: str, filename: str) -> Tuple[Optional[parsers.Dialect], int, List[Tuple[int, int]]]:
+    # (dialect, header end, byte ranges) of the upload; a file that is not cut is one range
+    dialect, header_end, ranges = None, 0, [(0, os.path.getsize(path))]
+    if filename.lower().endswith(".csv"):
+        # sniffed once for all pieces; UTF-16 cannot be cut at "\n" bytes
+        with open(path, "rb") as fh:
+            dialect = parsers.sniff(fh.read(parsers.SNIFF_BYTES))
+        if not dialect.encoding.startswith("utf-16"):
+            header_end, ranges = csv_ranges(path)
+    return dialect, header_end, ranges
+
+
+async def _run(job: Job, path: str, profile: Optional[str], previous: Optional[Job]):
+    loop = asyncio.get_running_loop()
+    try:
+        job.status = "parsing"
+        _record(job)
+        dialect, header_end, ranges = await asyncio.to_thread(_pieces, path, job.filename)
+        job.parts_total = len(ranges)
+        pool = _executor()
+
+        def parsed(_):
+            job.parts_done += 1
+            _record(job)
+
+        futures = []
+        for start, stop in ranges:
+            future = loop.run_in_executor(pool, _parse_part, path, header_end, start, stop, job.filename,
+                                          profile, dialect)
+            future.add_done_callback(parsed)
+            futures.append(future)
+        results = await asyncio.gather(*futures)
+        frames = [frame for frame, _ in results]
+        job.rejected = sum(raw - len(frame) for frame, raw in results)
+        del results
+        if job.rejected and not any(len(frame) for frame in frames):
+            # nothing to save: the file's dates or amounts are not in a format we read
+            raise ValueError(f"All {job.rejected} rows were rejected for a bad date or amount; "
+                             "check the file's format or bank profile.")
+
+        if previous is not None and previous.task is not None:
+            await asyncio.wait([previous.task])
+        job.status = "saving"
+        _record(job)
+        if len(frames) == 1:
+            job.rows = await asyncio.to_thread(data_store.save_transactions, frames[0], job.tenant, True)
+        else:
+            job.rows, _ = await asyncio.to_thread(data_store.ingest_chunks, frames, job.tenant, True)
+        job.status = "done"
+    except Exception as e:
+        if not isinstance(e, ValueError):
+            logger.exception("Ingestion job %s failed", job.id)
+        job.status = "failed"
+        job.error = str(e) if isinstance(e, ValueError) else f"Failed to process file: {e}"
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        job.finished_at = time.time()
+        _record(job)
+        if _latest.get(job.tenant) is job:
+            del _latest[job.tenant]
+        _forget_finished()
+
+
+def _forget_finished():
+    finished = [job_id for job_id, job in _jobs.items() if job.finished_at is not None]
+    for job_id in finished[:max(0, len(finished) - INGEST_JOBS_KEPT)]:
+        job = _jobs.pop(job_id)
+        path = _status_path(job.tenant, job.id)
+        if path is not None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
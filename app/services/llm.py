@@ -1,28 +1,75 @@
 import os
-import time
-import requests
+import json
+import asyncio
+import httpx
+from typing import AsyncIterator, Optional
 from dotenv import load_dotenv
+from app.services import llm_guard, telemetry
+from app.services.llm_guard import limiter, breaker
+from app.services.singleflight import AsyncSingleFlight
 
 load_dotenv()
 
 # Use your Gemini API key
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "Your Key")
 GEMINI_MODEL = "gemini-2.0-flash-lite"
-API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent"
+# Point GEMINI_API_BASE at a local stub server for tests and benchmarks
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+API_URL = f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:generateContent"
+STREAM_URL = f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:streamGenerateContent"
 
 HEADERS = {"Content-Type": "application/json"}
 
-def _post(payload):
-    url = f"{API_URL}?key={GEMINI_API_KEY}"
-    return requests.post(url, headers=HEADERS, json=payload, timeout=60)
+# Generation settings used unless a caller overrides them
+DEFAULT_MAX_OUTPUT_TOKENS = 256
+DEFAULT_TEMPERATURE = 0.2
+
+# Requests in flight to Gemini at once (also the connection pool size) and timeouts in seconds
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+
+# One pooled client per process so chat turns reuse connections (no TLS handshake each time)
+_client: Optional[httpx.AsyncClient] = None
+_slots: Optional[asyncio.Semaphore] = None
+
+# Identical prompts in flight at the same time share one Gemini call
+inflight = AsyncSingleFlight()
+
+
+# Status codes worth retrying: rate limited, or Gemini overloaded / briefly down
+_RETRY_STATUSES = (429, 500, 502, 503, 504, 529)
+_ATTEMPTS = 4
+
+
+class LLMError(Exception):
+    """Gemini did not return a usable completion; the message is safe to show to users."""
 
-def ask_llm(prompt: str, max_output_tokens: int = 256, temperature: float = 0.2) -> str:
-    """
-    Query Gemini API with simple retry logic.
-    """
-    if not GEMINI_API_KEY:
-        return "LLM not configured: missing GEMINI_API_KEY."
 
+class LLMUnavailable(LLMError):
+    """The circuit breaker is open: Gemini kept failing, so it is not being called for now."""
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client, _slots
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=LLM_MAX_CONCURRENCY,
+                                max_keepalive_connections=LLM_MAX_CONCURRENCY),
+        )
+        _slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _client
+
+async def aclose():
+    """Close the pooled client (called on app shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _payload(prompt: str, max_output_tokens: int, temperature: float) -> dict:
     wrapped = (
         "You are a helpful personal finance assistant. "
         "Answer using only the provided data summary when possible. "
@@ -30,7 +77,7 @@ def ask_llm(prompt: str, max_output_tokens: int = 256, temperature: float = 0.2)
         f"Instruction:\n{prompt}\n\nResponse:"
     )
 
-    payload = {
+    return {
         "contents": [{"parts": [{"text": wrapped}]}],
         "generationConfig": {
             "maxOutputTokens": max_output_tokens,
@@ -38,8 +85,70 @@ def ask_llm(prompt: str, max_output_tokens: int = 256, temperature: float = 0.2)
         }
     }
 
-    for attempt in range(4):
-        resp = _post(payload)
+async def _admit():
+    """Wait for the rate limiter; fails fast while the circuit breaker is open."""
+    if not breaker.allow():
+        raise LLMUnavailable("The assistant is temporarily unavailable. Please try again shortly.")
+    delay = limiter.reserve()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+def _retry_delay(resp: httpx.Response, attempt: int) -> float:
+    """Record a retryable failure and return how long to wait before the next attempt."""
+    telemetry.llm_retries.inc(status=resp.status_code)
+    wait = llm_guard.backoff(attempt)
+    if resp.status_code == 429:
+        pause = llm_guard.retry_after(resp.headers.get("Retry-After"))
+        limiter.throttle(pause)
+        return max(wait, pause or 0.0)
+    breaker.record_failure()
+    return wait
+
+def _record_response(resp: httpx.Response):
+    # Any answer that is not an overload shows Gemini is up
+    breaker.record_success()
+    if resp.status_code == 200:
+        limiter.succeeded()
+
+async def _post(payload: dict) -> httpx.Response:
+    client = _get_client()
+    async with _slots:
+        with telemetry.span("llm.attempt"):
+            return await client.post(API_URL, params={"key": GEMINI_API_KEY}, json=payload)
+
+async def generate(prompt: str, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS, temperature: float = DEFAULT_TEMPERATURE) -> str:
+    """
+    Query Gemini API through the shared rate limiter and circuit breaker, retrying
+    429/5xx with jittered exponential backoff (and Retry-After). Raises LLMError
+    (LLMUnavailable while the breaker is open) instead of returning an error message,
+    so callers can tell answers from failures. Concurrent calls with the same prompt
+    and settings share one request and its outcome.
+    """
+    telemetry.prompt_chars.observe(len(prompt))
+    return await inflight.do((prompt, max_output_tokens, temperature),
+                             lambda: _generate(prompt, max_output_tokens, temperature))
+
+async def _generate(prompt: str, max_output_tokens: int, temperature: float) -> str:
+    if not GEMINI_API_KEY:
+        raise LLMError("LLM not configured: missing GEMINI_API_KEY.")
+
+    payload = _payload(prompt, max_output_tokens, temperature)
+
+    for attempt in range(_ATTEMPTS):
+        await _admit()
+        try:
+            resp = await _post(payload)
+        except httpx.HTTPError as e:
+            breaker.record_failure()
+            raise LLMError(f"LLM request failed: {e!r}")
+
+        if resp.status_code in _RETRY_STATUSES:
+            delay = _retry_delay(resp, attempt)
+            if attempt + 1 < _ATTEMPTS:
+                await asyncio.sleep(delay)
+            continue
+
+        _record_response(resp)
         if resp.status_code == 200:
             try:
                 data = resp.json()
@@ -48,14 +157,78 @@ def ask_llm(prompt: str, max_output_tokens: int = 256, temperature: float = 0.2)
             except Exception:
                 return resp.text
 
-        if resp.status_code in (503, 529):
-            time.sleep(2 + attempt * 2)
+        if resp.status_code in (401, 403):
+            raise LLMError(f"Auth error from Gemini API ({resp.status_code}). Check your API key.")
+
+        raise LLMError(f"LLM error {resp.status_code}: {resp.text}")
+
+    raise LLMError("LLM is busy/loading. Please try again.")
+
+async def ask_llm(prompt: str, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS, temperature: float = DEFAULT_TEMPERATURE) -> str:
+    """Like generate(), but returns the error message as the answer."""
+    try:
+        return await generate(prompt, max_output_tokens, temperature)
+    except LLMError as e:
+        return str(e)
+
+async def generate_stream(prompt: str, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+                          temperature: float = DEFAULT_TEMPERATURE) -> AsyncIterator[str]:
+    """
+    Like generate(), but yields pieces of the answer as Gemini produces them
+    (streamGenerateContent over server-sent events). Raises LLMError.
+    """
+    if not GEMINI_API_KEY:
+        raise LLMError("LLM not configured: missing GEMINI_API_KEY.")
+
+    telemetry.prompt_chars.observe(len(prompt))
+    payload = _payload(prompt, max_output_tokens, temperature)
+    client = _get_client()
+
+    for attempt in range(_ATTEMPTS):
+        await _admit()
+        try:
+            async with _slots:
+                with telemetry.span("llm.stream_attempt"):
+                    async with client.stream("POST", STREAM_URL, json=payload,
+                                             params={"key": GEMINI_API_KEY, "alt": "sse"}) as resp:
+                        if resp.status_code == 200:
+                            _record_response(resp)
+                            async for line in resp.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                try:
+                                    chunk = json.loads(line[len("data:"):])
+                                    parts = chunk["candidates"][0]["content"]["parts"]
+                                except (ValueError, KeyError, IndexError):
+                                    continue
+                                for part in parts:
+                                    if part.get("text"):
+                                        yield part["text"]
+                            return
+                        body = (await resp.aread()).decode(errors="replace")
+        except httpx.HTTPError as e:
+            breaker.record_failure()
+            raise LLMError(f"LLM request failed: {e!r}")
+
+        if resp.status_code in _RETRY_STATUSES:
+            delay = _retry_delay(resp, attempt)
+            if attempt + 1 < _ATTEMPTS:
+                await asyncio.sleep(delay)
             continue
 
+        _record_response(resp)
         if resp.status_code in (401, 403):
-            return f"Auth error from Gemini API ({resp.status_code}). Check your API key."
+            raise LLMError(f"Auth error from Gemini API ({resp.status_code}). Check your API key.")
 
-        return f"LLM error {resp.status_code}: {resp.text}"
+        raise LLMError(f"LLM error {resp.status_code}: {body}")
 
-    return "LLM is busy/loading. Please try again."
+    raise LLMError("LLM is busy/loading. Please try again.")
 
+async def ask_llm_stream(prompt: str, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+                         temperature: float = DEFAULT_TEMPERATURE) -> AsyncIterator[str]:
+    """Like generate_stream(), but yields the error message as the answer."""
+    try:
+        async for piece in generate_stream(prompt, max_output_tokens, temperature):
+            yield piece
+    except LLMError as e:
+        yield str(e)
@@ -0,0 +1,164 @@
+import os
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+# Flow control for Gemini calls, shared by every request in the process: a token
+# bucket that slows down when Gemini answers 429 (and honours Retry-After), jittered
+# exponential backoff between retries, and a circuit breaker that stops calling an
+# LLM that keeps failing so chat requests can fail fast instead of queueing.
+
+LLM_RATE_PER_SEC = float(os.getenv("LLM_RATE_PER_SEC", "10"))
+LLM_BURST = int(os.getenv("LLM_BURST", "20"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+
+def backoff(attempt: int, base: float = LLM_BACKOFF_BASE, cap: float = LLM_BACKOFF_MAX) -> float:
+    """Seconds to wait before retry number attempt (0-based): full jitter over base * 2**attempt."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), None if absent or invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Admits up to burst calls at once and rate calls per second after that. The rate
+    halves on every throttle (429) and creeps back to max_rate with each success;
+    a Retry-After pauses admission altogether until it has passed.
+    """
+
+    def __init__(self, rate: float = LLM_RATE_PER_SEC, burst: int = LLM_BURST):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.throttled = 0
+        self._next = 0.0  # when the next call would be due if calls came at exactly rate
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token; returns how many seconds the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            interval = 1.0 / self.rate
+            start = max(now, self._paused_until, self._next - (self.burst - 1) * interval)
+            self._next = max(self._next, start) + interval
+            return start - now
+
+    def throttle(self, pause: Optional[float] = None):
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.max_rate / 64, self.rate / 2)
+            if pause:
+                self._paused_until = max(self._paused_until, time.monotonic() + pause)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "rate_per_sec": round(self.rate, 3),
+                "max_rate_per_sec": self.max_rate,
+                "burst": self.burst,
+                "throttled": self.throttled,
+                "paused_for_sec": round(max(0.0, self._paused_until - now), 3),
+                "queued_for_sec": round(max(0.0, self._next - now - (self.burst - 1) / self.rate), 3),
+            }
+
+
+class CircuitBreaker:
+    """
+    closed: calls go through. After failures consecutive failures it opens and
+    rejects calls for cooldown seconds, then lets a single probe through (half_open):
+    success closes it again, failure re-opens it. A probe that never reports back
+    (e.g. its request was cancelled) is replaced after another cooldown.
+    """
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at: Optional[float] = None
+        self._probe_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _state(self, now: float) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "open" if now - self._opened_at < self.cooldown else "half_open"
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            if state == "closed":
+                return True
+            if state == "half_open" and (self._probe_at is None or now - self._probe_at >= self.cooldown):
+                self._probe_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._probe_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            now = time.monotonic()
+            if self._probe_at is not None or (self._opened_at is None and self.failures >= self.max_failures):
+                self._opened_at = now
+                self.opened += 1
+            self._probe_at = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            return {
+                "state": state,
+                "consecutive_failures": self.failures,
+                "failure_threshold": self.max_failures,
+                "cooldown_sec": self.cooldown,
+                "retry_in_sec": round(max(0.0, self._opened_at + self.cooldown - now), 3) if state == "open" else 0.0,
+                "times_opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+limiter = TokenBucket()
+breaker = CircuitBreaker()
+
+
+def stats() -> Dict[str, Any]:
+    return {"limiter": limiter.stats(), "breaker": breaker.stats()}
@@ -1,99 +1,139 @@
+import inspect
+import functools
+import numpy as np
 import pandas as pd
-from typing import Dict, Any
-from app.services.data_store import get_transactions # type: ignore
+from datetime import date
+from typing import Dict, Any, Optional
+from app.services.data_store import get_snapshot, date_slice, Snapshot, AMOUNT_SCALE, DEFAULT_TENANT # type: ignore
+from app.services.singleflight import SingleFlight
+from app.services.telemetry import span
 
+# Every metric reads the tenant's current snapshot, or the one passed in so that a
+# caller combining several metrics sees a single data version.
 
-def _safe_df() -> pd.DataFrame:
-    df = get_transactions()
-    if df.empty:
-        return df
-    # ensure date column is datetime
-    if "date" in df.columns:
-        df["date"] = pd.to_datetime(df["date"], errors="coerce")
-        df = df.dropna(subset=["date"])  # drop rows with invalid dates
-    
-    # treat negative amounts as refunds and exclude from spend
-    df = df[df["amount"] > 0].copy()
-    return df
+inflight = SingleFlight()
 
 
-def spending_by_category() -> Dict[str, float]:
-    df = _safe_df()
-    if df.empty:
+def _coalesced(fn):
+    """Concurrent calls of fn with the same arguments on the same snapshot share one computation."""
+    sig = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        bound = sig.bind(*args, **kwargs)
+        bound.apply_defaults()
+        params = bound.arguments
+        params["snapshot"] = snap = params["snapshot"] or get_snapshot(params["tenant"])
+        # the snapshot object is the data version; the leader keeps it alive, so its id is not reused
+        key = (fn.__name__, id(snap)) + tuple(v for k, v in params.items() if k not in ("tenant", "snapshot"))
+        with span(f"metrics.{fn.__name__}"):
+            return inflight.do(key, lambda: fn(**params))
+    return wrapper
+
+
+@_coalesced
+def spending_by_category(tenant: str = DEFAULT_TENANT, snapshot: Optional[Snapshot] = None) -> Dict[str, float]:
+    snap = snapshot or get_snapshot(tenant)
+    if snap.empty:
         return {}
-    return (df.groupby("category")["amount"]
-              .sum()
-              .sort_values(ascending=False)
-              .round(2)
-              .to_dict())
+    return snap.by_category.round(2).to_dict()
 
-def top_merchants(n: int = 3) -> Dict[str, float]:
-    df = _safe_df()
-    if df.empty:
+@_coalesced
+def top_merchants(n: int = 3, tenant: str = DEFAULT_TENANT, snapshot: Optional[Snapshot] = None) -> Dict[str, float]:
+    snap = snapshot or get_snapshot(tenant)
+    if snap.empty:
         return {}
     # treat "description" as merchant
-    return (df.groupby("description")["amount"]
-              .sum()
-              .sort_values(ascending=False)
-              .head(n)
-              .round(2)
-              .to_dict())
+    return snap.by_merchant.head(n).round(2).to_dict()
 
-def monthly_totals() -> Dict[str, float]:
-    df = _safe_df()
-    if df.empty:
+@_coalesced
+def monthly_totals(tenant: str = DEFAULT_TENANT, snapshot: Optional[Snapshot] = None) -> Dict[str, float]:
+    snap = snapshot or get_snapshot(tenant)
+    if snap.empty:
         return {}
-    s = (df
-         .assign(month=df["date"].dt.to_period("M").astype(str))
-         .groupby("month")["amount"]
-         .sum()
-         .sort_index()
-         .round(2))
-    return s.to_dict()
+    return snap.by_month.round(2).to_dict()
 
-def fastest_growing_category() -> Dict[str, Any]:
+@_coalesced
+def fastest_growing_category(tenant: str = DEFAULT_TENANT, snapshot: Optional[Snapshot] = None) -> Dict[str, Any]:
     """
     Very small MoM growth heuristic:
     - Compute month totals per category
     - Compute MoM pct change for each category
     - Return the category with highest last available pct change
     """
-    df = _safe_df()
-    if df.empty:
+    snap = snapshot or get_snapshot(tenant)
+    if snap.empty:
         return {}
 
-    g = (df.assign(month=df["date"].dt.to_period("M").astype(str))
-            .groupby(["category", "month"])["amount"]
-            .sum()
-            .reset_index())
-
-    # pivot to months across columns, fill 0, then pct change across months
-    pivot = g.pivot(index="category", columns="month", values="amount").fillna(0).sort_index(axis=1)
-    if pivot.shape[1] < 2:
-        return {}
+    if snap.cube is not None:
+        # only the last two months are compared: read just their cells from the cube
+        months = snap.cube.periods("month")[-2:]
+        if len(months) < 2:
+            return {}
+        cube = snap.cube
+        recent = cube.table("month", "category", start=months[0], codes=True)
+        # every category with spend in any month, like the pivot below; the cube's
+        # category codes map straight to it, whatever the labels' type
+        month = cube.levels["month"]
+        present = np.unique(month.category[(month.spend > 0) & (month.category >= 0)])
+        column = np.full(len(cube.categories), -1)
+        column[present] = np.arange(len(present))
+        cols = column[recent["category"]]
+        assert (cols >= 0).all(), "cube category code without spend"
+        categories = pd.Index(cube.categories[present], name="category")
+        totals = np.zeros((2, len(categories)))
+        np.add.at(totals, ((recent["period"] == months[-1]).astype(int), cols), recent["amount"])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            growth = totals[1] / totals[0] - 1
+        growth[~np.isfinite(growth)] = 0
+        last_col = str(months[-1].astype("datetime64[M]"))
+        last_growth = pd.Series(growth, index=categories).sort_values(ascending=False)
+    else:
+        # pivot to months across columns, fill 0, then pct change across months
+        pivot = snap.by_category_month.unstack("month").fillna(0).sort_index(axis=1)
+        if pivot.shape[1] < 2:
+            return {}
 
-    pct = pivot.pct_change(axis=1).replace([pd.NA, pd.NaT, float("inf"), -float("inf")], 0).fillna(0)
-    last_col = pct.columns[-1]
-    last_growth = pct[last_col].sort_values(ascending=False)
+        pct = pivot.pct_change(axis=1).replace([pd.NA, pd.NaT, float("inf"), -float("inf")], 0).fillna(0)
+        last_col = pct.columns[-1]
+        last_growth = pct[last_col].sort_values(ascending=False)
 
-    top_cat = last_growth.index[0]
+    top_cat = last_growth.index[:1].tolist()[0]  # a plain Python value, whatever the labels' dtype
     return {
         "month": last_col,
         "category": top_cat,
         "growth_pct": round(float(last_growth.iloc[0]) * 100, 2)
     }
 
-def latest_week_top_expenses(k: int = 3) -> Dict[str, float]:
-    df = _safe_df()
-    if df.empty:
+@_coalesced
+def latest_week_top_expenses(k: int = 3, tenant: str = DEFAULT_TENANT, snapshot: Optional[Snapshot] = None) -> Dict[str, float]:
+    snap = snapshot or get_snapshot(tenant)
+    if snap.empty or k <= 0:
         return {}
-    last_date = df["date"].max()
-    week_start = last_date - pd.Timedelta(days=6)
-    w = df[(df["date"] >= week_start) & (df["date"] <= last_date)].copy()
-    if w.empty:
-        return {}
-    # biggest line items (not aggregated)
-    top = w.sort_values("amount", ascending=False).head(k)
+    # spend is in date order: the week is a slice off its end
+    last_day = snap.spend["date"].iloc[-1]
+    df = date_slice(snap.spend, last_day - pd.Timedelta(days=6), last_day)
+    # biggest line items (not aggregated): partial sort of the week's amounts
+    amounts = df["amount"].to_numpy()
+    week = np.arange(len(df))
+    if len(week) > k:
+        week = np.argpartition(-amounts, k - 1)[:k]
+    week = week[np.argsort(-amounts[week], kind="stable")]
+    top = df.take(week)
+    days = np.datetime_as_string(top["date"].to_numpy().astype("datetime64[D]"), unit="D")
     # use description as key with amount
-    return {f'{row["description"]} ({row["date"].date()})': round(float(row["amount"]), 2)
-            for _, row in top.iterrows()}
+    return {f"{desc} ({day})": round(float(amount) / AMOUNT_SCALE, 2)
+            for desc, day, amount in zip(top["description"], days, amounts[week])}
+
+@_coalesced
+def spend_rollup(grain: str = "month", by: str = "category", start: Optional[date] = None,
+                 end: Optional[date] = None, category: Optional[str] = None, merchant: Optional[str] = None,
+                 tenant: str = DEFAULT_TENANT, snapshot: Optional[Snapshot] = None) -> Dict[str, np.ndarray]:
+    """
+    Spend per period of grain ("day", "week" from Monday, or "month") and per
+    category or merchant, as columns "period" (first day), by and "amount",
+    sliced from the snapshot's rollup cube; start/end/category/merchant as in
+    filter_snapshot. Takes a stored snapshot, not a filtered view.
+    """
+    snap = snapshot or get_snapshot(tenant)
+    return snap.cube.table(grain, by, start=start, end=end, category=category, merchant=merchant)
@@ -0,0 +1,213 @@
+import io
+import os
+import csv
+import json
+import codecs
+import functools
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Union
+import pandas as pd
+from app.services.data_store import COMPACT_STORAGE, REQUIRED_COLUMNS, parse_dates
+
+# Turns uploaded files into frames with the REQUIRED_COLUMNS headers. CSV encoding
+# and delimiter are sniffed once from the start of the file, text columns are read
+# with explicit dtypes, and the pyarrow engine is used when it is installed. Bank
+# exports with other headers are mapped through profiles (see BANK_PROFILES_PATH).
+# New formats are added with @parser(".ext").
+
+try:
+    import pyarrow  # noqa: F401  (only needed by pandas' pyarrow engine)
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    CSV_ENGINE = "c"
+
+# JSON list of bank profiles; the bundled file has a few examples
+BANK_PROFILES_PATH = os.getenv("BANK_PROFILES_PATH",
+                               os.path.join(os.path.dirname(__file__), "bank_profiles.json"))
+
+# Bytes read to sniff a CSV's encoding and delimiter
+SNIFF_BYTES = 64 * 1024
+
+_DELIMITERS = ",;\t|"
+
+Source = Union[bytes, BinaryIO]
+
+
+@dataclass(frozen=True)
+class Dialect:
+    encoding: str = "utf-8"
+    delimiter: str = ","
+
+
+@dataclass(frozen=True)
+class Profile:
+    """
+    How one bank's export maps onto REQUIRED_COLUMNS: columns maps its header names
+    (matched ignoring case) to ours. date_format (strptime), delimiter, encoding,
+    decimal and thousands (the amount's separators) override what would be sniffed;
+    negate_amount is for exports where spending is negative.
+    """
+    name: str
+    columns: Dict[str, str]
+    date_format: Optional[str] = None
+    delimiter: Optional[str] = None
+    encoding: Optional[str] = None
+    decimal: str = "."
+    thousands: Optional[str] = None
+    negate_amount: bool = False
+    _lookup: Dict[str, str] = field(default_factory=dict, compare=False, repr=False)
+
+    def __post_init__(self):
+        self._lookup.update({_key(k): v.strip().lower() for k, v in self.columns.items()})
+
+    def matches(self, header: List[str]) -> bool:
+        return set(self._lookup) <= {_key(h) for h in header}
+
+
+def _key(name) -> str:
+    return str(name).strip().lower()
+
+
+@functools.lru_cache(maxsize=1)
+def profiles() -> Dict[str, Profile]:
+    if not BANK_PROFILES_PATH or not os.path.exists(BANK_PROFILES_PATH):
+        return {}
+    with open(BANK_PROFILES_PATH, encoding="utf-8") as fh:
+        items = json.load(fh)
+    return {item["name"]: Profile(**item) for item in items}
+
+
+def get_profile(name: Optional[str]) -> Optional[Profile]:
+    """The named profile; raises ValueError for an unknown name."""
+    if not name:
+        return None
+    profile = profiles().get(name)
+    if profile is None:
+        raise ValueError(f"Unknown bank profile {name!r}. Known: {sorted(profiles())}")
+    return profile
+
+
+def _detect_profile(header: List[str]) -> Optional[Profile]:
+    """The profile with the most columns that fits header, unless header already has ours."""
+    if set(REQUIRED_COLUMNS) <= {_key(h) for h in header}:
+        return None
+    fitting = [p for p in profiles().values() if p.matches(header)]
+    return max(fitting, key=lambda p: len(p.columns)) if fitting else None
+
+
+def sniff(sample: bytes) -> Dialect:
+    """Encoding (from a BOM, else UTF-8 if it decodes, else cp1252) and delimiter of CSV bytes."""
+    if sample.startswith(codecs.BOM_UTF8):
+        encoding = "utf-8-sig"
+    elif sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encoding = "utf-16"
+    else:
+        try:
+            # the sample may end in the middle of a character
+            sample.decode("utf-8")
+            encoding = "utf-8"
+        except UnicodeDecodeError as e:
+            encoding = "utf-8" if e.start >= len(sample) - 3 else "cp1252"
+    lines = sample.decode(encoding, errors="ignore").splitlines()[:50]
+    try:
+        delimiter = csv.Sniffer().sniff("\n".join(lines), delimiters=_DELIMITERS).delimiter
+    except csv.Error:
+        delimiter = ","
+    return Dialect(encoding=encoding, delimiter=delimiter)
+
+
+def _header(sample: bytes, dialect: Dialect) -> List[str]:
+    text = sample.decode(dialect.encoding, errors="ignore")
+    return next(csv.reader(io.StringIO(text), delimiter=dialect.delimiter), [])
+
+
+def _read_sample(source: Source) -> bytes:
+    if isinstance(source, bytes):
+        return source[:SNIFF_BYTES]
+    sample = source.read(SNIFF_BYTES)
+    source.seek(0)
+    return sample
+
+
+def _csv_options(sample: bytes, profile: Optional[Profile], dialect: Optional[Dialect]) -> Dict:
+    dialect = dialect or sniff(sample)
+    if profile is not None:
+        dialect = Dialect(encoding=profile.encoding or dialect.encoding,
+                          delimiter=profile.delimiter or dialect.delimiter)
+    header = _header(sample, dialect)
+    profile = profile or _detect_profile(header)
+    targets = {h: (profile._lookup.get(_key(h)) if profile else _key(h)) for h in header}
+    # text stays text (a date is parsed once per distinct value later); labels are few
+    # and repeat, so the compact layout reads them straight into categoricals
+    label = "category" if COMPACT_STORAGE else str
+    dtype = {h: (label if t in ("description", "category") else str)
+             for h, t in targets.items() if t in ("date", "description", "category")}
+    read = {"sep": dialect.delimiter, "encoding": dialect.encoding, "dtype": dtype, "engine": CSV_ENGINE}
+    if profile is not None and profile.decimal != ".":
+        read["decimal"] = profile.decimal
+    if profile is not None and profile.thousands:
+        # otherwise one "1.234,50" leaves the whole column as text, and every amount NaN
+        read.update(thousands=profile.thousands, engine="c")  # pyarrow has no thousands option
+    return {"profile": profile, "read": read}
+
+
+def _apply_profile(df: pd.DataFrame, profile: Optional[Profile]) -> pd.DataFrame:
+    if profile is None:
+        return df
+    df = df.rename(columns=lambda c: profile._lookup.get(_key(c), c))
+    if "amount" in df.columns and profile.negate_amount:
+        df["amount"] = -pd.to_numeric(df["amount"], errors="coerce")
+    if "date" in df.columns and profile.date_format:
+        df["date"] = parse_dates(df["date"], profile.date_format)
+    return df
+
+
+_PARSERS: Dict[str, Callable[..., pd.DataFrame]] = {}
+
+
+def parser(*extensions: str):
+    """Register fn(source, profile, dialect) as the parser for files with these extensions."""
+    def register(fn):
+        for ext in extensions:
+            _PARSERS[ext.lower()] = fn
+        return fn
+    return register
+
+
+def supported(filename: str) -> bool:
+    return os.path.splitext(filename.lower())[1] in _PARSERS
+
+
+def parse(source: Source, filename: str, profile: Optional[str] = None,
+          dialect: Optional[Dialect] = None) -> pd.DataFrame:
+    """
+    Parse an uploaded file with the parser for its extension; profile names a bank
+    profile, otherwise one is picked from the header if ours is not there.
+    Raises ValueError for unsupported formats and unknown profiles.
+    """
+    fn = _PARSERS.get(os.path.splitext(filename.lower())[1])
+    if fn is None:
+        raise ValueError("Unsupported file format. Please upload a CSV or Excel file.")
+    return fn(source, get_profile(profile), dialect)
+
+
+@parser(".csv")
+def parse_csv(source: Source, profile: Optional[Profile] = None, dialect: Optional[Dialect] = None) -> pd.DataFrame:
+    options = _csv_options(_read_sample(source), profile, dialect)
+    data = io.BytesIO(source) if isinstance(source, bytes) else source
+    return _apply_profile(pd.read_csv(data, **options["read"]), options["profile"])
+
+
+@parser(".xls", ".xlsx")
+def parse_excel(source: Source, profile: Optional[Profile] = None, dialect: Optional[Dialect] = None) -> pd.DataFrame:
+    data = io.BytesIO(source) if isinstance(source, bytes) else source
+    df = pd.read_excel(data)
+    return _apply_profile(df, profile or _detect_profile(list(df.columns)))
+
+
+def iter_csv(source: BinaryIO, chunk_rows: int, profile: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    """parse_csv in chunks of chunk_rows rows, for streaming ingestion."""
+    options = _csv_options(_read_sample(source), get_profile(profile), None)
+    read = dict(options["read"], engine="c")  # the pyarrow engine cannot read in chunks
+    for chunk in pd.read_csv(source, chunksize=chunk_rows, **read):
+        yield _apply_profile(chunk, options["profile"])
@@ -0,0 +1,222 @@
+import re
+import calendar
+import pandas as pd
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from app.services.data_store import Snapshot  # type: ignore
+
+# Answers plain aggregate questions ("spend on food in March", "top merchant last
+# week", "total last month") straight from the snapshot. Anything it does not fully
+# recognize returns None and goes to the LLM, as does a question naming a period
+# parse_period cannot read ("yesterday", "last 3 months", "first half of 2024"),
+# more than one period, category or merchant, or asking for anything but a spend
+# total (counts, refunds, the biggest purchase, amounts over $N, "not on food").
+# Relative periods ("this month", "last week") are measured from the latest
+# transaction, not from today's date.
+
+_MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+_MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+_MONTH_RE = "|".join(sorted(_MONTHS, key=len, reverse=True))
+_ORDINAL = r"(?:st|nd|rd|th)?"
+
+# The periods parse_period reads, most specific first
+_LAST_DAYS = re.compile(r"\b(?:last|past|previous) (\d+) days\b")
+_WEEK = re.compile(r"\b(?:this|last|past|previous) week\b")
+_THIS_MONTH = re.compile(r"\bthis month\b")
+_LAST_MONTH = re.compile(r"\b(?:last|previous|past) month\b")
+_DAY_MONTH = re.compile(rf"\b(\d{{1,2}}){_ORDINAL} (?:of )?({_MONTH_RE})\b(?:,? (\d{{4}})\b)?")
+_MONTH_DAY = re.compile(rf"\b({_MONTH_RE}) (\d{{1,2}}){_ORDINAL}\b(?:,? (\d{{4}})\b)?")
+# "may" alone is usually the verb: it names the month only with a year or day next to it
+_MONTH = re.compile(rf"\b(?!may\b(?!,? \d{{4}}\b))({_MONTH_RE})\b(?:,? (\d{{4}})\b)?")
+_THIS_YEAR = re.compile(r"\bthis year\b")
+_YEAR = re.compile(r"\b(?:in )?(20\d\d)\b")
+_LAST_YEAR = re.compile(r"\b(?:last|previous) year\b")
+_PERIODS = (_LAST_DAYS, _WEEK, _THIS_MONTH, _LAST_MONTH, _DAY_MONTH, _MONTH_DAY, _MONTH, _THIS_YEAR, _YEAR,
+            _LAST_YEAR)
+# Time expressions left over once those periods are taken out are ones parse_period
+# cannot read; answering them for all time would be wrong
+_OTHER_TIME = re.compile(
+    r"\b((day|week|weekend|fortnight|month|quarter|year)s?|yesterday|today|tonight|tomorrow|since|ago|"
+    r"until|till|before|after|between|daily|weekly|monthly|quarterly|yearly|annual(ly)?|ytd|q[1-4]|h[12]|may|"
+    r"half|first|second|early|late|mid|beginning|start|end|weekdays?|mornings?|evenings?|nights?|"
+    r"spring|summer|autumn|fall|winter|holidays?|christmas)\b")
+
+# Questions that need reasoning rather than a lookup
+_OPEN_ENDED = re.compile(
+    r"\b(why|should|could|would|advice|advise|recommend|suggest|tips?|save|budget|compare|"
+    r"trend|predict|forecast|average|increase|decrease|grow|reduce|cut|help|explain)\w*\b")
+# Questions about something other than the spend total: counts, money coming in,
+# amount filters and negations. The totals here add up every spend of the period.
+_NOT_A_TOTAL = re.compile(
+    r"\b(how many|number of|times|count\w*|often|frequen\w*|"
+    r"refund\w*|income|earn\w*|salary|wages?|credit\w*|receiv\w*|deposit\w*|reimburs\w*|cashback|net|"
+    r"not|no|never|without|except\w*|excluding|other than|besides|apart from|\w+n't)\b|"
+    r"\$\s?\d|\b(over|under|above|below|more than|less than|greater than|at least|at most|exceed\w*)\s+\$?\d")
+# A single transaction at an extreme; the top branch only reads the highest label total
+_HIGHEST = re.compile(r"\b(biggest|largest|highest|most expensive|max|maximum|single)\b")
+_LOWEST = re.compile(r"\b(smallest|lowest|least|cheapest|min|minimum)\b")
+_TOP = re.compile(r"\b(top|biggest|largest|most|highest)\b")
+_MERCHANT = re.compile(r"\b(merchants?|stores?|shops?|vendors?|payees?|where)\b")
+_CATEGORY = re.compile(r"\bcategor(y|ies)\b")
+_LISTING = re.compile(r"\b(when|show|list|which (transactions|payments|purchases))\b")
+_SPEND = re.compile(r"\b(spen[dt]|spending|paid|pay|costs?|expenses?|total)\b")
+# Words that may follow "on"/"at"/"for" without naming a category or merchant
+_PERIOD_WORDS = {"the", "this", "last", "past", "previous", "total", "all", "everything",
+                 "month", "week", "year", "days"} | set(_MONTHS)
+
+
+@dataclass(frozen=True)
+class LocalAnswer:
+    intent: str
+    text: str
+    data: Dict[str, Any]
+
+
+def parse_period(q: str, last: pd.Timestamp) -> Tuple[Optional[pd.Timestamp], Optional[pd.Timestamp], str]:
+    """(start, end inclusive, label) for the period named in q; (None, None, "") for all time."""
+    this_month = last.to_period("M")
+    m = _LAST_DAYS.search(q)
+    if m:
+        days = int(m.group(1))
+        return last - pd.Timedelta(days=days - 1), last, f"the last {days} days"
+    if _WEEK.search(q):
+        return last - pd.Timedelta(days=6), last, "the last 7 days"
+    if _THIS_MONTH.search(q):
+        return this_month.start_time, last, this_month.strftime("%B %Y")
+    if _LAST_MONTH.search(q):
+        p = this_month - 1
+        return p.start_time, p.end_time.normalize(), p.strftime("%B %Y")
+    m = _DAY_MONTH.search(q)
+    day, month, year = (m.group(1), m.group(2), m.group(3)) if m else (None, None, None)
+    if not m:
+        m = _MONTH_DAY.search(q)
+        day, month, year = (m.group(2), m.group(1), m.group(3)) if m else (None, None, None)
+    if m:
+        month = _MONTHS[month]
+        year = int(year) if year else (last.year if month <= last.month else last.year - 1)
+        try:
+            d = pd.Timestamp(year=year, month=month, day=int(day))
+        except ValueError:
+            return None, None, ""  # no such day
+        return d, d, f"{d.day} {d.strftime('%B %Y')}"
+    m = _MONTH.search(q)
+    if m:
+        month = _MONTHS[m.group(1)]
+        year = int(m.group(2)) if m.group(2) else (last.year if month <= last.month else last.year - 1)
+        p = pd.Period(year=year, month=month, freq="M")
+        return p.start_time, p.end_time.normalize(), p.strftime("%B %Y")
+    if _THIS_YEAR.search(q):
+        return pd.Timestamp(year=last.year, month=1, day=1), last, str(last.year)
+    m = _YEAR.search(q) or _LAST_YEAR.search(q)
+    if m:
+        year = int(m.group(1)) if m.groups() else last.year - 1
+        return pd.Timestamp(year=year, month=1, day=1), pd.Timestamp(year=year, month=12, day=31), str(year)
+    return None, None, ""
+
+
+def _without_periods(q: str) -> Tuple[str, int]:
+    """q with the periods parse_period reads taken out, and how many there were."""
+    found = 0
+    for pattern in _PERIODS:
+        q, n = pattern.subn(" ", q)
+        found += n
+    return q, found
+
+
+def has_unknown_period(q: str) -> bool:
+    """
+    True if q mentions a time that parse_period does not read ("yesterday", "last 3
+    months", "first half of 2024", a bare "may") or more than one period ("march and april").
+    """
+    rest, found = _without_periods(q)
+    return found > 1 or _OTHER_TIME.search(rest) is not None
+
+
+def _mentions(q: str, labels: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    """
+    (kind, name) of every name in labels ({kind: names}) that appears in q as whole
+    words (case-insensitive). A name found inside a longer one ("food" in "fast
+    food") does not count; a text naming both a category and a merchant is the category.
+    """
+    lookup: Dict[str, Tuple[str, Any]] = {}
+    for kind, names in labels.items():
+        lookup.update({str(name).lower(): (kind, name) for name in names})
+    words = [w.strip(".'") for w in re.findall(r"[\w&'.-]+", q)]
+    spans = []
+    for i in range(len(words)):
+        for j in range(i + 1, min(len(words), i + 6) + 1):
+            text = " ".join(words[i:j])
+            if text in lookup:
+                spans.append((i, j, text))
+    taken, found = set(), []
+    for i, j, text in sorted(spans, key=lambda span: (-len(span[2]), span[0])):
+        if taken.isdisjoint(range(i, j)):
+            taken.update(range(i, j))
+            if lookup[text] not in found:
+                found.append(lookup[text])
+    return found
+
+
+def _money(value: float) -> str:
+    return f"${value:,.2f}"
+
+
+def answer(query: str, snap: Snapshot) -> Optional[LocalAnswer]:
+    """Answer query from snap, or None if it should go to the LLM."""
+    q = re.sub(r"\s+", " ", query.lower()).strip()
+    if snap.empty or _OPEN_ENDED.search(q) or _NOT_A_TOTAL.search(q) or _LOWEST.search(q) or has_unknown_period(q):
+        return None
+
+    last = snap.spend["date"].iloc[-1]  # spend is in date order
+    start, end, label = parse_period(q, last)
+    if start is None and any(pattern.search(q) for pattern in _PERIODS):
+        return None  # names a day that does not exist ("february 30")
+    # totals come from the snapshot's rollup cube: no rows of the period are scanned
+    cube = snap.cube
+    period = {"start": str(start.date()) if start is not None else None,
+              "end": str(end.date()) if end is not None else None}
+    where = f" on {label}" if start is not None and start == end else f" in {label}" if label else ""
+    # the merchant list is checked before the categories, so a name that is both counts as the category
+    mentioned = _mentions(q, {"merchant": snap.by_merchant.index, "category": snap.by_category.index})
+    if len(mentioned) > 1:
+        return None  # "food and rent": a single total would answer only part of the question
+
+    if _TOP.search(q) and (_MERCHANT.search(q) or _CATEGORY.search(q)):
+        noun = "category" if _CATEGORY.search(q) else "merchant"
+        filters = {kind: str(name) for kind, name in mentioned}
+        if noun in filters:
+            return None  # "top category for food"
+        for kind, name in mentioned:
+            where = f" for {name}{where}" if kind == "category" else f" at {name}{where}"
+        totals = cube.by_label(noun, start, end, **filters)
+        if totals.empty:
+            return LocalAnswer(f"top_{noun}", f"There is no spending recorded{where}.", {"period": period})
+        name, value = totals.idxmax(), float(totals.max())
+        return LocalAnswer(f"top_{noun}", f"Your top {noun}{where} was {name} at {_money(value)}.",
+                           {"period": period, noun: str(name), "amount": round(value, 2)})
+
+    if _HIGHEST.search(q):
+        return None  # "biggest purchase": one transaction, not a total
+    if not _SPEND.search(q) and not q.startswith("how much"):
+        return None
+    if _LISTING.search(q):
+        return None  # asks for individual transactions, not a total
+
+    category = next((name for kind, name in mentioned if kind == "category"), None)
+    merchant = next((name for kind, name in mentioned if kind == "merchant"), None)
+    if category is not None:
+        value = cube.total(start, end, category=str(category))
+        return LocalAnswer("spend_on_category", f"You spent {_money(value)} on {category}{where}.",
+                           {"period": period, "category": str(category), "amount": round(value, 2)})
+    if merchant is not None:
+        value = cube.total(start, end, merchant=str(merchant))
+        return LocalAnswer("spend_at_merchant", f"You spent {_money(value)} at {merchant}{where}.",
+                           {"period": period, "merchant": str(merchant), "amount": round(value, 2)})
+    targets = re.findall(r"\b(?:on|at|for|with|from) ([a-z][\w&'.-]*)", q)
+    if any(t.strip(".'") not in _PERIOD_WORDS for t in targets):
+        return None  # names something we don't know; let the LLM handle it
+    if re.search(r"\b(total|how much|in all|altogether)\b", q):
+        value = cube.total(start, end)
+        return LocalAnswer("total_spend", f"You spent {_money(value)} in total{where}.",
+                           {"period": period, "amount": round(value, 2)})
+    return None
@@ -0,0 +1,262 @@
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+# Transactions pre-aggregated at ingest into cells of (period, category, merchant)
+# at day, week and month grain, each holding the spend (positive amounts) and the
+# net amount (refunds included). A cell exists only for a combination that occurs,
+# so the size is bounded by days x merchants (a merchant rarely spans categories),
+# not by the number of rows. Queries slice cells by period with a binary search,
+# reading the coarsest grain whose periods exactly cover the date range.
+
+GRAINS = ("day", "week", "month")
+
+DateLike = Optional[object]  # anything pd.Timestamp accepts, or None for an open side
+
+
+def period_ids(days: np.ndarray, grain: str) -> np.ndarray:
+    """Period number of each day (days since 1970-01-01) at grain; weeks start on Monday."""
+    if grain == "day":
+        return days
+    if grain == "week":
+        return (days + 3) // 7  # 1970-01-01 was a Thursday
+    return days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+
+def period_starts(periods: np.ndarray, grain: str) -> np.ndarray:
+    """First day (datetime64[D]) of each period number of grain."""
+    if grain == "day":
+        return periods.astype("datetime64[D]")
+    if grain == "week":
+        return (periods * 7 - 3).astype("datetime64[D]")
+    return periods.astype("datetime64[M]").astype("datetime64[D]")
+
+
+def _day(value: DateLike) -> Optional[int]:
+    if value is None:
+        return None
+    return int(pd.Timestamp(value).to_datetime64().astype("datetime64[D]").astype(np.int64))
+
+
+def _sum_by(major: np.ndarray, minor: np.ndarray, *values: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """
+    (major, minor, then the sum of each of values) per distinct pair of
+    non-negative ints, ordered by major then minor. Hashes rather than sorts the
+    rows; only the distinct pairs are sorted.
+    """
+    if not len(major):
+        empty = np.zeros(0, dtype=np.int64)
+        return (empty, empty) + tuple(np.zeros(0, dtype=v.dtype) for v in values)
+    width = int(minor.max()) + 1
+    codes, keys = pd.factorize(major.astype(np.int64) * width + minor)
+    order = np.argsort(keys)
+    rank = np.empty(len(keys), dtype=np.int64)
+    rank[order] = np.arange(len(keys))
+    codes = rank[codes]
+    sums = []
+    for v in values:
+        total = np.bincount(codes, weights=v, minlength=len(keys))
+        # whole cents stay exact below 2**53
+        sums.append(np.rint(total).astype(v.dtype) if v.dtype.kind in "iu" else total)
+    keys = keys[order]
+    return (keys // width, keys % width) + tuple(sums)
+
+
+@dataclass(frozen=True)
+class Level:
+    """Cells of one grain, ordered by period, then category code, then merchant code (-1: missing label)."""
+    grain: str
+    period: np.ndarray
+    category: np.ndarray
+    merchant: np.ndarray
+    spend: np.ndarray
+    net: np.ndarray
+
+    def take(self, rows) -> "Level":
+        return Level(self.grain, self.period[rows], self.category[rows], self.merchant[rows],
+                     self.spend[rows], self.net[rows])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.period, self.category, self.merchant, self.spend, self.net))
+
+
+def _level(grain: str, period: np.ndarray, category: np.ndarray, merchant: np.ndarray,
+           spend: np.ndarray, net: np.ndarray, n_merchants: int) -> Level:
+    # one cell per (period, category, merchant); the spend and net sums share the grouping
+    pair = (category.astype(np.int64) + 1) * (n_merchants + 1) + (merchant + 1)
+    period_u, pair_u, spend_sum, net_sum = _sum_by(period, pair, spend, net)
+    return Level(grain, period_u, (pair_u // (n_merchants + 1) - 1).astype(np.int32),
+                 (pair_u % (n_merchants + 1) - 1).astype(np.int32), spend_sum, net_sum)
+
+
+def _codes(column: pd.Series) -> Tuple[np.ndarray, pd.Index]:
+    # categorical columns already carry codes; -1 marks a missing label either way
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy().astype(np.int32), column.cat.categories
+    codes, labels = pd.factorize(column, sort=True)
+    return codes.astype(np.int32), labels
+
+
+@dataclass(frozen=True)
+class Cube:
+    """
+    Rollups of one snapshot's transactions. levels maps each of GRAINS to its cells;
+    category and merchant codes index categories and merchants. Amounts are in
+    stored units; results are divided by scale.
+    """
+    categories: pd.Index
+    merchants: pd.Index
+    levels: Dict[str, Level]
+    scale: int = 1
+
+    @property
+    def nbytes(self) -> int:
+        return sum(level.nbytes for level in self.levels.values()) + int(
+            self.categories.memory_usage(deep=True) + self.merchants.memory_usage(deep=True))
+
+    def _grain(self, lo: Optional[int], hi: Optional[int], grains: Tuple[str, ...]) -> str:
+        """The first of grains whose periods tile [lo, hi] exactly; day always does."""
+        for grain in grains:
+            # lo opens a period and hi closes one
+            starts = lo is None or period_ids(np.int64(lo - 1), grain) != period_ids(np.int64(lo), grain)
+            ends = hi is None or period_ids(np.int64(hi), grain) != period_ids(np.int64(hi + 1), grain)
+            if starts and ends:
+                return grain
+        return "day"
+
+    def _hits(self, labels: pd.Index, value: str) -> np.ndarray:
+        # codes of the labels equal to value, ignoring case
+        return np.flatnonzero(labels.astype(str).str.lower() == value.strip().lower())
+
+    def cells(self, start: DateLike = None, end: DateLike = None, category: Optional[str] = None,
+              merchant: Optional[str] = None, grains: Tuple[str, ...] = ("month", "week")) -> Level:
+        """
+        Cells dated from start to end (whole days, inclusive) with the given labels
+        (ignoring case), from the first of grains that fits the range, else by day.
+        """
+        lo, hi = _day(start), _day(end)
+        grain = self._grain(lo, hi, grains)
+        level = self.levels[grain]
+        i = 0 if lo is None else int(np.searchsorted(level.period, period_ids(np.int64(lo), grain), "left"))
+        j = len(level.period) if hi is None else int(np.searchsorted(level.period, period_ids(np.int64(hi), grain), "right"))
+        cells = level.take(slice(i, max(i, j)))
+        if category:
+            cells = cells.take(np.isin(cells.category, self._hits(self.categories, category)))
+        if merchant:
+            cells = cells.take(np.isin(cells.merchant, self._hits(self.merchants, merchant)))
+        return cells
+
+    def periods(self, grain: str) -> np.ndarray:
+        """First days of the periods of grain with spend in a known category, oldest first."""
+        level = self.levels[grain]
+        return period_starts(np.unique(level.period[(level.spend > 0) & (level.category >= 0)]), grain)
+
+    def total(self, start: DateLike = None, end: DateLike = None, category: Optional[str] = None,
+              merchant: Optional[str] = None) -> float:
+        """Spend from start to end, optionally for one category / merchant."""
+        return float(self.cells(start, end, category, merchant).spend.sum()) / self.scale
+
+    def by_label(self, by: str, start: DateLike = None, end: DateLike = None, category: Optional[str] = None,
+                 merchant: Optional[str] = None) -> pd.Series:
+        """Spend per category or merchant ("description") with any spend, in code order."""
+        cells = self.cells(start, end, category, merchant)
+        codes, labels = (cells.category, self.categories) if by == "category" else (cells.merchant, self.merchants)
+        keep = codes >= 0
+        sums = np.bincount(codes[keep], weights=cells.spend[keep], minlength=len(labels))
+        present = np.flatnonzero(sums > 0)
+        index = pd.Index(labels[present].astype(object), name=by if by == "category" else "description")
+        return pd.Series(sums[present] / self.scale, index=index, name="amount")
+
+    def by_period(self, grain: str, start: DateLike = None, end: DateLike = None,
+                  category: Optional[str] = None, merchant: Optional[str] = None,
+                  measure: str = "spend") -> pd.Series:
+        """
+        Spend (or, with measure="net", the net amount) per period of grain that has
+        any, indexed by the period's first day.
+        """
+        cells = self.cells(start, end, category, merchant, grains=(grain,))
+        values = getattr(cells, measure)
+        periods = period_ids(cells.period, grain) if cells.grain != grain else cells.period
+        keep = values > 0 if measure == "spend" else slice(None)
+        period_u, _, sums = _sum_by(periods[keep], np.zeros(len(periods[keep]), dtype=np.int64), values[keep])
+        index = pd.DatetimeIndex(period_starts(period_u, grain).astype("datetime64[s]"), name="date")
+        return pd.Series(sums / self.scale, index=index, name="amount")
+
+    def table(self, grain: str, by: str, start: DateLike = None, end: DateLike = None,
+              category: Optional[str] = None, merchant: Optional[str] = None,
+              label_major: bool = False, codes: bool = False) -> Dict[str, np.ndarray]:
+        """
+        Spend per (period of grain, category or merchant) as columns "period" (first
+        day), by and "amount", ordered by period then label code (label_major: the
+        other way round). Pairs without spend are left out. With codes, by holds the
+        label codes (indexing categories / merchants) instead of the labels as text.
+        """
+        cells = self.cells(start, end, category, merchant, grains=(grain,))
+        label, labels = (cells.category, self.categories) if by == "category" else (cells.merchant, self.merchants)
+        periods = period_ids(cells.period, grain) if cells.grain != grain else cells.period
+        keep = (label >= 0) & (cells.spend > 0)
+        if label_major:
+            code_u, period_u, sums = _sum_by(label[keep], periods[keep], cells.spend[keep])
+        else:
+            period_u, code_u, sums = _sum_by(periods[keep], label[keep], cells.spend[keep])
+        names = code_u if codes else np.asarray(labels[code_u].astype(str), dtype=object)
+        return {"period": period_starts(period_u, grain), by: names, "amount": sums / self.scale}
+
+    def merge(self, other: "Cube") -> "Cube":
+        """
+        The cube of both snapshots' transactions. At each grain, only the periods
+        from other's first day on are summed again; the older cells are kept.
+        """
+        categories = self.categories.union(other.categories)
+        merchants = self.merchants.union(other.merchants)
+        maps = []
+        for cube in (self, other):
+            # code -1 picks the appended -1
+            maps.append((np.append(categories.get_indexer(cube.categories), -1).astype(np.int32),
+                         np.append(merchants.get_indexer(cube.merchants), -1).astype(np.int32)))
+        # the kept cells stay in code order only if self's codes keep their order
+        ordered = all(np.all(np.diff(m[:-1]) > 0) for m in maps[0])
+        days = other.levels["day"].period
+        levels = {}
+        for grain in GRAINS:
+            mine, theirs = (_recode(cube.levels[grain], *m) for cube, m in zip((self, other), maps))
+            cut = 0
+            if ordered:
+                cut = len(mine.period) if not len(days) else int(
+                    np.searchsorted(mine.period, period_ids(days.min(), grain), "left"))
+            rows = _concat_levels(grain, [mine.take(slice(cut, None)), theirs])
+            summed = _level(grain, rows.period, rows.category, rows.merchant, rows.spend, rows.net, len(merchants))
+            levels[grain] = _concat_levels(grain, [mine.take(slice(None, cut)), summed])
+        return Cube(categories, merchants, levels, self.scale)
+
+
+def _recode(level: Level, cat_map: np.ndarray, mer_map: np.ndarray) -> Level:
+    return Level(level.grain, level.period, cat_map[level.category], mer_map[level.merchant], level.spend, level.net)
+
+
+def _concat_levels(grain: str, parts: List[Level]) -> Level:
+    return Level(grain, *(np.concatenate([getattr(p, f) for p in parts])
+                          for f in ("period", "category", "merchant", "spend", "net")))
+
+
+def _from_days(rows: Level, categories: pd.Index, merchants: pd.Index, scale: int) -> Cube:
+    # rows: day-dated, not necessarily distinct; coarser grains are summed from the day cells
+    day = _level("day", rows.period, rows.category, rows.merchant, rows.spend, rows.net, len(merchants))
+    levels = {"day": day}
+    for grain in GRAINS[1:]:
+        levels[grain] = _level(grain, period_ids(day.period, grain), day.category, day.merchant,
+                               day.spend, day.net, len(merchants))
+    return Cube(categories, merchants, levels, scale)
+
+
+def build(df: pd.DataFrame, scale: int = 1) -> Cube:
+    """The cube of a frame with the stored date / description / amount / category columns."""
+    category, categories = _codes(df["category"])
+    merchant, merchants = _codes(df["description"])
+    days = df["date"].to_numpy().astype("datetime64[D]").astype(np.int64)
+    amount = df["amount"].to_numpy()
+    spend = np.where(amount > 0, amount, 0).astype(amount.dtype)
+    day = Level("day", days, category, merchant, spend, amount)
+    return _from_days(day, categories, merchants, scale)
@@ -0,0 +1,193 @@
+import re
+import threading
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Inverted index over the words of the description and category labels. It is built
+# with the snapshot (or, for a snapshot made by an append, on its first search), so a
+# lookup only touches the rows of the labels that match.
+
+FIELDS = ("description", "category")
+
+# Rows examined at a time while looking for the newest matches
+_CHUNK = 4096
+# Above this many matching labels, walk all rows newest first instead of label by label
+_MAX_LABEL_SCANS = 64
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _WORD.findall(str(text).lower())
+
+
+class _FieldIndex:
+    """
+    One column: labels are the distinct values, codes the label of each row (-1 for
+    none), postings map a word to the label codes containing it, and
+    order[starts[c]:starts[c + 1]] are the rows of label c, newest first, with
+    neg_days the matching negated dates (days since 1970, ascending within a label).
+    """
+
+    def __init__(self, column: pd.Series, days: np.ndarray):
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            codes, labels = column.cat.codes.to_numpy(), column.cat.categories
+        else:
+            codes, labels = pd.factorize(column)
+        self.codes = np.asarray(codes)
+        self.labels = [str(label) for label in labels]
+        self.order = np.lexsort((-days, self.codes)).astype(np.int32)
+        self.starts = np.searchsorted(self.codes[self.order], np.arange(len(self.labels) + 1))
+        self.neg_days = (-days[self.order]).astype(np.int32)
+        postings: Dict[str, List[int]] = {}
+        for code, label in enumerate(self.labels):
+            for word in set(tokenize(label)):
+                postings.setdefault(word, []).append(code)
+        self.postings = {w: np.array(c, dtype=np.int64) for w, c in postings.items()}
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.order.nbytes + self.starts.nbytes + self.neg_days.nbytes)
+
+    def scores(self, words: Iterable[str]) -> np.ndarray:
+        """
+        Per label code, how many of words its label contains; one extra trailing zero
+        so that scores[codes] gives 0 for rows without a label.
+        """
+        score = np.zeros(len(self.labels) + 1, dtype=np.int64)
+        for word in set(words):
+            codes = self.postings.get(word)
+            if codes is not None:
+                score[codes] += 1
+        return score
+
+
+def _window(neg_days: np.ndarray, start: int, stop: int, first_day: Optional[int],
+            last_day: Optional[int]) -> slice:
+    """Positions within [start, stop) of a newest-first run dated within [first_day, last_day]."""
+    neg = neg_days[start:stop]
+    lo = int(np.searchsorted(neg, -last_day, "left")) if last_day is not None else 0
+    hi = int(np.searchsorted(neg, -first_day, "right")) if first_day is not None else stop - start
+    return slice(start + lo, start + hi)
+
+
+class TransactionIndex:
+    """
+    Word lookup over a transactions frame; results are row positions into that frame.
+    lazy defers the build to the first search, which keeps the frame until then.
+    """
+
+    def __init__(self, df: pd.DataFrame, lazy: bool = False):
+        self._frame: Optional[pd.DataFrame] = df
+        self._lock = threading.Lock()
+        if not lazy:
+            self.build()
+
+    @property
+    def built(self) -> bool:
+        return self._frame is None
+
+    def build(self):
+        """Build the index if it has not been; safe to call from several threads."""
+        if self._frame is None:
+            return
+        with self._lock:
+            df = self._frame
+            if df is None:
+                return  # another thread built it meanwhile
+            days = df["date"].to_numpy().astype("datetime64[D]").astype(np.int64) if len(df) else np.empty(0, np.int64)
+            self.fields = {name: _FieldIndex(df[name], days) for name in FIELDS}
+            # all rows newest first, for words matching too many labels to visit one by one
+            self.order = np.argsort(-days, kind="stable").astype(np.int32)
+            self.neg_days = (-days[self.order]).astype(np.int32)
+            self._frame = None  # last: the fields are complete once it is cleared
+
+    @property
+    def nbytes(self) -> int:
+        if not self.built:
+            return 0
+        return int(self.order.nbytes + self.neg_days.nbytes) + sum(f.nbytes for f in self.fields.values())
+
+    def __getstate__(self):
+        self.build()
+        state = dict(self.__dict__)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._frame = None
+        self._lock = threading.Lock()
+
+    def search(self, words: Iterable[str], k: int, first_day: Optional[int] = None,
+               last_day: Optional[int] = None,
+               keep: Optional[Callable[[np.ndarray], np.ndarray]] = None) -> np.ndarray:
+        """
+        Positions of up to k rows whose description (or, failing that, category)
+        contains any of words, best first: matching description words count double,
+        category words once, and newer rows win ties. first_day/last_day (days since
+        1970) bound the dates; keep(rows) returns a mask of rows to consider.
+        """
+        self.build()
+        words = set(words)
+        description, category = self.fields["description"], self.fields["category"]
+        desc, cat = description.scores(words), category.scores(words)
+        if desc.any():
+            field, scores, weight, bonus = description, desc, 2, int(cat.max())
+        elif cat.any():
+            field, scores, weight, bonus = category, cat, 1, 0
+        else:
+            return np.empty(0, dtype=np.int32)
+
+        def score_of(rows: np.ndarray) -> np.ndarray:
+            return 2 * desc[description.codes[rows]] + cat[category.codes[rows]]
+
+        found: List[np.ndarray] = []
+        found_days: List[np.ndarray] = []
+
+        def collect(order: np.ndarray, neg_days: np.ndarray, w: slice, tier: int):
+            # Rows come newest first, so stop once k of them have the best score a row
+            # of this tier can reach; older rows cannot outrank them.
+            best = weight * tier + bonus
+            hits = 0
+            for start in range(w.start, w.stop, _CHUNK):
+                chunk = slice(start, min(start + _CHUNK, w.stop))
+                rows, neg = order[chunk], neg_days[chunk]
+                if order is self.order:
+                    mask = scores[field.codes[rows]] == tier
+                    rows, neg = rows[mask], neg[mask]
+                if keep is not None:
+                    mask = keep(rows)
+                    rows, neg = rows[mask], neg[mask]
+                found.append(rows)
+                found_days.append(-neg)
+                hits += int((score_of(rows) == best).sum())
+                if hits >= k:
+                    return
+
+        tiers = sorted(set(scores[scores > 0].tolist()), reverse=True)
+        for n, tier in enumerate(tiers):
+            matched = np.flatnonzero(scores == tier)
+            if len(matched) > _MAX_LABEL_SCANS:
+                collect(self.order, self.neg_days, _window(self.neg_days, 0, len(self.order), first_day, last_day), tier)
+            else:
+                for code in matched:
+                    w = _window(field.neg_days, int(field.starts[code]), int(field.starts[code + 1]),
+                                first_day, last_day)
+                    collect(field.order, field.neg_days, w, tier)
+            # lower tiers cannot outrank k rows already scoring above their best
+            if n + 1 < len(tiers):
+                reachable = weight * tiers[n + 1] + bonus
+                if sum(int((score_of(r) > reachable).sum()) for r in found) >= k:
+                    break
+
+        if not found:
+            return np.empty(0, dtype=np.int32)
+        rows = np.concatenate(found)
+        days = np.concatenate(found_days).astype(np.int64)
+        rank = (score_of(rows) << 32) + days  # days since 1970 stay far below 2**32
+        if len(rank) > k:
+            top = np.argpartition(-rank, k - 1)[:k]
+            rows, rank = rows[top], rank[top]
+        return rows[np.argsort(-rank, kind="stable")]
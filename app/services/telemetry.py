@@ -0,0 +1,190 @@
+import os
+import time
+import math
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# In-process counters and latency histograms, rendered in the Prometheus text format
+# by GET /metrics, and per-request stage timings: a request sent with "X-Profile: 1"
+# gets a Server-Timing header listing the spans it went through. Values are per
+# process; with several uvicorn workers each one is scraped (or counted) separately.
+
+# Set PROFILE_HEADER=0 to ignore X-Profile (the header reveals internal stage names)
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "1") != "0"
+
+# Seconds; fine at the low end, where metrics and local answers land
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name, self.description, self.label_names = name, description, tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(str(labels[n]) for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.description, self.label_names = name, description, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket (last is +Inf)], sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels[n]) for n in self.label_names)
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += count
+                    le = _labels(self.label_names + ("le",), key + (_number(bound),))
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total[0])}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+_registry: List = []
+
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+requests = Histogram("finance_request_seconds", "HTTP request latency by route.", ["method", "route", "status"])
+stages = Histogram("finance_stage_seconds", "Latency of internal stages (metrics, ingestion, LLM calls).", ["stage"])
+rows_ingested = Counter("finance_rows_ingested_total", "Transactions stored by uploads.", ["mode"])
+llm_retries = Counter("finance_llm_retries_total", "LLM attempts that were retried, by HTTP status.", ["status"])
+prompt_chars = Histogram("finance_llm_prompt_chars", "Size of the prompts sent to the LLM, in characters.",
+                         buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000))
+
+# Spans of the current request when it asked for a profile (X-Profile: 1)
+_profile: "contextvars.ContextVar[Optional[List[Tuple[str, float]]]]" = contextvars.ContextVar("profile", default=None)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time the block into finance_stage_seconds{stage=...} (and the request's profile)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stages.observe(elapsed, stage=stage)
+        profile = _profile.get()
+        if profile is not None:
+            profile.append((stage, elapsed))
+
+
+def timed(stage: str):
+    """Decorator form of span for plain functions."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _server_timing(profile: List[Tuple[str, float]], total: float) -> str:
+    # Server-Timing: name;dur=milliseconds, one entry per span, in the order they ended
+    entries = [f'{i}-{stage.replace(" ", "_")};dur={elapsed * 1000:.2f}' for i, (stage, elapsed) in enumerate(profile)]
+    return ", ".join(entries + [f"total;dur={total * 1000:.2f}"])
+
+
+def _route_template(scope) -> str:
+    # scope["route"] is the matched route, but routes of an included router keep their
+    # own path ("/by-category"): the router prefix is the part of the request path
+    # before the shortest tail the route's pattern matches
+    route = scope.get("route")
+    if route is None or not hasattr(route, "path_regex"):
+        return "unmatched"
+    path = scope["path"]
+    for i, char in enumerate(path):
+        if char == "/" and route.path_regex.match(path[i:]):
+            return path[:i] + route.path
+    return route.path
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware: observes every HTTP request into finance_request_seconds, labelled
+    with the route template (not the raw path, which would include ids), and answers
+    X-Profile: 1 with a Server-Timing header. For streamed responses the header only
+    covers the work done before the first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        profiled = PROFILE_HEADER and any(k == b"x-profile" and v.strip() not in (b"", b"0")
+                                          for k, v in scope.get("headers", ()))
+        profile: Optional[List[Tuple[str, float]]] = [] if profiled else None
+        token = _profile.set(profile)
+        status = 500
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile is not None:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", _server_timing(profile, time.perf_counter() - started).encode()))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            _profile.reset(token)
+            requests.observe(time.perf_counter() - started, method=scope["method"],
+                             route=_route_template(scope), status=str(status))
@@ -0,0 +1,139 @@
+import os
+import sys
+import asyncio
+import argparse
+from benchmarks import datagen, report
+from benchmarks.stub_llm import StubConfig, StubServer
+
+# python -m benchmarks <command>; see the Benchmarks section of the README.
+
+
+def _sizes(text: str):
+    return tuple(int(float(size)) for size in text.split(","))
+
+
+def _stub_options(parser: argparse.ArgumentParser):
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=100.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-error-status", type=int, default=503)
+
+
+def _stub_config(args) -> StubConfig:
+    return StubConfig(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms,
+                      error_rate=args.llm_error_rate, error_status=args.llm_error_status)
+
+
+def _result_options(parser: argparse.ArgumentParser):
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="fail (exit 1) on regressions against this results file")
+    parser.add_argument("--save-baseline", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown before it counts as a regression (0.2 = 20%%)")
+
+
+def _load(args) -> report.Results:
+    from benchmarks import load
+    results: report.Results = {}
+
+    def run(url: str):
+        for scenario in args.scenarios:
+            results.update(asyncio.run(load.run_scenario(
+                url, scenario, concurrency=args.concurrency, duration=args.duration,
+                requests=args.requests, seed_rows=args.seed_rows, upload_rows=args.upload_rows)))
+
+    if args.url:
+        run(args.url)
+        return results
+    stub = StubServer(config=_stub_config(args)).start()
+    try:
+        with load.backend(stub.base_url, port=args.port, workers=args.workers) as url:
+            run(url)
+    finally:
+        stub.shutdown()
+    print(f"stub LLM: {stub.calls} calls, {stub.failures} failed")
+    return results
+
+
+def _in_process(args) -> report.Results:
+    # before the app is imported: keep the benchmark ledgers in memory
+    os.environ["DATA_STORE_DIR"] = ""
+    from benchmarks import scale
+    if args.command == "scale":
+        return scale.endpoint_latency(args.sizes, repeat=args.repeat)
+    return scale.ingest(args.sizes, repeat=args.repeat)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    gen = commands.add_parser("generate", help="write a synthetic transactions CSV")
+    gen.add_argument("output")
+    gen.add_argument("--rows", type=int, default=100_000)
+    gen.add_argument("--categories", type=int, default=8)
+    gen.add_argument("--merchants", type=int, default=500)
+    gen.add_argument("--days", type=int, default=730)
+    gen.add_argument("--seed", type=int, default=0)
+
+    stub = commands.add_parser("stub-llm", help="serve the stub Gemini API")
+    stub.add_argument("--port", type=int, default=8700)
+    _stub_options(stub)
+
+    load = commands.add_parser("load", help="run load scenarios over HTTP")
+    load.add_argument("scenarios", nargs="+", choices=["upload", "dashboard", "chatbot", "mixed"])
+    load.add_argument("--url", help="target a running backend instead of starting one with the stub LLM")
+    load.add_argument("--port", type=int, default=8765, help="port for the backend started by the run")
+    load.add_argument("--workers", type=int, default=1, help="uvicorn workers of the backend started by the run")
+    load.add_argument("--concurrency", type=int, default=8)
+    load.add_argument("--duration", type=float, default=30.0, help="seconds per scenario")
+    load.add_argument("--requests", type=int, help="stop after this many operations instead")
+    load.add_argument("--seed-rows", type=int, default=100_000, help="transactions loaded before the run")
+    load.add_argument("--upload-rows", type=int, default=100_000, help="transactions per upload operation")
+    _stub_options(load)
+    _result_options(load)
+
+    scale = commands.add_parser("scale", help="per-endpoint latency at several ledger sizes, in process")
+    scale.add_argument("--sizes", type=_sizes, default=(10_000, 1_000_000, 10_000_000))
+    scale.add_argument("--repeat", type=int, default=20)
+    _result_options(scale)
+
+    ingest = commands.add_parser("ingest", help="time the parse / prepare / save steps of an upload")
+    ingest.add_argument("--sizes", type=_sizes, default=(100_000, 1_000_000))
+    ingest.add_argument("--repeat", type=int, default=3)
+    _result_options(ingest)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        df = datagen.generate(args.rows, categories=args.categories, merchants=args.merchants,
+                              days=args.days, seed=args.seed)
+        datagen.to_csv(df, args.output)
+        return 0
+    if args.command == "stub-llm":
+        server = StubServer(args.port, _stub_config(args))
+        print(f"Stub Gemini API on {server.base_url}; run the backend with GEMINI_API_BASE={server.base_url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    results = _load(args) if args.command == "load" else _in_process(args)
+    print(report.table(results))
+    if args.output:
+        report.save(results, args.output)
+    if args.save_baseline:
+        report.save(results, args.save_baseline)
+    if args.baseline:
+        regressions = report.compare(results, report.load(args.baseline), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:", file=sys.stderr)
+            print("\n".join(regressions), file=sys.stderr)
+            return 1
+        print(f"\nNo regressions against {args.baseline} (tolerance {args.tolerance:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+from typing import Optional
+import numpy as np
+import pandas as pd
+
+# Synthetic transactions with the REQUIRED_COLUMNS headers, in the CSV layout the
+# UI uploads (day-first dates). Merchant popularity is skewed the way real ledgers
+# are: a few merchants take most of the rows.
+
+CATEGORY_NAMES = ["Food", "Transport", "Entertainment", "Bills", "Rent", "Shopping",
+                  "Health", "Travel", "Education", "Gifts", "Utilities", "Fees"]
+
+DATE_FORMAT = "%d/%m/%Y"
+
+
+def _labels(prefix: str, n: int, named=()) -> np.ndarray:
+    names = list(named[:n]) + [f"{prefix} {i}" for i in range(len(named), n)]
+    return np.array(names, dtype=object)
+
+
+def generate(rows: int, categories: int = 8, merchants: int = 500, days: int = 730,
+             end: str = "2024-12-31", refund_share: float = 0.02, seed: int = 0) -> pd.DataFrame:
+    """
+    rows transactions spread uniformly over the days ending at end, with categories
+    and merchants distinct labels. Each merchant sticks to one category, and about
+    refund_share of the rows are refunds (negative amounts). Same seed, same frame.
+    """
+    rng = np.random.default_rng(seed)
+    category_names = _labels("Category", categories, CATEGORY_NAMES)
+    merchant_names = _labels("Merchant", merchants)
+    merchant_category = rng.integers(0, categories, merchants)
+    # typical spend per category, in pounds
+    category_scale = rng.uniform(5, 120, categories)
+
+    # Zipf-like popularity: merchant i is picked with weight 1 / (i + 1)
+    weights = 1.0 / np.arange(1, merchants + 1)
+    merchant = rng.choice(merchants, rows, p=weights / weights.sum())
+    category = merchant_category[merchant]
+
+    amount = np.round(rng.lognormal(0, 0.6, rows) * category_scale[category], 2)
+    amount[rng.random(rows) < refund_share] *= -1
+
+    # strftime once per calendar day, not once per row
+    calendar = pd.date_range(end=end, periods=days, freq="D").strftime(DATE_FORMAT).to_numpy()
+    day = rng.integers(0, days, rows)
+
+    return pd.DataFrame({
+        "date": calendar[day],
+        "description": merchant_names[merchant],
+        "amount": amount,
+        "category": category_names[category],
+    })
+
+
+def to_csv(df: pd.DataFrame, path: Optional[str] = None) -> Optional[bytes]:
+    """df as upload-ready CSV: written to path, or returned as bytes."""
+    if path is not None:
+        df.to_csv(path, index=False)
+        return None
+    return df.to_csv(index=False).encode()
@@ -0,0 +1,248 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+import itertools
+import subprocess
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+import httpx
+from benchmarks import datagen
+from benchmarks.report import Results, summarize
+
+# Load scenarios run against a live backend over HTTP: a number of concurrent
+# clients each pick weighted operations for a fixed time (or request count), and
+# every operation's latency is recorded under "<scenario>:<operation>". Uploads
+# count until their background job is done, streams until the last event.
+
+Operation = Callable[["Session"], Awaitable[bool]]
+
+
+class Session:
+    """What an operation needs: the client, the tenant holding the seeded data and a random source."""
+
+    def __init__(self, client: httpx.AsyncClient, tenant: str, upload_csv: bytes, rng: random.Random):
+        self.client = client
+        self.tenant = tenant
+        self.upload_csv = upload_csv
+        self.rng = rng
+        self.etag = ""
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"X-Tenant-ID": self.tenant}
+
+
+async def upload(client: httpx.AsyncClient, data: bytes, tenant: str, poll: float = 0.05,
+                 unknown_for: float = 5.0) -> bool:
+    """
+    Replace tenant's data with the CSV and wait for the job; True when it is done.
+    A 404 (a worker that has not seen the job) is retried for up to unknown_for seconds.
+    """
+    r = await client.post("/upload/", files={"file": ("bench.csv", data, "text/csv")},
+                          headers={"X-Tenant-ID": tenant})
+    if r.status_code != 202:
+        return False
+    job = r.json()
+    deadline = None
+    while job["status"] not in ("done", "failed"):
+        await asyncio.sleep(poll)
+        r = await client.get(f"/upload/jobs/{job['job_id']}", headers={"X-Tenant-ID": tenant})
+        if r.status_code == 404:
+            deadline = deadline or time.perf_counter() + unknown_for
+            if time.perf_counter() < deadline:
+                continue
+        if r.status_code != 200:
+            return False
+        job, deadline = r.json(), None
+    return job["status"] == "done"
+
+
+async def _upload(s: Session) -> bool:
+    # a tenant of its own, so reads in a mixed run keep seeing the seeded data
+    return await upload(s.client, s.upload_csv, f"{s.tenant}-upload")
+
+
+async def _dashboard(s: Session) -> bool:
+    r = await s.client.get("/summary/dashboard", headers=s.headers)
+    return r.status_code == 200
+
+
+# the summary calls the UI made, one after another, before /summary/dashboard
+_PAGE_CALLS = [("/summary/by-category", {}), ("/summary/monthly-totals", {}), ("/summary/top-merchants", {"n": 5}),
+               ("/summary/top-expenses-week", {"k": 3}), ("/summary/daily-totals", {})]
+
+
+async def _page_five_calls(s: Session) -> bool:
+    for path, params in _PAGE_CALLS:
+        r = await s.client.get(path, params=params, headers=s.headers)
+        if r.status_code != 200:
+            return False
+    return True
+
+
+async def _dashboard_columnar(s: Session) -> bool:
+    r = await s.client.get("/summary/dashboard", params={"format": "columnar"}, headers=s.headers)
+    return r.status_code == 200
+
+
+async def _dashboard_cached(s: Session) -> bool:
+    # what a UI refresh costs when the data has not changed (the first call fetches the ETag)
+    r = await s.client.get("/summary/dashboard", headers=dict(s.headers, **{"If-None-Match": s.etag}))
+    if r.status_code == 200:
+        s.etag = r.headers.get("etag", "")
+    return r.status_code in (200, 304)
+
+
+async def _filtered_summary(s: Session) -> bool:
+    month = s.rng.randint(1, 12)
+    params = {"start": f"2024-{month:02d}-01", "end": f"2024-{month:02d}-28"}
+    r = await s.client.get("/summary/by-category", params=params, headers=s.headers)
+    return r.status_code == 200
+
+
+async def _daily_totals(s: Session) -> bool:
+    r = await s.client.get("/summary/daily-totals", params={"format": "columnar"}, headers=s.headers)
+    return r.status_code == 200
+
+
+LOCAL_QUESTIONS = [
+    "How much did I spend on {category} in {month}?",
+    "What was my top merchant last week?",
+    "What did I spend in total last month?",
+    "Which category did I spend the most on in {month}?",
+]
+
+# Numbers the LLM questions, so the answer cache never serves them
+_asked = itertools.count()
+
+LLM_QUESTIONS = [
+    "Any tips to cut my {category} spending? ({n})",
+    "Why did my spending change compared with earlier months? ({n})",
+    "Should I budget more for {category}? ({n})",
+]
+
+
+def _question(s: Session, templates: List[str]) -> str:
+    return s.rng.choice(templates).format(category=s.rng.choice(datagen.CATEGORY_NAMES[:8]),
+                                          month=s.rng.choice(["March", "June", "September"]),
+                                          n=next(_asked))
+
+
+async def _chat_local(s: Session) -> bool:
+    r = await s.client.post("/chatbot/", json={"query": _question(s, LOCAL_QUESTIONS)}, headers=s.headers)
+    return r.status_code == 200
+
+
+async def _chat_llm(s: Session) -> bool:
+    r = await s.client.post("/chatbot/", json={"query": _question(s, LLM_QUESTIONS)}, headers=s.headers)
+    return r.status_code == 200 and r.json().get("served_by") == "llm"
+
+
+async def _chat_stream(s: Session) -> bool:
+    async with s.client.stream("POST", "/chatbot/stream", json={"query": _question(s, LLM_QUESTIONS)},
+                               headers=s.headers) as r:
+        async for _ in r.aiter_bytes():
+            pass
+    return r.status_code == 200
+
+
+# scenario -> [(operation name, weight, operation)]
+SCENARIOS: Dict[str, List[Tuple[str, float, Operation]]] = {
+    "upload": [("upload", 1, _upload)],
+    "dashboard": [("dashboard", 4, _dashboard), ("page_five_calls", 4, _page_five_calls),
+                  ("dashboard_columnar", 2, _dashboard_columnar),
+                  ("dashboard_304", 2, _dashboard_cached), ("by_category_month", 1, _filtered_summary),
+                  ("daily_totals", 1, _daily_totals)],
+    "chatbot": [("chat_local", 5, _chat_local), ("chat_llm", 4, _chat_llm), ("chat_stream", 1, _chat_stream)],
+    "mixed": [("dashboard", 6, _dashboard), ("dashboard_304", 4, _dashboard_cached),
+              ("by_category_month", 2, _filtered_summary), ("chat_local", 4, _chat_local),
+              ("chat_llm", 3, _chat_llm), ("upload", 1, _upload)],
+}
+
+
+async def run_scenario(base_url: str, scenario: str, concurrency: int = 8, duration: float = 30.0,
+                       requests: Optional[int] = None, seed_rows: int = 100_000,
+                       upload_rows: int = 100_000, tenant: str = "bench", seed: int = 0) -> Results:
+    """
+    Seed tenant with seed_rows generated transactions, then run scenario with
+    concurrency clients for duration seconds, or until requests operations are done.
+    """
+    operations = SCENARIOS[scenario]
+    names = [name for name, _, _ in operations]
+    weights = [weight for _, weight, _ in operations]
+    samples: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    issued = itertools.count()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        if not await upload(client, datagen.to_csv(datagen.generate(seed_rows, seed=seed)), tenant):
+            raise RuntimeError("Seeding the benchmark tenant failed")
+        upload_csv = datagen.to_csv(datagen.generate(upload_rows, seed=seed + 1)) if "upload" in names else b""
+
+        async def worker(i: int, deadline: float):
+            session = Session(client, tenant, upload_csv, random.Random(seed * 1000 + i))
+            while time.perf_counter() < deadline and (requests is None or next(issued) < requests):
+                index = session.rng.choices(range(len(operations)), weights)[0]
+                name, _, operation = operations[index]
+                started = time.perf_counter()
+                try:
+                    ok = await operation(session)
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    samples[name].append(time.perf_counter() - started)
+                else:
+                    errors[name] += 1
+
+        started = time.perf_counter()
+        deadline = started + (duration if requests is None else float("inf"))
+        await asyncio.gather(*(worker(i, deadline) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    results = {f"{scenario}:{name}": summarize(samples[name], errors[name], elapsed)
+               for name in names if samples[name] or errors[name]}
+    every = [latency for name in names for latency in samples[name]]
+    results[f"{scenario}:all"] = summarize(every, sum(errors.values()), elapsed)
+    return results
+
+
+@contextmanager
+def backend(llm_base_url: str, port: int = 8765, workers: int = 1,
+            env: Optional[Dict[str, str]] = None, timeout: float = 60.0) -> Iterator[str]:
+    """
+    Run uvicorn app.main:app in a subprocess wired to the stub LLM, with an empty
+    temporary DATA_STORE_DIR; yields its base URL. Other settings come from the
+    environment (and env).
+    """
+    with tempfile.TemporaryDirectory(prefix="finance-bench-") as data_dir:
+        child_env = dict(os.environ, GEMINI_API_BASE=llm_base_url, GEMINI_API_KEY="bench",
+                         DATA_STORE_DIR=data_dir, **(env or {}))
+        cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+               "--workers", str(workers), "--log-level", "warning"]
+        server = subprocess.Popen(cmd, env=child_env)
+        url = f"http://127.0.0.1:{port}"
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                if server.poll() is not None:
+                    raise RuntimeError(f"Backend exited with code {server.returncode}")
+                try:
+                    if httpx.get(url + "/", timeout=1).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Backend did not start in time")
+                time.sleep(0.2)
+            yield url
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
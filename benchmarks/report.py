@@ -0,0 +1,67 @@
+import json
+from typing import Dict, List, Sequence
+import numpy as np
+
+# Results are {name: {"count", "errors", "p50_ms", "p95_ms", "p99_ms", "throughput_rps"}}.
+# A stored baseline is the same JSON; compare() flags every latency that grew, or
+# throughput that fell, by more than the tolerance.
+
+Results = Dict[str, Dict[str, float]]
+
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+
+# Differences below this many milliseconds are noise, whatever the ratio
+MIN_LATENCY_DELTA_MS = 1.0
+
+
+def summarize(latencies: Sequence[float], errors: int = 0, elapsed: float = 0.0) -> Dict[str, float]:
+    """Percentiles (in ms) of latencies given in seconds; throughput counts every request over elapsed seconds."""
+    count = len(latencies) + errors
+    stats = {"count": count, "errors": errors}
+    if len(latencies):
+        p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+        stats.update(p50_ms=round(p50, 3), p95_ms=round(p95, 3), p99_ms=round(p99, 3))
+    if elapsed > 0:
+        stats["throughput_rps"] = round(count / elapsed, 2)
+    return stats
+
+
+def compare(results: Results, baseline: Results, tolerance: float = 0.2) -> List[str]:
+    """Regressions of results against baseline, as readable lines; empty when none."""
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key in LATENCY_KEYS:
+            if key in stats and key in base:
+                now, before = stats[key], base[key]
+                if now > before * (1 + tolerance) and now - before > MIN_LATENCY_DELTA_MS:
+                    regressions.append(f"{name}: {key} {before:.1f} -> {now:.1f} ms ({now / before - 1:+.0%})")
+        if "throughput_rps" in stats and base.get("throughput_rps"):
+            now, before = stats["throughput_rps"], base["throughput_rps"]
+            if now < before * (1 - tolerance):
+                regressions.append(f"{name}: throughput {before:.1f} -> {now:.1f} req/s ({now / before - 1:+.0%})")
+        if stats.get("errors", 0) > base.get("errors", 0):
+            regressions.append(f"{name}: errors {base.get('errors', 0)} -> {stats['errors']}")
+    return regressions
+
+
+def table(results: Results) -> str:
+    header = f"{'benchmark':<44}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}"
+    lines = [header, "-" * len(header)]
+    for name, s in results.items():
+        cells = [f"{s[k]:>10.1f}" if k in s else f"{'-':>10}" for k in LATENCY_KEYS + ("throughput_rps",)]
+        lines.append(f"{name:<44}{s['count']:>8}{s['errors']:>8}" + "".join(cells))
+    return "\n".join(lines)
+
+
+def load(path: str) -> Results:
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def save(results: Results, path: str):
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=2, sort_keys=True)
+        fh.write("\n")
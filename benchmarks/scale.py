@@ -0,0 +1,101 @@
+import io
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+import pandas as pd
+from benchmarks import datagen
+from benchmarks.report import Results, summarize
+
+# In-process benchmarks, without network noise: per-endpoint latency through the
+# ASGI app at several ledger sizes, and the ingest steps (parse, prepare, save)
+# of an upload. Import this module with DATA_STORE_DIR set (the CLI sets it
+# empty, so nothing is written to disk).
+
+DEFAULT_SIZES = (10_000, 1_000_000, 10_000_000)
+
+# (name, method, path, params, json body)
+ENDPOINTS: List[Tuple[str, str, str, Dict[str, Any], Any]] = [
+    ("by_category", "GET", "/summary/by-category", {}, None),
+    ("monthly_totals", "GET", "/summary/monthly-totals", {}, None),
+    ("top_merchants", "GET", "/summary/top-merchants", {"n": 5}, None),
+    ("top_expenses_week", "GET", "/summary/top-expenses-week", {"k": 3}, None),
+    ("daily_totals", "GET", "/summary/daily-totals", {}, None),
+    ("daily_totals_columnar", "GET", "/summary/daily-totals", {"format": "columnar"}, None),
+    ("by_category_one_month", "GET", "/summary/by-category", {"start": "2024-06-01", "end": "2024-06-30"}, None),
+    ("by_merchant_filter", "GET", "/summary/by-category", {"merchant": "Merchant 3"}, None),
+    ("rollup_week_category", "GET", "/summary/rollup", {"grain": "week", "by": "category"}, None),
+    ("dashboard", "GET", "/summary/dashboard", {}, None),
+    ("dashboard_columnar", "GET", "/summary/dashboard", {"format": "columnar"}, None),
+    ("chat_local", "POST", "/chatbot/", {}, {"query": "How much did I spend on Food in June?"}),
+]
+
+
+def endpoint_latency(sizes: Sequence[int] = DEFAULT_SIZES, repeat: int = 20, seed: int = 0) -> Results:
+    """Latency of each ENDPOINTS call, repeat times per ledger size, keyed "scale-<rows>:<endpoint>"."""
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.services import data_store
+
+    results: Results = {}
+    with TestClient(app) as client:
+        for rows in sizes:
+            tenant = f"scale-{rows}"
+            data_store.save_transactions(datagen.generate(rows, seed=seed), tenant)
+            headers = {"X-Tenant-ID": tenant}
+            for name, method, path, params, body in ENDPOINTS:
+                client.request(method, path, params=params, json=body, headers=headers)  # warm up
+                latencies, errors = [], 0
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    r = client.request(method, path, params=params, json=body, headers=headers)
+                    if r.status_code == 200:
+                        latencies.append(time.perf_counter() - started)
+                    else:
+                        errors += 1
+                results[f"scale-{rows}:{name}"] = summarize(latencies, errors)
+            data_store.reset(tenant)  # free the ledger before the next size
+    return results
+
+
+def _normalize_before(df: pd.DataFrame) -> pd.DataFrame:
+    # the normalize step of the reading path before the parser layer: the date of
+    # every row is parsed, not once per distinct value
+    d = df.copy()
+    d.columns = [c.strip().lower() for c in d.columns]
+    d["date"] = pd.to_datetime(d["date"], dayfirst=True, errors="coerce")
+    d["amount"] = pd.to_numeric(d["amount"], errors="coerce")
+    return d
+
+
+def ingest(sizes: Sequence[int] = (100_000, 1_000_000), repeat: int = 3, seed: int = 0) -> Results:
+    """
+    Each step of an upload of a generated CSV, keyed "ingest-<rows>:<step>":
+    read_csv_defaults (pandas with no hints plus _normalize_before, the reading
+    path before the parser layer, for reference), parse (parsers.parse), prepare
+    (normalize and encode) and save (publish a prepared frame).
+    """
+    from app.services import data_store, parsers
+
+    results: Results = {}
+    for rows in sizes:
+        data = datagen.to_csv(datagen.generate(rows, seed=seed))
+        steps: Dict[str, List[float]] = {"read_csv_defaults": [], "parse": [], "prepare": [], "save": []}
+        for _ in range(repeat):
+            started = time.perf_counter()
+            _normalize_before(pd.read_csv(io.BytesIO(data)))
+            steps["read_csv_defaults"].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            raw = parsers.parse(data, "bench.csv")
+            steps["parse"].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            prepared = data_store.prepare(raw)
+            steps["prepare"].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            data_store.save_transactions(prepared, "bench-ingest", prepared=True)
+            steps["save"].append(time.perf_counter() - started)
+        data_store.reset("bench-ingest")
+        for step, latencies in steps.items():
+            results[f"ingest-{rows}:{step}"] = summarize(latencies)
+    return results
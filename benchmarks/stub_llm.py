@@ -0,0 +1,121 @@
+import json
+import time
+import random
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+# A stand-in for the Gemini API with configurable latency and failures, so load
+# tests never reach Google. Start it, then run the backend with
+# GEMINI_API_BASE=http://127.0.0.1:<port> (any GEMINI_API_KEY works). It answers
+# :generateContent with one JSON body and :streamGenerateContent with server-sent
+# events, like the real API.
+
+
+@dataclass
+class StubConfig:
+    """
+    latency_ms +/- jitter_ms is the time to answer (for streams, the whole answer,
+    spread over stream_chunks events). error_rate of the calls fail with
+    error_status; a 429 carries Retry-After: retry_after.
+    """
+    latency_ms: float = 300.0
+    jitter_ms: float = 100.0
+    error_rate: float = 0.0
+    error_status: int = 503
+    retry_after: int = 1
+    stream_chunks: int = 5
+    seed: Optional[int] = None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "StubServer"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json", headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        stub = self.server
+        fail, delay = stub.draw()
+        stub.count(fail)
+        if fail:
+            time.sleep(delay)
+            headers = [("Retry-After", str(stub.config.retry_after))] if stub.config.error_status == 429 else []
+            return self._send(stub.config.error_status, b'{"error": {"message": "stub failure"}}', headers=headers)
+
+        prompt = payload.get("contents", [{}])[0].get("parts", [{}])[0].get("text", "")
+        words = f"Stub answer to a {len(prompt)}-character prompt.".split(" ")
+        if ":streamGenerateContent" not in self.path:
+            time.sleep(delay)
+            return self._send(200, json.dumps(_candidate(" ".join(words))).encode())
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunks = max(1, stub.config.stream_chunks)
+        # consecutive runs of words, so the pieces join up to the unary answer
+        bounds = [len(words) * i // chunks for i in range(chunks + 1)]
+        for lo, hi in zip(bounds, bounds[1:]):
+            time.sleep(delay / chunks)
+            if lo == hi:
+                continue
+            piece = " ".join(words[lo:hi]) + (" " if hi < len(words) else "")
+            event = f"data: {json.dumps(_candidate(piece))}\r\n\r\n".encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def _candidate(text: str) -> dict:
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # load runs open many connections at once; the default backlog of 5 resets some of them
+    request_queue_size = 128
+
+    def __init__(self, port: int = 0, config: Optional[StubConfig] = None, host: str = "127.0.0.1"):
+        super().__init__((host, port), _Handler)
+        self.config = config or StubConfig()
+        self.calls = 0
+        self.failures = 0
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def draw(self):
+        # (fail?, seconds to wait) for one call
+        config = self.config
+        with self._lock:
+            fail = self._rng.random() < config.error_rate
+            jitter = self._rng.uniform(-config.jitter_ms, config.jitter_ms)
+        return fail, max(0.0, config.latency_ms + jitter) / 1000
+
+    def count(self, failed: bool):
+        with self._lock:
+            self.calls += 1
+            self.failures += failed
+
+    def start(self) -> "StubServer":
+        """Serve from a daemon thread; call shutdown() to stop."""
+        threading.Thread(target=self.serve_forever, name="stub-llm", daemon=True).start()
+        return self
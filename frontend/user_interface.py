@@ -2,6 +2,10 @@ import streamlit as st
 import plotly.express as px
 import requests
 import pandas as pd
+import re
+import uuid
+import json
+import time
 
 BASE_URL = "http://127.0.0.1:8000"
 
@@ -13,6 +17,84 @@ st.set_page_config(
     layout="wide"
 )
 
+# Each browser gets its own data on the backend. The tenant id is kept in the page URL
+# (?tenant=...), so a refresh or a bookmark comes back to the same data.
+if "tenant_id" not in st.session_state:
+    tenant = st.query_params.get("tenant", "")
+    if not re.fullmatch(r"[A-Za-z0-9_.-]{1,64}", tenant):
+        tenant = uuid.uuid4().hex
+    st.session_state["tenant_id"] = tenant
+st.query_params["tenant"] = st.session_state["tenant_id"]
+HEADERS = {"X-Tenant-ID": st.session_state["tenant_id"]}
+
+
+@st.cache_resource
+def http_session() -> requests.Session:
+    # One keep-alive connection pool for every rerun of the script
+    return requests.Session()
+
+
+session = http_session()
+
+
+def load_dashboard():
+    """
+    All summary panels in one request. The backend answers 304 while the data is
+    unchanged, so most reruns reuse the panels kept in session_state.
+    """
+    cached = st.session_state.get("dashboard")
+    headers = dict(HEADERS)
+    if cached:
+        headers["If-None-Match"] = cached[0]
+    try:
+        # columnar: each panel arrives as {column: [values]}, ready for pd.DataFrame
+        res = session.get(f"{BASE_URL}/summary/dashboard", params={"format": "columnar"},
+                          headers=headers, timeout=30)
+    except requests.RequestException:
+        return None, None
+    if res.status_code == 304 and cached:
+        return cached
+    if res.status_code == 200:
+        st.session_state["dashboard"] = (res.headers.get("ETag", ""), res.json())
+        return st.session_state["dashboard"]
+    return None, None
+
+
+def wait_for_upload(job: dict, unknown_for: float = 5.0) -> dict:
+    """
+    Poll the backend's ingestion job, showing its progress, until it finishes. A
+    worker that has not yet seen the job's status answers 404; that is retried for
+    up to unknown_for seconds.
+    """
+    bar = st.progress(0.0, text="Processing transactions...")
+    unknown_since = None
+    while job.get("status") not in ("done", "failed"):
+        time.sleep(0.5)
+        res = session.get(f"{BASE_URL}/upload/jobs/{job['job_id']}", headers=HEADERS, timeout=30)
+        if res.status_code == 404:
+            unknown_since = unknown_since or time.monotonic()
+            if time.monotonic() - unknown_since < unknown_for:
+                continue
+        if res.status_code != 200:
+            job = {"status": "failed", "error": res.json().get("detail", res.text)}
+            break
+        job, unknown_since = res.json(), None
+        bar.progress(job["progress"], text="Processing transactions...")
+    bar.empty()
+    return job
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def dashboard_frames(etag: str, _panels: dict) -> dict:
+    # Keyed on the ETag alone (_panels is not hashed), so built once per data version
+    return {
+        "category": pd.DataFrame(_panels["by_category"]).set_axis(["Category", "Amount"], axis=1),
+        "month": pd.DataFrame(_panels["monthly_totals"]).set_axis(["Month", "Total"], axis=1),
+        "merchant": pd.DataFrame(_panels["top_merchants"]).set_axis(["Merchant", "Amount"], axis=1),
+        "week": pd.DataFrame(_panels["top_expenses_week"]).set_axis(["Week", "Amount"], axis=1),
+        "daily": pd.DataFrame(_panels["daily_totals"]),
+    }
+
 # Inject custom CSS for medium fonts & spacing
 # Inject custom CSS for medium fonts, spacing & background
 st.markdown(
@@ -71,7 +153,9 @@ uploaded_file = st.file_uploader(
     type=["csv", "xlsx"]
 )
 
-if uploaded_file is not None:
+# Streamlit keeps the file across reruns; send it only once
+upload_key = (uploaded_file.name, uploaded_file.size) if uploaded_file is not None else None
+if uploaded_file is not None and st.session_state.get("uploaded") != upload_key:
     files = {
         "file": (
             uploaded_file.name,
@@ -79,16 +163,19 @@ if uploaded_file is not None:
             uploaded_file.type
         )
     }
-    response = requests.post(f"{BASE_URL}/upload", files=files)
+    response = session.post(f"{BASE_URL}/upload", files=files, headers=HEADERS)
+    # the backend parses in the background and answers with a job to poll
+    job = wait_for_upload(response.json()) if response.status_code == 202 else None
 
-    if response.status_code == 200:
+    if job is not None and job["status"] == "done":
+        st.session_state["uploaded"] = upload_key
         st.markdown(
             "<p style='color:green; font-size:18px; font-weight:bold;'>✅ Transactions uploaded successfully!</p>", 
             unsafe_allow_html=True
         )
     else:
         st.markdown(
-            f"<p style='color:red; font-size:18px; font-weight:bold;'>❌ Upload failed: {response.json().get('detail', response.text)}</p>", 
+            f"<p style='color:red; font-size:18px; font-weight:bold;'>❌ Upload failed: {job['error'] if job else response.json().get('detail', response.text)}</p>", 
             unsafe_allow_html=True
         )
 
@@ -103,11 +190,12 @@ if uploaded_file is not None:
 # Category Spending
 st.markdown("<h2 style='color:black; font-size:28px; font-weight:bold;'>📊 Spending Insights</h2>", unsafe_allow_html=True)
 
+etag, panels = load_dashboard()
+frames = dashboard_frames(etag, panels) if panels is not None else None
+
 # Category Spending
-res_cat = requests.get(f"{BASE_URL}/summary/by-category")
-if res_cat.status_code == 200:
-    data = res_cat.json()  # backend gives dict
-    df_cat = pd.DataFrame(list(data.items()), columns=["Category", "Amount"])
+if frames is not None:
+    df_cat = frames["category"]
 
     if not df_cat.empty:
         fig = px.pie(
@@ -150,15 +238,8 @@ else:
 # Monthly Totals
 st.markdown("<h2 style='color:black; font-size:28px; font-weight:bold;'>💰 Monthly Expense Summary</h2>", unsafe_allow_html=True)
 
-res_month = requests.get(f"{BASE_URL}/summary/monthly-totals")
-if res_month.status_code == 200:
-    data = res_month.json()
-
-    # If API response is dict, convert it properly
-    if isinstance(data, dict):
-        df_month = pd.DataFrame(list(data.items()), columns=["Month", "Total"])
-    else:
-        df_month = pd.DataFrame(data)
+if frames is not None:
+    df_month = frames["month"]
 
     if not df_month.empty:
         latest_month = df_month.iloc[-1]  # get the most recent month
@@ -176,15 +257,8 @@ else:
 # Top Merchants
 # =====================
 st.markdown("<h2 style='color:black; font-size:28px; font-weight:bold;'>🏪 Top Merchants</h2>", unsafe_allow_html=True)
-res_merch = requests.get(f"{BASE_URL}/summary/top-merchants?n=5")
-if res_merch.status_code == 200:
-    data = res_merch.json()
-
-    # If response is dict → convert to DataFrame
-    if isinstance(data, dict):
-        df_merch = pd.DataFrame(list(data.items()), columns=["Merchant", "Amount"])
-    else:  # assume list of dicts
-        df_merch = pd.DataFrame(data)
+if frames is not None:
+    df_merch = frames["merchant"]
 
     if not df_merch.empty:
         fig3 = px.bar(
@@ -238,15 +312,8 @@ else:
 # =====================
 st.markdown("<h2 style='color:black; font-size:28px; font-weight:bold;'>📅 Weekly Spending Trends</h2>", unsafe_allow_html=True)
 
-res_week = requests.get(f"{BASE_URL}/summary/top-expenses-week?k=3")
-if res_week.status_code == 200:
-    data = res_week.json()
-
-    # Handle dict → convert into DataFrame
-    if isinstance(data, dict):
-        df_week = pd.DataFrame(list(data.items()), columns=["Week", "Amount"])
-    else:  # assume list of dicts
-        df_week = pd.DataFrame(data)
+if frames is not None:
+    df_week = frames["week"]
 
     if not df_week.empty:
         fig4 = px.bar(
@@ -298,9 +365,8 @@ else:
 # Daily Expenses
 # =====================
 st.markdown("<h2 style='color:black; font-size:28px; font-weight:bold;'>📈 Daily Expenses Trend</h2>", unsafe_allow_html=True)
-res_daily = requests.get(f"{BASE_URL}/summary/daily-totals")
-if res_daily.status_code == 200:
-    df_daily = pd.DataFrame(res_daily.json())
+if frames is not None:
+    df_daily = frames["daily"]
     if not df_daily.empty:
         fig5 = px.line(df_daily, x="date", y="amount", title="Daily Expenses Trend", markers=True)
 
@@ -377,28 +443,36 @@ user_input = st.text_area(
 # Styled Ask button
 if st.button("Ask"):
     if user_input.strip():
-        response = requests.post(f"{BASE_URL}/chatbot", json={"query": user_input})
+        response = session.post(f"{BASE_URL}/chatbot/stream", json={"query": user_input},
+                                headers=HEADERS, stream=True)
         if response.status_code == 200:
-            answer = response.json().get("answer")
-
-            # Styled response box
-            st.markdown(
-                f"""
-                <div style="
-                    padding: 15px;
-                    border-radius: 10px;
-                    background-color: #e6ffe6;
-                    border: 2px solid #33cc33;
-                    font-size: 18px;
-                    font-weight: bold;
-                    color: black;
-                    margin-top: 10px;">
-                    🤖 Answer: {answer}
-                </div>
-                """,
-                unsafe_allow_html=True
-            )
+            # Styled response box, redrawn as each piece of the answer arrives
+            answer_box = st.empty()
+            answer = ""
+            event = "message"
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:") and event == "message":
+                    answer += json.loads(line[len("data:"):]).get("text", "")
+                    answer_box.markdown(
+                        f"""
+                        <div style="
+                            padding: 15px;
+                            border-radius: 10px;
+                            background-color: #e6ffe6;
+                            border: 2px solid #33cc33;
+                            font-size: 18px;
+                            font-weight: bold;
+                            color: black;
+                            margin-top: 10px;">
+                            🤖 Answer: {answer}
+                        </div>
+                        """,
+                        unsafe_allow_html=True
+                    )
+                elif not line:
+                    event = "message"
         else:
             st.error("❌ Failed to fetch chatbot response.")
 
-
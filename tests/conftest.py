@@ -0,0 +1,50 @@
+import os
+
+# Settings the app modules read at import time: keep the store in memory, parse
+# uploads in a thread, and never call the real Gemini API
+os.environ["DATA_STORE_DIR"] = ""
+os.environ["INGEST_WORKERS"] = "0"
+os.environ["GEMINI_API_KEY"] = "test-key"
+os.environ["LLM_CACHE_PATH"] = ""
+
+import uuid
+import pytest
+from benchmarks.stub_llm import StubConfig, StubServer
+from app.services import data_store, llm, llm_cache, llm_guard
+
+
+@pytest.fixture
+def tenant():
+    """A tenant id of its own for each test, dropped from the store afterwards."""
+    tenant_id = f"test-{uuid.uuid4().hex[:12]}"
+    yield tenant_id
+    with data_store._tenants_lock:
+        data_store._tenants.pop(tenant_id, None)
+
+
+@pytest.fixture
+def stub_llm(monkeypatch):
+    """
+    A local stand-in for Gemini (benchmarks.stub_llm) that llm calls instead of the
+    real API, with a fresh rate limiter, circuit breaker and answer cache. Change
+    stub_llm.config to inject latency or failures.
+    """
+    server = StubServer(config=StubConfig(latency_ms=50, jitter_ms=0, seed=0)).start()
+    base = f"{server.base_url}/models/{llm.GEMINI_MODEL}"
+    monkeypatch.setattr(llm, "API_URL", f"{base}:generateContent")
+    monkeypatch.setattr(llm, "STREAM_URL", f"{base}:streamGenerateContent")
+    limiter, breaker = llm_guard.TokenBucket(rate=1000, burst=1000), llm_guard.CircuitBreaker()
+    for module in (llm, llm_guard):  # llm calls through them, llm_guard.stats() reports them
+        monkeypatch.setattr(module, "limiter", limiter)
+        monkeypatch.setattr(module, "breaker", breaker)
+    monkeypatch.setattr(llm, "inflight", llm.inflight.__class__())
+    # retries back off for milliseconds rather than seconds
+    monkeypatch.setattr(llm_guard, "backoff", lambda attempt: 0.01 * 2 ** attempt)
+    llm_cache.answers.clear()
+    # the pooled client belongs to the event loop of the test that created it
+    llm._client = None
+    yield server
+    llm._client = None
+    llm_cache.answers.clear()
+    server.shutdown()
+    server.server_close()
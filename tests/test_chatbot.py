@@ -0,0 +1,86 @@
+import json
+import time
+import asyncio
+import inspect
+import httpx
+import pytest
+from app.main import app
+from app.routers import summary
+from app.services import data_store, llm, llm_cache, query_engine
+from benchmarks import datagen
+
+SLOW = 0.5
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/chatbot/", {"query": "How much did I spend?"}),
+    ("/chatbot/stream", {"query": "How much did I spend?"}),
+    ("/chatbot/batch", [{"query": "How much did I spend?"}] * 2),
+])
+def test_answering_does_not_block_the_event_loop(monkeypatch, tenant, path, body):
+    data_store.save_transactions(datagen.generate(1_000, seed=16), tenant)
+
+    def slow_answer(query, snap):
+        time.sleep(SLOW)  # stands in for pandas work on a large ledger
+        return query_engine.LocalAnswer("total_spend", "You spent $1.00 in total.", {})
+
+    monkeypatch.setattr(query_engine, "answer", slow_answer)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test",
+                                     headers={"X-Tenant-ID": tenant}) as client:
+            request = asyncio.ensure_future(client.post(path, json=body))
+            # how late a 10 ms timer fires while the request is served
+            worst = 0.0
+            while not request.done():
+                started = time.perf_counter()
+                await asyncio.sleep(0.01)
+                worst = max(worst, time.perf_counter() - started)
+            return (await request).status_code, worst
+
+    status, worst = asyncio.run(run())
+    assert status == 200
+    assert worst < SLOW / 2, worst
+
+
+def test_summary_routes_run_in_the_thread_pool():
+    assert not inspect.iscoroutinefunction(summary.daily_totals)
+
+
+def _events(body: str):
+    """(event name, data) of each server-sent event in body"""
+    events = []
+    for block in body.split("\n\n")[:-1]:
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        assert set(fields) <= {"event", "data"}, block
+        events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+
+def test_stream_joins_up_to_the_unary_answer(stub_llm, tenant):
+    data_store.save_transactions(datagen.generate(1_000, seed=17), tenant)
+    body = {"query": "Why did my spending go up?"}
+
+    async def run():
+        llm._client = None
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test",
+                                     headers={"X-Tenant-ID": tenant}) as client:
+            async with client.stream("POST", "/chatbot/stream", json=body) as r:
+                assert r.status_code == 200
+                assert r.headers["content-type"].startswith("text/event-stream")
+                streamed = (await r.aread()).decode()
+            llm_cache.answers.clear()  # so /chatbot/ asks the LLM too
+            unary = (await client.post("/chatbot/", json=body)).json()
+        return streamed, unary
+
+    streamed, unary = asyncio.run(run())
+    events = _events(streamed)
+    assert streamed.endswith("\n\n")
+    pieces, (done, info) = events[:-1], events[-1]
+    assert len(pieces) == stub_llm.config.stream_chunks
+    assert all(name == "message" and set(data) == {"text"} for name, data in pieces)
+    assert done == "done" and info["served_by"] == "llm" and info["latency_ms"] >= 0
+    assert unary["served_by"] == "llm" and stub_llm.calls == 2
+    assert "".join(data["text"] for _, data in pieces) == unary["answer"]
@@ -0,0 +1,95 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import pytest
+from app.main import app
+from app.services import data_store, llm, metrics
+from app.services.singleflight import SingleFlight
+from benchmarks import datagen
+
+N = 20
+
+
+def test_identical_prompts_cost_one_upstream_call(stub_llm):
+    stub_llm.config.latency_ms = 200
+
+    async def ask(prompts):
+        return await asyncio.gather(*(llm.generate(p) for p in prompts))
+
+    answers = asyncio.run(ask(["What should I cut back on?"] * N))
+    assert stub_llm.calls == 1
+    assert len(set(answers)) == 1
+    assert llm.inflight.stats()["shared"] == N - 1
+
+    llm._client = None  # new event loop below
+    asyncio.run(ask([f"Question {i}" for i in range(N)]))
+    assert stub_llm.calls == 1 + N
+
+
+def test_identical_chat_requests_cost_one_upstream_call(stub_llm, tenant):
+    data_store.save_transactions(datagen.generate(5_000, seed=6), tenant)
+    # long enough for every request to reach the LLM call before the first answer is cached
+    stub_llm.config.latency_ms = 500
+
+    async def ask():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test",
+                                     headers={"X-Tenant-ID": tenant}) as client:
+            return await asyncio.gather(*(client.post("/chatbot/", json={"query": "Why is my spending so high?"})
+                                          for _ in range(N)))
+
+    responses = asyncio.run(ask())
+    assert all(r.status_code == 200 for r in responses)
+    assert {r.json()["served_by"] for r in responses} == {"llm"}
+    assert len({r.json()["answer"] for r in responses}) == 1
+    assert stub_llm.calls == 1
+
+
+def test_concurrent_metrics_on_one_snapshot_compute_once(monkeypatch, tenant):
+    monkeypatch.setattr(metrics, "inflight", SingleFlight())
+    data_store.save_transactions(datagen.generate(1_000, seed=7), tenant)
+    snap = data_store.get_snapshot(tenant)
+    runs = []
+
+    @metrics._coalesced
+    def slow_total(tenant: str = data_store.DEFAULT_TENANT, snapshot=None):
+        runs.append(1)
+        time.sleep(0.2)
+        return float(snapshot.by_category.sum())
+
+    start = threading.Barrier(N)
+
+    def call(_):
+        start.wait()
+        return slow_total(snapshot=snap)
+
+    with ThreadPoolExecutor(N) as pool:
+        results = list(pool.map(call, range(N)))
+    assert len(runs) == 1
+    assert len(set(results)) == 1
+    assert metrics.inflight.stats() == {"calls": 1, "shared": N - 1, "in_flight": 0}
+
+    # another data version is another computation
+    data_store.append_transactions(datagen.generate(10, end="2025-02-01", seed=8), dedupe_on=None, tenant=tenant)
+    slow_total(snapshot=data_store.get_snapshot(tenant))
+    assert len(runs) == 2
+
+
+def test_waiters_get_the_leaders_error():
+    flight = SingleFlight()
+    start = threading.Barrier(4)
+
+    def fail():
+        time.sleep(0.1)
+        raise ValueError("boom")
+
+    def call(_):
+        start.wait()
+        with pytest.raises(ValueError, match="boom"):
+            flight.do("key", fail)
+
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(call, range(4)))
+    assert flight.stats() == {"calls": 1, "shared": 3, "in_flight": 0}
@@ -0,0 +1,59 @@
+import json
+import pytest
+from app.routers import chatbot
+from app.services import context_builder, data_store
+from benchmarks import datagen
+
+QUESTIONS = [
+    "Give me an overview of my finances",
+    "How has my spending changed over the years?",
+    "Which category is growing fastest?",
+    "How does my Food spending in March 2024 compare to February?",
+    "When did I last pay Merchant 3?",
+    "Show my Transport purchases over $50 in the last 30 days",
+]
+
+
+@pytest.fixture
+def histories(tenant):
+    """The same ledger shape over 3 months and over 20 years, as two tenants' snapshots."""
+    short, long = f"{tenant}-short", f"{tenant}-long"
+    data_store.save_transactions(datagen.generate(20_000, categories=12, merchants=3_000, days=90, seed=1), short)
+    data_store.save_transactions(datagen.generate(400_000, categories=12, merchants=3_000, days=7_300, seed=2), long)
+    yield data_store.get_snapshot(short), data_store.get_snapshot(long)
+    for t in (short, long):
+        data_store._tenants.pop(t, None)
+
+
+def _prompt_tokens(query: str, snap: data_store.Snapshot, budget: int = context_builder.CONTEXT_TOKEN_BUDGET):
+    context = context_builder.build_context(query, snap, budget=budget)
+    return context_builder.estimate_tokens(context_builder.encode(context)), chatbot._build_prompt(context, query)
+
+
+@pytest.mark.parametrize("query", QUESTIONS)
+def test_prompt_size_does_not_grow_with_history(histories, query):
+    short, long = histories
+    short_tokens, _ = _prompt_tokens(query, short)
+    long_tokens, prompt = _prompt_tokens(query, long)
+    assert long_tokens <= context_builder.CONTEXT_TOKEN_BUDGET
+    assert short_tokens <= context_builder.CONTEXT_TOKEN_BUDGET
+    # the template around the context is a fixed size
+    template = len(chatbot._build_prompt({}, query))
+    assert context_builder.estimate_tokens(prompt) <= context_builder.CONTEXT_TOKEN_BUDGET + (template + 3) // 4
+
+
+def test_old_full_dump_would_not_fit(histories):
+    """What the prompt used to carry: every metric, indented JSON, whatever the history."""
+    _, long = histories
+    dump = json.dumps(context_builder.overview(long), indent=2)
+    assert context_builder.estimate_tokens(dump) > 2 * context_builder.CONTEXT_TOKEN_BUDGET
+    tokens, _ = _prompt_tokens(QUESTIONS[0], long)
+    assert tokens <= context_builder.CONTEXT_TOKEN_BUDGET
+
+
+@pytest.mark.parametrize("budget", [50, 150, 400])
+def test_budget_is_configurable(histories, budget):
+    _, long = histories
+    for query in QUESTIONS:
+        tokens, _ = _prompt_tokens(query, long, budget)
+        assert tokens <= budget
@@ -0,0 +1,232 @@
+import os
+import time
+import shutil
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from fastapi.testclient import TestClient
+from app.main import app
+from app.services import data_store, metrics
+from app.services.search_index import TransactionIndex
+from benchmarks import datagen
+
+
+def _check_snapshot(snap: data_store.Snapshot):
+    """Every part of a snapshot describes the same rows."""
+    tx, spend = snap.transactions, snap.spend
+    assert pd.api.types.is_datetime64_dtype(tx["date"])
+    assert tx["date"].is_monotonic_increasing and spend["date"].is_monotonic_increasing
+    assert len(spend) == int((tx["amount"] > 0).sum())
+    total = float(spend["amount"].sum()) / data_store.AMOUNT_SCALE
+    assert np.isclose(snap.by_category.sum(), total)
+    assert np.isclose(snap.by_merchant.sum(), total)
+    assert np.isclose(snap.by_month.sum(), total)
+    assert np.isclose(snap.by_day.sum(), float(tx["amount"].sum()) / data_store.AMOUNT_SCALE)
+    assert metrics.spending_by_category(snapshot=snap) == snap.by_category.round(2).to_dict()
+
+
+def test_concurrent_uploads_and_reads(tenant):
+    """Readers never see a half-built snapshot while uploads and appends replace the data."""
+    uploads = [datagen.generate(5_000 + 1_000 * i, seed=i) for i in range(8)]
+    batches = [datagen.generate(500, end="2025-01-31", days=31, seed=100 + i) for i in range(8)]
+    data_store.save_transactions(uploads[0], tenant)
+    done = threading.Event()
+    errors = []
+
+    def writer():
+        try:
+            for upload, batch in zip(uploads, batches):
+                data_store.save_transactions(upload, tenant)
+                data_store.append_transactions(batch, dedupe_on=None, tenant=tenant)
+        except Exception as e:  # pragma: no cover - reported below
+            errors.append(e)
+        finally:
+            done.set()
+
+    def reader():
+        seen = 0
+        try:
+            while not done.is_set():
+                snap = data_store.get_snapshot(tenant)
+                assert snap.version >= seen, "versions went backwards"
+                seen = snap.version
+                _check_snapshot(snap)
+                view = data_store.filter_snapshot(snap, start=pd.Timestamp("2024-06-01"),
+                                                  end=pd.Timestamp("2024-06-30"))
+                assert view.transactions["date"].between("2024-06-01", "2024-06-30").all()
+                assert np.isclose(view.by_category.sum(),
+                                  float(view.spend["amount"].sum()) / data_store.AMOUNT_SCALE)
+        except Exception as e:
+            errors.append(e)
+
+    def http_reader(client: TestClient):
+        try:
+            while not done.is_set():
+                r = client.get("/summary/dashboard", headers={"X-Tenant-ID": tenant})
+                assert r.status_code == 200
+                panels = r.json()
+                # one response, one data version: the panels add up to the same spend
+                assert np.isclose(sum(panels["by_category"].values()), sum(panels["monthly_totals"].values()))
+        except Exception as e:
+            errors.append(e)
+
+    with TestClient(app) as client:
+        threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(3)] \
+            + [threading.Thread(target=http_reader, args=(client,)) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=120)
+    assert not errors, errors[0]
+
+    final = data_store.get_snapshot(tenant)
+    _check_snapshot(final)
+    assert len(final.transactions) == len(uploads[-1]) + len(batches[-1])
+
+
+def test_readers_do_not_mutate_the_store(tenant):
+    data_store.save_transactions(datagen.generate(2_000, seed=1), tenant)
+    snap = data_store.get_snapshot(tenant)
+    dtypes = snap.transactions.dtypes.copy()
+    with TestClient(app) as client:
+        for path in ("/summary/daily-totals", "/summary/dashboard", "/summary/by-category"):
+            assert client.get(path, headers={"X-Tenant-ID": tenant}).status_code == 200
+    assert data_store.get_snapshot(tenant) is snap
+    assert snap.transactions.dtypes.equals(dtypes)
+
+
+def _best_of(fn, repeat: int = 5) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def test_compact_layout_is_smaller_and_faster(monkeypatch):
+    """The compact layout against the plain object/float64 one, on the same rows."""
+    raw = datagen.generate(200_000, merchants=2_000, seed=4)
+    compact = data_store.prepare(raw)
+    monkeypatch.setattr(data_store, "COMPACT_STORAGE", False)
+    plain = data_store.prepare(raw)
+
+    assert isinstance(compact["category"].dtype, pd.CategoricalDtype)
+    assert compact["amount"].dtype == np.int64 and plain["amount"].dtype == np.float64
+    np.testing.assert_array_equal(compact["amount"].to_numpy(), np.round(plain["amount"].to_numpy() * 100))
+
+    compact_bytes = compact.memory_usage(deep=True, index=False).sum()
+    plain_bytes = plain.memory_usage(deep=True, index=False).sum()
+    assert compact_bytes < 0.25 * plain_bytes, (compact_bytes, plain_bytes)
+
+    def rollups(df):
+        for by in ("category", "description"):
+            df["amount"].groupby(df[by], observed=True).sum()
+
+    compact_time, plain_time = _best_of(lambda: rollups(compact)), _best_of(lambda: rollups(plain))
+    assert compact_time < plain_time / 2, (compact_time, plain_time)
+
+
+def test_get_transactions_shares_the_stored_columns(tenant):
+    data_store.save_transactions(datagen.generate(1_000, seed=2), tenant)
+    stored = data_store.get_snapshot(tenant).transactions
+    view = data_store.get_transactions(tenant)
+    for col in ("date", "amount"):
+        assert np.shares_memory(view[col].to_numpy(), stored[col].to_numpy())
+    assert np.shares_memory(view["category"].array.codes, stored["category"].array.codes)
+
+
+def _rows(frame: pd.DataFrame) -> list:
+    return list(zip(frame["date"], frame["description"].astype(str), frame["amount"], frame["category"].astype(str)))
+
+
+def test_appends_keep_date_order(tmp_path, monkeypatch, tenant):
+    monkeypatch.setattr(data_store, "DATA_STORE_DIR", str(tmp_path))
+    base = datagen.generate(3_000, end="2024-12-31", seed=11)
+    batches = [datagen.generate(200, end="2025-01-31", days=31, seed=12),  # after the stored rows
+               datagen.generate(200, end="2023-06-30", days=60, seed=13),  # back-dated
+               datagen.generate(50, end="2025-01-31", days=1, seed=14)]   # the last stored day again
+    data_store.save_transactions(base, tenant)
+    for batch in batches:
+        data_store.append_transactions(batch, dedupe_on=None, tenant=tenant)
+    snap = data_store.get_snapshot(tenant)
+    _check_snapshot(snap)
+    # the order a full upload of the same rows gives: by date, then upload order
+    expected = data_store.prepare(pd.concat([base] + batches, ignore_index=True))
+    expected = expected.sort_values("date", kind="stable")
+    assert _rows(snap.transactions) == _rows(expected)
+
+    # appends leave the search index to the first search, whose results match an eager build
+    assert not snap.index.built and snap.index.nbytes == 0
+    eager = TransactionIndex(snap.transactions)
+    for words in (["merchant", "1"], ["food"], ["groceries", "merchant"]):
+        np.testing.assert_array_equal(snap.index.search(words, 20), eager.search(words, 20))
+    assert snap.index.built
+
+    # persisted without the index; another process builds its own on first search
+    data_store.append_transactions(batches[0][:10], dedupe_on=None, tenant=tenant)
+    data_store._tenants.pop(tenant)
+    loaded = data_store.get_snapshot(tenant)
+    assert not loaded.index.built
+    assert len(loaded.index.search(["food"], 5)) == 5
+
+
+def _append_batches(path: str, tenant: str, seed: int, batches: int) -> int:
+    # runs in another process: a second uvicorn worker sharing DATA_STORE_DIR
+    data_store.DATA_STORE_DIR = path
+    for i in range(batches):
+        data_store.append_transactions(datagen.generate(100, end="2025-01-31", days=31, seed=seed * 1_000 + i),
+                                       dedupe_on=None, tenant=tenant)
+    return batches * 100
+
+
+def test_workers_appending_to_one_tenant_lose_no_rows(tmp_path, monkeypatch, tenant):
+    monkeypatch.setattr(data_store, "DATA_STORE_DIR", str(tmp_path))
+    data_store.save_transactions(datagen.generate(20_000, seed=15), tenant)
+    with ProcessPoolExecutor(3, mp_context=multiprocessing.get_context("spawn")) as pool:
+        added = sum(pool.map(_append_batches, [str(tmp_path)] * 3, [tenant] * 3, range(3), [15] * 3))
+    data_store.load_from_disk(tenant)
+    snap = data_store.get_snapshot(tenant)
+    assert len(snap.transactions) == 20_000 + added
+    _check_snapshot(snap)
+
+
+def _age(path, days: float):
+    """Set the use stamps of a tenant directory to days ago."""
+    past = time.time() - days * 86_400
+    for name in (".used", "manifest.json", "jobs"):
+        if (path / name).exists():
+            os.utime(path / name, (past, past))
+
+
+def test_idle_tenants_are_purged(tmp_path, monkeypatch, tenant):
+    monkeypatch.setattr(data_store, "DATA_STORE_DIR", str(tmp_path))
+    idle, active, read = f"{tenant}-idle", f"{tenant}-active", f"{tenant}-read"
+    try:
+        for t in (idle, active, read):
+            data_store.save_transactions(datagen.generate(500, seed=17), t)
+            data_store.get_snapshot(t)
+        (tmp_path / data_store.DEFAULT_TENANT).mkdir()
+        (tmp_path / data_store.DEFAULT_TENANT / "manifest.json").write_text("{}")
+        for t in (idle, read, data_store.DEFAULT_TENANT):
+            _age(tmp_path / t, 10)
+        # a read marks the tenant as used again
+        data_store._tenants[read].touched = 0.0
+        data_store.get_snapshot(read)
+
+        assert data_store.purge_idle_tenants(ttl_hours=24 * 7) == [idle]
+        assert sorted(p.name for p in tmp_path.iterdir()) == sorted([active, read, data_store.DEFAULT_TENANT])
+        assert idle not in data_store._tenants
+        assert data_store.get_snapshot(idle).empty
+        assert data_store.purge_idle_tenants(ttl_hours=0) == []
+
+        # a worker still holding a purged tenant drops its data on the next read
+        held = data_store.get_snapshot(active)
+        shutil.rmtree(tmp_path / active)
+        snap = data_store.get_snapshot(active)
+        assert snap.empty and snap.version > held.version
+    finally:
+        for t in (idle, active, read):
+            data_store._tenants.pop(t, None)
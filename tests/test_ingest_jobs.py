@@ -0,0 +1,128 @@
+import io
+import asyncio
+import tracemalloc
+import httpx
+import pandas as pd
+import pytest
+from app.main import app
+from app.services import data_store, ingest_jobs, parsers
+from benchmarks import datagen
+
+
+def _forget_in_process():
+    """What a worker that did not take the upload knows about its jobs"""
+    ingest_jobs._jobs.clear()
+
+
+def test_any_worker_answers_a_status_poll(tmp_path, monkeypatch, tenant):
+    monkeypatch.setattr(data_store, "DATA_STORE_DIR", str(tmp_path))
+    data = datagen.to_csv(datagen.generate(2_000, seed=9))
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test",
+                                     headers={"X-Tenant-ID": tenant}) as client:
+            r = await client.post("/upload/", files={"file": ("t.csv", data, "text/csv")})
+            assert r.status_code == 202
+            job_id = r.json()["job_id"]
+            task = ingest_jobs._jobs[job_id].task
+            _forget_in_process()
+            running = await client.get(f"/upload/jobs/{job_id}")
+            await task
+            _forget_in_process()
+            done = await client.get(f"/upload/jobs/{job_id}")
+            other = await client.get(f"/upload/jobs/{job_id}", headers={"X-Tenant-ID": f"{tenant}-other"})
+            unknown = await client.get("/upload/jobs/..%2F..%2Fmanifest")
+        return job_id, running, done, other, unknown
+
+    job_id, running, done, other, unknown = asyncio.run(run())
+    assert (tmp_path / tenant / "jobs" / f"{job_id}.json").exists()
+    assert running.status_code == 200 and running.json()["status"] in ("queued", "parsing", "saving", "done")
+    assert done.status_code == 200
+    assert done.json()["status"] == "done" and done.json()["rows"] == 2_000 and done.json()["progress"] == 1.0
+    assert other.status_code == 404
+    assert unknown.status_code == 404
+
+
+def test_forgotten_jobs_remove_their_status(tmp_path, monkeypatch, tenant):
+    monkeypatch.setattr(data_store, "DATA_STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(ingest_jobs, "INGEST_JOBS_KEPT", 1)
+    data = datagen.to_csv(datagen.generate(100, seed=10))
+
+    async def run():
+        ids = []
+        for _ in range(3):
+            job = ingest_jobs.submit(ingest_jobs.spool(io.BytesIO(data)), "t.csv", tenant=tenant)
+            await job.task
+            ids.append(job.id)
+        return ids
+
+    ids = asyncio.run(run())
+    assert sorted(p.stem for p in (tmp_path / tenant / "jobs").iterdir()) == [ids[-1]]
+
+
+def test_a_job_that_rejects_every_row_fails(tmp_path, monkeypatch, tenant):
+    monkeypatch.setattr(data_store, "DATA_STORE_DIR", str(tmp_path))
+    data_store.save_transactions(datagen.generate(100, seed=11), tenant)
+    data = b"date,description,amount,category\n2024-05-03,Tesco,ten,Food\nsoon,Uber,20,Transport\n"
+
+    async def run():
+        job = ingest_jobs.submit(ingest_jobs.spool(io.BytesIO(data)), "t.csv", tenant=tenant)
+        await job.task
+        return job
+
+    job = asyncio.run(run())
+    assert job.status == "failed" and job.rows == 0 and job.rejected == 2
+    assert "rejected" in job.error
+    # the stored data is left as it was
+    assert len(data_store.get_snapshot(tenant).transactions) == 100
+
+
+def _quoted_csv(rows: int) -> bytes:
+    """A CSV whose descriptions are quoted and some span two lines."""
+    lines = ["date,description,amount,category"]
+    for i in range(rows):
+        desc = f'"Shop {i}, ""main""\nstreet"' if i % 7 == 0 else f'"Shop {i}"'
+        lines.append(f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d},{desc},{i % 90 + 1}.50,Food")
+    return ("\n".join(lines) + "\n").encode()
+
+
+@pytest.mark.parametrize("part_bytes, block_bytes", [(1_000, 16), (1_000, 1_000_000), (5_000, 333), (10**9, 64)])
+def test_csv_ranges_cut_between_records(tmp_path, monkeypatch, part_bytes, block_bytes):
+    monkeypatch.setattr(ingest_jobs, "_BLOCK_BYTES", block_bytes)
+    data = _quoted_csv(2_000)
+    path = tmp_path / "t.csv"
+    path.write_bytes(data)
+    header_end, ranges = ingest_jobs.csv_ranges(str(path), part_bytes)
+    # the ranges cover the rows without gaps, each cut after a whole record
+    assert ranges[0][0] == header_end and ranges[-1][1] == len(data)
+    assert all(stop == start for (_, stop), (start, _) in zip(ranges, ranges[1:]))
+    for start, stop in ranges[:-1]:
+        assert data[stop - 1:stop] == b"\n" and data[header_end:stop].count(b'"') % 2 == 0
+        assert stop - start > part_bytes
+    if part_bytes > len(data):
+        assert (header_end, ranges) == (0, [(0, len(data))])
+    else:
+        assert len(ranges) > 1
+    pieces = [parsers.parse(data[:header_end] + data[start:stop], "t.csv") for start, stop in ranges]
+    # the pieces' categoricals differ, so compare the values
+    pd.testing.assert_frame_equal(pd.concat(pieces, ignore_index=True).astype(str),
+                                  parsers.parse(data, "t.csv").astype(str))
+
+
+def test_upload_is_copied_and_scanned_in_blocks(tmp_path):
+    data = datagen.to_csv(datagen.generate(400_000, seed=18))
+    source = tmp_path / "upload.csv"
+    source.write_bytes(data)
+    tracemalloc.start()
+    try:
+        with open(source, "rb") as fh:
+            path = ingest_jobs.spool(fh)
+        _, ranges = ingest_jobs.csv_ranges(path, 2 * 1024 * 1024)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(data) > 10 * 1024 * 1024 and len(ranges) > 5
+    assert peak < 4 * 1024 * 1024, peak
+    with open(path, "rb") as fh:
+        assert fh.read() == data
@@ -0,0 +1,93 @@
+import time
+import asyncio
+import httpx
+import pytest
+from app.main import app
+from app.services import data_store, llm
+from benchmarks import datagen
+
+
+def _generate(prompt: str = "How am I doing?") -> str:
+    llm._client = None  # each asyncio.run is a new event loop
+    return asyncio.run(llm.generate(prompt))
+
+
+def test_answer_from_stub(stub_llm):
+    assert _generate().startswith("Stub answer")
+    assert stub_llm.calls == 1
+    assert llm.breaker.state == "closed"
+
+
+def test_stream_pieces_join_up_to_the_answer(stub_llm):
+    async def stream():
+        llm._client = None
+        return [piece async for piece in llm.generate_stream("How am I doing?")]
+
+    pieces = asyncio.run(stream())
+    assert len(pieces) == stub_llm.config.stream_chunks
+    assert "".join(pieces) == _generate()
+    assert stub_llm.calls == 2
+
+
+def test_overloaded_llm_is_retried_then_reported(stub_llm):
+    stub_llm.config.error_rate, stub_llm.config.error_status = 1.0, 503
+    with pytest.raises(llm.LLMError):
+        _generate()
+    assert stub_llm.calls == llm._ATTEMPTS
+    assert llm.breaker.failures == llm._ATTEMPTS
+
+
+def test_breaker_opens_fails_fast_and_recovers(stub_llm):
+    llm.breaker.max_failures, llm.breaker.cooldown = 3, 0.5
+    stub_llm.config.error_rate = 1.0
+    with pytest.raises(llm.LLMError):
+        _generate()
+    assert llm.breaker.state == "open"
+
+    # open: no call reaches the LLM, and the caller is not kept waiting
+    calls, started = stub_llm.calls, time.perf_counter()
+    with pytest.raises(llm.LLMUnavailable):
+        _generate("another question")
+    assert stub_llm.calls == calls
+    assert time.perf_counter() - started < 0.1
+
+    # after the cooldown one probe goes through; its success closes the breaker
+    stub_llm.config.error_rate = 0.0
+    time.sleep(0.5)
+    assert llm.breaker.state == "half_open"
+    assert _generate("a third question").startswith("Stub answer")
+    assert llm.breaker.state == "closed"
+
+
+def test_rate_limited_calls_honour_retry_after(stub_llm, monkeypatch):
+    monkeypatch.setattr(llm, "_ATTEMPTS", 2)
+    stub_llm.config.error_rate, stub_llm.config.error_status, stub_llm.config.retry_after = 1.0, 429, 1
+    started = time.perf_counter()
+    with pytest.raises(llm.LLMError):
+        _generate()
+    # the second attempt waited for Retry-After, not just the (millisecond) backoff
+    assert time.perf_counter() - started >= 1.0
+    assert llm.limiter.throttled == 2
+    assert llm.limiter.rate < llm.limiter.max_rate
+    # being rate limited is not an outage
+    assert llm.breaker.state == "closed"
+
+
+def test_chat_degrades_to_data_while_breaker_is_open(stub_llm, tenant):
+    data_store.save_transactions(datagen.generate(2_000, seed=5), tenant)
+    llm.breaker.max_failures = 1
+    llm.breaker.record_failure()
+
+    async def ask():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test",
+                                     headers={"X-Tenant-ID": tenant}) as client:
+            answer = await client.post("/chatbot/", json={"query": "Should I budget more for Food?"})
+            stats = await client.get("/chatbot/llm-stats")
+        return answer.json(), stats.json()
+
+    chat, stats = asyncio.run(ask())
+    assert stub_llm.calls == 0
+    assert chat["served_by"] == "data"
+    assert "temporarily unavailable" in chat["answer"] and "Food@2024-12" in chat["answer"]
+    assert stats["breaker"]["state"] == "open" and stats["breaker"]["rejected"] >= 1
@@ -0,0 +1,37 @@
+import dataclasses
+import pandas as pd
+import pytest
+from app.services import data_store, metrics
+from benchmarks import datagen
+
+
+def _without_cube(snap: data_store.Snapshot) -> data_store.Snapshot:
+    """snap answered from its pivot rollups, as before the cube"""
+    return dataclasses.replace(snap, cube=None)
+
+
+def test_numeric_categories(tenant):
+    df = pd.DataFrame({
+        "date": pd.to_datetime(["2024-01-05", "2024-01-06", "2024-02-05", "2024-02-06", "2024-02-07"]),
+        "description": ["a", "b", "c", "d", "e"],
+        "amount": [10.0, 50.0, 30.0, 40.0, 5.0],
+        "category": [1, 2, 1, 2, 3],
+    })
+    data_store.save_transactions(df, tenant)
+    snap = data_store.get_snapshot(tenant)
+    expected = {"month": "2024-02", "category": 1, "growth_pct": 200.0}
+    assert metrics.fastest_growing_category(snapshot=_without_cube(snap)) == expected
+    assert metrics.fastest_growing_category(snapshot=snap) == expected
+
+    # a filtered view keeps the labels' type in every rollup
+    view = data_store.filter_snapshot(snap, start=pd.Timestamp("2024-01-01"))
+    assert set(view.by_category_month.index.get_level_values("category")) == {1, 2, 3}
+    assert metrics.fastest_growing_category(snapshot=view) == expected
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_cube_matches_pivot(tenant, seed):
+    data_store.save_transactions(datagen.generate(5_000, categories=8, days=120, seed=seed), tenant)
+    snap = data_store.get_snapshot(tenant)
+    assert metrics.fastest_growing_category(snapshot=snap) == \
+        metrics.fastest_growing_category(snapshot=_without_cube(snap))
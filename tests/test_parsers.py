@@ -0,0 +1,26 @@
+import io
+import pandas as pd
+import pytest
+from app.services import data_store, parsers
+
+EU_EXPORT = (
+    "Buchungstag;Verwendungszweck;Betrag;Kategorie\n"
+    "03.05.2024;Miete Mai;-1.234,50;Wohnen\n"
+    "04.05.2024;Rewe;-12,00;Lebensmittel\n"
+    "05.05.2024;Erstattung;2.000,00;Sonstiges\n"
+    "06.05.2024;Autohaus;-12.345.678,99;Auto\n"
+).encode("utf-8")
+
+
+@pytest.mark.parametrize("read", [
+    pytest.param(lambda: parsers.parse(EU_EXPORT, "export.csv", profile="eu-semicolon"), id="named"),
+    pytest.param(lambda: parsers.parse(EU_EXPORT, "export.csv"), id="detected"),
+    pytest.param(lambda: pd.concat(parsers.iter_csv(io.BytesIO(EU_EXPORT), 2, profile="eu-semicolon"),
+                                   ignore_index=True), id="chunked"),
+])
+def test_eu_profile_reads_thousands_separators(read):
+    df = data_store.prepare(read())
+    assert len(df) == 4
+    amounts = df["amount"] / data_store.AMOUNT_SCALE if data_store.COMPACT_STORAGE else df["amount"]
+    assert amounts.tolist() == [1234.5, 12.0, -2000.0, 12345678.99]
+    assert df["date"].dt.strftime("%Y-%m-%d").tolist() == ["2024-05-03", "2024-05-04", "2024-05-05", "2024-05-06"]
@@ -0,0 +1,106 @@
+import pandas as pd
+import pytest
+from app.services import data_store, query_engine
+
+ROWS = [
+    ("2024-03-03", "Tesco", 10.0, "Food"),
+    ("2024-03-05", "Uber", 20.0, "Transport"),
+    ("2024-04-10", "Tesco", 30.0, "Food"),
+    ("2024-05-03", "Tesco", 40.0, "Food"),
+    ("2024-05-03", "Landlord", 500.0, "Rent"),
+    ("2024-05-21", "Burger Bar", 15.0, "Fast Food"),
+    ("2024-06-28", "Uber", 25.0, "Transport"),
+    ("2024-06-30", "Tesco", 50.0, "Food"),
+]
+
+
+@pytest.fixture
+def snap(tenant):
+    df = pd.DataFrame(ROWS, columns=data_store.REQUIRED_COLUMNS)
+    df["date"] = pd.to_datetime(df["date"], format="%Y-%m-%d")
+    data_store.save_transactions(df, tenant)
+    return data_store.get_snapshot(tenant)
+
+
+@pytest.mark.parametrize("query", [
+    # periods the parser cannot read must not be answered as all-time totals
+    "How much did I spend on food in the last 3 months?",
+    "What was my total spent yesterday?",
+    "How much did I spend on Food today?",
+    "How much did I spend on food this quarter?",
+    "Total spent on food since January",
+    "How much did I spend on food 2 weeks ago?",
+    "How much did I spend on food in the past year?",
+    "How much did I spend on food on February 30?",
+    # "may" without a year or day next to it is not the month
+    "How much may I spend on food?",
+    "How much did I spend on food in May?",
+    # one total cannot answer for several categories or merchants
+    "How much did I spend on Food and Rent?",
+    "Total spent at Tesco and Uber",
+    "How much did I spend at Tesco on Transport?",
+    # nor several periods, or a part of one
+    "How much did I spend on food in March and April?",
+    "How much did I spend on food in march 2024 and april 2024?",
+    "How much did I spend on food from March to April?",
+    "Total spent on food in the first half of 2024",
+    "How much did I spend in Q1 2024?",
+    "How much did I spend on weekends?",
+    # questions that are not about a spend total
+    "What is the total number of transactions?",
+    "How many times did I pay Uber?",
+    "how much is my biggest purchase?",
+    "What was my smallest payment?",
+    "Which was my smallest category?",
+    "How much did I receive in refunds?",
+    "How much income did I get?",
+    "How much credit did I get?",
+    "How much did I earn?",
+    "How much did I spend on rent over $100?",
+    "How much did I spend under $50?",
+    "How much did I spend at Tesco more than 20?",
+    "How much did I not spend on food?",
+    "how much did i spend in 2024 except food",
+])
+def test_goes_to_the_llm(snap, query):
+    assert query_engine.answer(query, snap) is None
+
+
+@pytest.mark.parametrize("query, intent, amount, start, end", [
+    ("How much did I spend on food in May 2024?", "spend_on_category", 40.0, "2024-05-01", "2024-05-31"),
+    ("How much did I spend on food on 3 May 2024?", "spend_on_category", 40.0, "2024-05-03", "2024-05-03"),
+    ("How much did I spend on food on May 3rd?", "spend_on_category", 40.0, "2024-05-03", "2024-05-03"),
+    ("How much did I spend on food last month?", "spend_on_category", 40.0, "2024-05-01", "2024-05-31"),
+    ("How much did I spend on food?", "spend_on_category", 130.0, None, None),
+    ("How much did I spend on fast food?", "spend_on_category", 15.0, None, None),
+    ("How much did I spend at Uber in the last 30 days?", "spend_at_merchant", 25.0, "2024-06-01", "2024-06-30"),
+    ("Total in March", "total_spend", 30.0, "2024-03-01", "2024-03-31"),
+    ("How much did I spend in March 2024?", "total_spend", 30.0, "2024-03-01", "2024-03-31"),
+    ("Which was my biggest category?", "top_category", 500.0, None, None),
+])
+def test_answers_locally(snap, query, intent, amount, start, end):
+    local = query_engine.answer(query, snap)
+    assert local is not None
+    assert local.intent == intent
+    assert local.data["amount"] == amount
+    assert local.data["period"] == {"start": start, "end": end}
+
+
+def test_top_merchant_within_a_category(snap):
+    local = query_engine.answer("Which was my top merchant for transport?", snap)
+    assert local.intent == "top_merchant"
+    assert local.data["merchant"] == "Uber" and local.data["amount"] == 45.0
+    assert "for Transport" in local.text
+    # without the category, the landlord's rent is the top spend
+    assert query_engine.answer("Which was my top merchant?", snap).data["merchant"] == "Landlord"
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("spend in may 2024", ("2024-05-01", "2024-05-31")),
+    ("spend on may 3, 2024", ("2024-05-03", "2024-05-03")),
+    ("spend on the 3rd of may", ("2024-05-03", "2024-05-03")),
+    ("how much may i spend", (None, None)),
+])
+def test_parse_period(query, expected):
+    start, end, _ = query_engine.parse_period(query, pd.Timestamp("2024-06-30"))
+    assert tuple(None if d is None else str(d.date()) for d in (start, end)) == expected
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+from app.services import data_store, rollup
+from benchmarks import datagen
+
+
+def _cells(cube: rollup.Cube, grain: str) -> pd.DataFrame:
+    """The cells of grain with their labels, in a canonical order"""
+    level = cube.levels[grain]
+
+    def labels(index: pd.Index, codes: np.ndarray) -> np.ndarray:
+        return np.where(codes >= 0, np.asarray(index, dtype=object)[codes], None)
+
+    cells = pd.DataFrame({"period": level.period, "category": labels(cube.categories, level.category),
+                          "merchant": labels(cube.merchants, level.merchant), "spend": level.spend, "net": level.net})
+    return cells.astype({"category": str, "merchant": str}).sort_values(
+        ["period", "category", "merchant"], ignore_index=True)
+
+
+@pytest.mark.parametrize("end, days, merchants", [
+    ("2025-01-31", 31, 500),   # after the stored rows
+    ("2023-06-30", 60, 500),   # back-dated
+    ("2024-12-31", 1, 50),     # the last stored day again
+    ("2025-01-31", 31, 5_000),  # mostly merchants the first cube has not seen
+])
+def test_merge_matches_a_full_build(end, days, merchants):
+    first = data_store.prepare(datagen.generate(5_000, end="2024-12-31", seed=21))
+    batch = data_store.prepare(datagen.generate(300, end=end, days=days, merchants=merchants, seed=22))
+    merged = rollup.build(first).merge(rollup.build(batch))
+    full = rollup.build(pd.concat([first, batch], ignore_index=True))
+    for grain in rollup.GRAINS:
+        level = merged.levels[grain]
+        assert np.all(np.diff(level.period) >= 0)
+        pd.testing.assert_frame_equal(_cells(merged, grain), _cells(full, grain))
+
+
+def test_merge_with_unsorted_labels():
+    """Labels a cube was built with in no particular order: every period is summed again."""
+    first = data_store.prepare(datagen.generate(2_000, end="2024-12-31", seed=23))
+    first["category"] = first["category"].cat.reorder_categories(first["category"].cat.categories[::-1])
+    batch = data_store.prepare(datagen.generate(200, end="2025-01-31", days=31, seed=24))
+    merged = rollup.build(first).merge(rollup.build(batch))
+    full = rollup.build(pd.concat([first, batch], ignore_index=True))
+    for grain in rollup.GRAINS:
+        pd.testing.assert_frame_equal(_cells(merged, grain), _cells(full, grain))